@@ -1,7 +1,12 @@
 from django.contrib import admin
-from .models import Dataset
+from .models import Dataset, DatasetSummary
 
 @admin.register(Dataset)
 class DatasetAdmin(admin.ModelAdmin):
     list_display = ('id', 'uploaded_at', 'file')
     readonly_fields = ('uploaded_at',)
+
+@admin.register(DatasetSummary)
+class DatasetSummaryAdmin(admin.ModelAdmin):
+    list_display = ('dataset', 'total_equipment_count', 'computed_at')
+    readonly_fields = ('computed_at',)
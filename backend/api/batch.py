@@ -0,0 +1,130 @@
+from concurrent.futures import ProcessPoolExecutor
+from concurrent.futures.process import BrokenProcessPool
+from django.conf import settings
+import os
+import threading
+import zipfile
+from .compression import BLOCK_SIZE
+from .ingest import DatasetError, iter_chunks
+from .stats import StatsAccumulator
+
+_pool = None
+_pool_lock = threading.Lock()
+
+
+def _init_worker():
+    # Started with "spawn"/"forkserver" the worker has no configured settings yet
+    import django
+    os.environ.setdefault('DJANGO_SETTINGS_MODULE', 'config.settings')
+    django.setup()
+
+
+def get_process_pool():
+    """Process pool for batch parsing, created on first use like the upload threads."""
+    global _pool
+    with _pool_lock:
+        if _pool is None:
+            _pool = ProcessPoolExecutor(max_workers=settings.BATCH_WORKERS, initializer=_init_worker)
+    return _pool
+
+
+def _discard_pool(pool):
+    """Drop ``pool`` after a worker died; the next ``get_process_pool()`` starts a new one.
+
+    A broken pool refuses every later submission, so keeping it would fail
+    all batches until the server restarts.
+    """
+    global _pool
+    with _pool_lock:
+        if _pool is pool:
+            _pool = None
+    pool.shutdown(wait=False, cancel_futures=True)
+
+
+def summarize_file(file_path):
+    """Worker entry point: aggregate one CSV and return the accumulator state.
+
+    The JSON-safe state is what crosses the process boundary; the parent
+    rebuilds and merges it.
+    """
+    accumulator = StatsAccumulator()
+    try:
+        for chunk in iter_chunks(file_path):
+            accumulator.update(chunk)
+    except DatasetError:
+        raise
+    except Exception as e:
+        raise DatasetError(f"Error processing CSV: {str(e)}") from e
+    return accumulator.to_dict()
+
+
+def extract_archive(upload, target_dir):
+    """Extract the CSV members of a zip upload and return ``(name, path)`` pairs.
+
+    Members are streamed to disk one at a time; directories and non-CSV
+    members are skipped. The bytes actually written are checked against
+    ``UPLOAD_MAX_DECOMPRESSED_SIZE``, per member and for the whole archive;
+    the sizes in the zip headers are not trusted.
+    """
+    limit = settings.UPLOAD_MAX_DECOMPRESSED_SIZE
+    total = 0
+    try:
+        archive = zipfile.ZipFile(upload)
+    except zipfile.BadZipFile:
+        raise DatasetError(f"{upload.name} is not a valid zip archive.", reason='invalid_archive')
+
+    extracted = []
+    with archive:
+        for index, member in enumerate(archive.infolist()):
+            if member.is_dir() or not member.filename.lower().endswith('.csv'):
+                continue
+            if len(extracted) >= settings.BATCH_MAX_FILES:
+                raise DatasetError(f"A batch may contain at most {settings.BATCH_MAX_FILES} files.",
+                                   reason='too_many_files')
+            file_path = os.path.join(target_dir, f'{index}.csv')
+            written = 0
+            with archive.open(member) as source, open(file_path, 'wb') as target:
+                while block := source.read(BLOCK_SIZE):
+                    written += len(block)
+                    total += len(block)
+                    if limit is not None and max(written, total) > limit:
+                        raise DatasetError(f"{upload.name} expands to more than {limit} bytes when extracted.",
+                                           reason='decompressed_too_large')
+                    target.write(block)
+            extracted.append((member.filename, file_path))
+    return extracted
+
+
+def aggregate_files(files):
+    """Parse ``(name, path)`` pairs in parallel and merge them into one summary.
+
+    Returns the per-file results, in the order given, and the combined stats
+    of every file that could be parsed. Files that fail are reported with
+    their error and left out of the combined summary.
+    """
+    pool = get_process_pool()
+    try:
+        futures = [(name, pool.submit(summarize_file, file_path)) for name, file_path in files]
+    except BrokenProcessPool:
+        # A worker died since the pool was last used
+        _discard_pool(pool)
+        pool = get_process_pool()
+        futures = [(name, pool.submit(summarize_file, file_path)) for name, file_path in files]
+
+    combined = StatsAccumulator()
+    results = []
+    for name, future in futures:
+        try:
+            accumulator = StatsAccumulator.from_dict(future.result())
+        except DatasetError as e:
+            results.append({"name": name, "error": str(e)})
+            continue
+        except BrokenProcessPool:
+            # Killed (out of memory, say) while parsing; this file or another
+            # one in flight is to blame, so report them all and start afresh
+            _discard_pool(pool)
+            results.append({"name": name, "error": "The worker parsing this file stopped unexpectedly."})
+            continue
+        results.append({"name": name, "stats": accumulator.to_stats()})
+        combined.merge(accumulator)
+    return results, combined.to_stats()
@@ -0,0 +1,71 @@
+from django.conf import settings
+from django.core.cache import cache
+from django.http import HttpResponse, HttpResponseNotModified
+from django.utils.http import parse_etags, quote_etag
+from rest_framework import status
+from rest_framework.response import Response
+from rest_framework.renderers import JSONRenderer
+import hashlib
+
+HISTORY_KEY = 'api:history'
+
+
+def stats_key(dataset_id):
+    return f'api:stats:{dataset_id}'
+
+
+def make_etag(*parts):
+    """Strong validator built from the ids and timestamps a response was made from."""
+    return hashlib.sha1('|'.join(map(str, parts)).encode('utf-8')).hexdigest()
+
+
+def cached_response(request, key, build):
+    """Answer a GET from the response cache, or with 304 when the client is current.
+
+    ``build()`` returns ``(etag, data)`` and only runs on a cache miss. Entries
+    are dropped by the Dataset/DatasetSummary signals in ``api.signals``; the
+    timeout bounds staleness in other processes, which never see those signals.
+    """
+    entry = cache.get(key)
+    if entry is None:
+        entry = build()
+        cache.set(key, entry, settings.RESPONSE_CACHE_TIMEOUT)
+    etag, data = entry
+    etag = quote_etag(etag)
+
+    headers = {'ETag': etag, 'Cache-Control': 'no-cache'}
+    if _is_current(request, etag):
+        return Response(status=status.HTTP_304_NOT_MODIFIED, headers=headers)
+    return Response(data, headers=headers)
+
+
+async def acached_response(request, key, build):
+    """``cached_response()`` for async views, where ``build`` is a coroutine function."""
+    entry = await cache.aget(key)
+    if entry is None:
+        entry = await build()
+        await cache.aset(key, entry, settings.RESPONSE_CACHE_TIMEOUT)
+    etag, data = entry
+    etag = quote_etag(etag)
+
+    headers = {'ETag': etag, 'Cache-Control': 'no-cache'}
+    if _is_current(request, etag):
+        return HttpResponseNotModified(headers=headers)
+    return json_response(data, headers=headers)
+
+
+def json_response(data, **kwargs):
+    """JSON response for the plain Django (async) views, rendered like DRF's."""
+    return HttpResponse(JSONRenderer().render(data), content_type='application/json', **kwargs)
+
+
+def _is_current(request, etag):
+    client_etags = parse_etags(request.headers.get('If-None-Match', ''))
+    return '*' in client_etags or etag in client_etags
+
+
+def invalidate(dataset_id=None):
+    keys = [HISTORY_KEY]
+    if dataset_id is not None:
+        keys.append(stats_key(dataset_id))
+    cache.delete_many(keys)
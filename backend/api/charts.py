@@ -0,0 +1,94 @@
+from collections import OrderedDict
+from django.conf import settings
+import io
+import threading
+
+PNG = 'png'
+SVG = 'svg'
+CONTENT_TYPES = {PNG: 'image/png', SVG: 'image/svg+xml'}
+
+# Same palettes as the desktop dashboard
+THEMES = {
+    'dark': {
+        'background': '#050510',
+        'text': 'white',
+        'spine': '#333',
+        'bars': ['#36A2EB', '#FF6384', '#4BC0C0'],
+        'slices': ['#00f3ff', '#bc13fe', '#ff0064', '#ffff00', '#00ff9d'],
+    },
+    'light': {
+        'background': '#f0f2f5',
+        'text': '#1a1a1a',
+        'spine': '#ccc',
+        'bars': ['#0056b3', '#d63384', '#198754'],
+        'slices': ['#36A2EB', '#FF6384', '#FFCE56', '#4BC0C0', '#9966FF'],
+    },
+}
+
+DPI = 100
+
+
+class LRUCache:
+    """Thread-safe mapping that evicts the least recently used entry past ``max_entries``."""
+
+    def __init__(self, max_entries):
+        self.max_entries = max_entries
+        self._entries = OrderedDict()
+        self._lock = threading.Lock()
+
+    def get_or_set(self, key, build):
+        with self._lock:
+            if key in self._entries:
+                self._entries.move_to_end(key)
+                return self._entries[key]
+        value = build()
+        with self._lock:
+            self._entries[key] = value
+            self._entries.move_to_end(key)
+            while len(self._entries) > self.max_entries:
+                self._entries.popitem(last=False)
+        return value
+
+    def __len__(self):
+        return len(self._entries)
+
+
+chart_cache = LRUCache(settings.CHART_CACHE_SIZE)
+# Matplotlib's font and text caches are shared, so renders run one at a time
+_render_lock = threading.Lock()
+
+
+def render_chart(stats, theme='dark', width=1000, height=400, image_format=PNG):
+    """Average-metrics bar chart next to the Type distribution pie, as image bytes.
+
+    Matplotlib is imported here, and only its Agg/SVG canvases are used, so
+    the API starts without it and never needs a display.
+    """
+    from matplotlib.figure import Figure
+
+    colors = THEMES[theme]
+    figure = Figure(figsize=(width / DPI, height / DPI), dpi=DPI)
+    figure.patch.set_facecolor(colors['background'])
+    bars, pie = figure.subplots(1, 2)
+
+    bars.set_facecolor(colors['background'])
+    bars.tick_params(colors=colors['text'])
+    for spine in bars.spines.values():
+        spine.set_color(colors['spine'])
+    bars.bar(['Flow', 'Pressure', 'Temp'],
+             [stats['average_flowrate'], stats['average_pressure'], stats['average_temperature']],
+             color=colors['bars'], alpha=0.8)
+    bars.set_title("Average Metrics", color=colors['text'])
+
+    distribution = stats['equipment_type_distribution']
+    if distribution:
+        pie.pie(list(distribution.values()), labels=list(distribution.keys()), autopct='%1.1f%%',
+                textprops=dict(color=colors['text']), colors=colors['slices'])
+    else:
+        pie.axis('off')
+    pie.set_title("Equipment Distribution", color=colors['text'])
+
+    buffer = io.BytesIO()
+    with _render_lock:
+        figure.savefig(buffer, format=image_format, facecolor=figure.get_facecolor())
+    return buffer.getvalue()
@@ -0,0 +1,258 @@
+"""Chunked, resumable uploads: initiate, PUT numbered chunks, then finalize.
+
+Each chunk is appended to a staging file and parsed while it is read, so the
+statistics and the columnar cache grow with the transfer. Finalizing parses
+only the last record and moves the files into place; storing the summary
+still makes one pass over the columnar cache for the outlier flags (and
+reads every column for exact percentiles). Between requests the parser's
+position and the merged aggregates live on the ``ChunkedUpload`` row. A
+chunk counts as received once that row moves on, so a transfer interrupted
+at any point, including a connection dropped mid-chunk, resumes at
+``next_chunk``; bytes of a chunk that never completed are cut off when it
+is sent again. A chunk may be sent with ``Content-Encoding: gzip``
+(or zstd); it is then decompressed while it is read and staged as CSV.
+"""
+from django.conf import settings
+from django.core.files import locks
+from django.core.files.storage import default_storage
+from django.utils import timezone
+from contextlib import contextmanager
+import os
+from .columnar import ColumnarWriter, columnar_path, remove_columnar
+from .compression import Decompressor
+from .ingest import CSVStreamParser, DatasetError
+from .metrics import stage
+from .models import ChunkedUpload, Dataset
+from .processing import feed_chunks, process_streamed_upload
+from .stats import StatsAccumulator
+from .uploads import STAGING_DIR, StagedUploadedFile
+
+# Request bodies are read in blocks of this size, so memory stays flat per chunk
+READ_SIZE = 1 << 20
+# Errors in how a chunk was sent rather than in the CSV; the chunk can be resent
+CHUNK_ERRORS = {'incomplete_chunk', 'invalid_compression', 'decompressed_too_large', 'unsupported_encoding'}
+
+
+class UploadConflict(Exception):
+    """The chunk does not continue the upload, or the upload no longer accepts chunks."""
+
+
+def staged_path(upload):
+    return default_storage.path(f'{STAGING_DIR}/{upload.pk.hex}.csv')
+
+
+@contextmanager
+def _locked(upload):
+    """Hold the upload's staging file exclusively and yield it with a fresh row.
+
+    Two requests for the same upload (a client retrying a chunk it thinks was
+    lost) are serialized here; the state is re-read once the lock is held.
+    """
+    pk, path = upload.pk, staged_path(upload)
+    os.makedirs(os.path.dirname(path), exist_ok=True)
+    with open(os.open(path, os.O_RDWR | os.O_CREAT, 0o666), 'r+b') as handle:
+        locks.lock(handle, locks.LOCK_EX)
+        try:
+            try:
+                upload.refresh_from_db()
+            except ChunkedUpload.DoesNotExist:
+                raise UploadConflict("The upload was discarded.")
+            yield handle
+        finally:
+            # Opening the file creates it; only an upload still receiving keeps one
+            if not ChunkedUpload.objects.filter(pk=pk, status=ChunkedUpload.RECEIVING).exists():
+                discard_files(path)
+            locks.unlock(handle)
+
+
+def _restore(upload):
+    parser = CSVStreamParser.resume(
+        bytes(upload.header) if upload.header is not None else None, bytes(upload.pending), upload.odd_quotes
+    )
+    accumulator = StatsAccumulator.from_dict(upload.aggregates) if upload.aggregates else StatsAccumulator()
+    return parser, accumulator, _columnar_writer(upload)
+
+
+def _columnar_writer(upload):
+    if not settings.DATASET_COLUMNAR_CACHE:
+        return None
+    path = staged_path(upload)
+    if upload.next_chunk == 0:
+        # Leftovers of a first chunk whose state was never saved
+        remove_columnar(path)
+        return ColumnarWriter(columnar_path(path))
+    if not os.path.isdir(columnar_path(path)):
+        return None
+    writer = ColumnarWriter.extend(columnar_path(path))
+    if writer.rows == upload.rows:
+        return writer
+    # The cache got ahead of the saved state (a chunk was written but its row
+    # update never landed); the dataset rebuilds it from the CSV on first use
+    writer.abort()
+    remove_columnar(path)
+    return None
+
+
+def _read_blocks(stream, length):
+    remaining = length
+    while remaining > 0:
+        try:
+            block = stream.read(min(READ_SIZE, remaining)) if stream is not None else b''
+        except Exception as e:
+            # A dropped connection (UnreadablePostError, OSError, ...) loses
+            # only this chunk; the client sends it again
+            raise DatasetError(f"The chunk could not be read: {e}", reason='incomplete_chunk') from e
+        if not block:
+            raise DatasetError("The chunk ended before its Content-Length.", reason='incomplete_chunk')
+        remaining -= len(block)
+        yield block
+
+
+def receive_chunk(upload, index, stream, length, compression=None):
+    """Append chunk ``index`` of ``length`` bytes read from ``stream``.
+
+    ``compression`` (``api.compression.GZIP`` or ``ZSTD``) decompresses the
+    body first; ``length`` is then its compressed size. Returns False when
+    the chunk had already been received (a retry), True once it is stored
+    and parsed. Raises ``UploadConflict`` for a chunk out of order, and
+    ``DatasetError`` when the body is cut short or the CSV is invalid; the
+    latter also fails the upload.
+    """
+    with _locked(upload) as handle:
+        if upload.status != ChunkedUpload.RECEIVING:
+            raise UploadConflict(f"The upload is {upload.status}.")
+        if index < upload.next_chunk:
+            return False
+        if index > upload.next_chunk:
+            raise UploadConflict(f"Expected chunk {upload.next_chunk}.")
+
+        handle.truncate(upload.bytes_received)
+        handle.seek(upload.bytes_received)
+        parser, accumulator, writer = _restore(upload)
+
+        def consume(block):
+            handle.write(block)
+            with stage('parse'):
+                chunks = parser.feed(block)
+            feed_chunks(chunks, accumulator, writer)
+
+        try:
+            decompressor = None
+            if compression:
+                decompressor = Decompressor(compression, consume, settings.UPLOAD_CHUNK_MAX_SIZE)
+            for block in _read_blocks(stream, length):
+                if decompressor:
+                    decompressor.write(block)
+                else:
+                    consume(block)
+            if decompressor:
+                decompressor.close()
+            with stage('parse'):
+                chunks = parser.flush()
+            feed_chunks(chunks, accumulator, writer)
+        except DatasetError as e:
+            if writer:
+                writer.abort()
+            # A broken body is simply sent again; invalid CSV fails the upload
+            if e.reason not in CHUNK_ERRORS:
+                _fail(upload, e)
+            raise
+        except Exception as e:
+            if writer:
+                writer.abort()
+            raise _fail(upload, DatasetError(f"Error processing CSV: {str(e)}")) from e
+
+        if writer:
+            writer.close()
+        header, pending, odd_quotes = parser.state
+        ChunkedUpload.objects.filter(pk=upload.pk).update(
+            next_chunk=index + 1,
+            bytes_received=handle.tell(),
+            rows=writer.rows if writer else 0,
+            header=header,
+            pending=pending,
+            odd_quotes=odd_quotes,
+            aggregates=accumulator.to_dict(),
+            updated_at=timezone.now(),
+        )
+        upload.refresh_from_db()
+        return True
+
+
+def finalize_upload(upload, percentiles=None):
+    """Turn a fully received upload into a Dataset and return its stats.
+
+    Only the last record (if it had no trailing newline) is left to parse;
+    the staged CSV and columnar cache are moved into place. Saving the
+    summary scans the columnar cache once for the outlier flags, and reads
+    every column when exact percentiles are asked for. Finalizing an
+    upload that is already complete returns the stored stats again.
+    """
+    with _locked(upload):
+        if upload.status == ChunkedUpload.COMPLETE and upload.dataset_id:
+            return Dataset.objects.select_related('summary').get(pk=upload.dataset_id).summary.to_stats()
+        if upload.status != ChunkedUpload.RECEIVING:
+            raise UploadConflict(f"The upload is {upload.status}.")
+
+        path = staged_path(upload)
+        parser, accumulator, writer = _restore(upload)
+        try:
+            with stage('parse'):
+                chunks = parser.close()
+            feed_chunks(chunks, accumulator, writer)
+        except DatasetError as e:
+            if writer:
+                writer.abort()
+            _fail(upload, e)
+            raise
+        except Exception as e:
+            if writer:
+                writer.abort()
+            raise _fail(upload, DatasetError(f"Error processing CSV: {str(e)}")) from e
+        if writer:
+            writer.close()
+
+        staged = StagedUploadedFile(path, upload.filename, 'text/csv', upload.bytes_received, None, mode='rb')
+        staged.accumulator = accumulator
+        if os.path.isdir(columnar_path(path)):
+            staged.columnar_staging = columnar_path(path)
+        # Saving moves the staged CSV into storage; no bytes are copied
+        dataset = Dataset(file=staged)
+        try:
+            dataset.save()
+            stats = process_streamed_upload(dataset, staged, percentiles=percentiles)
+        except Exception as e:
+            if dataset.pk:
+                dataset.delete()
+            if isinstance(e, DatasetError):
+                _fail(upload, e)
+                raise
+            raise _fail(upload, DatasetError(f"Error processing CSV: {str(e)}")) from e
+        finally:
+            staged.close()
+        ChunkedUpload.objects.filter(pk=upload.pk).update(
+            status=ChunkedUpload.COMPLETE, dataset=dataset, pending=b'', aggregates={}, updated_at=timezone.now()
+        )
+        upload.refresh_from_db()
+        return stats
+
+
+def discard_upload(upload):
+    """Delete ``upload`` and its staged files, waiting for a chunk in progress."""
+    with _locked(upload):
+        upload.delete()
+
+
+def _fail(upload, error):
+    # The staged files go when the lock is released (see _locked)
+    ChunkedUpload.objects.filter(pk=upload.pk).update(
+        status=ChunkedUpload.FAILED, error=str(error), pending=b'', aggregates={}, updated_at=timezone.now()
+    )
+    return error
+
+
+def discard_files(path):
+    """Remove a staged CSV and its columnar cache."""
+    remove_columnar(path)
+    if os.path.exists(path):
+        os.remove(path)
@@ -0,0 +1,266 @@
+import json
+import os
+import shutil
+import threading
+import numpy as np
+import pandas as pd
+from .ingest import METRIC_COLUMNS, iter_chunks
+
+# Binary column files live in a directory next to the uploaded CSV
+COLUMNAR_SUFFIX = '.cols'
+FORMAT_VERSION = 1
+
+# One raw little-endian file per column; Equipment Name is stored Arrow-style
+# as a UTF-8 byte blob plus an int64 offsets array (rows + 1 entries)
+METRIC_FILES = {column: f'{column.lower()}.f64' for column in METRIC_COLUMNS}
+TYPE_FILE = 'type.i32'
+NAME_OFFSETS_FILE = 'name.off'
+NAME_DATA_FILE = 'name.dat'
+META_FILE = 'meta.json'
+# Bit flags from the default outlier thresholds, written by api.outliers
+OUTLIER_FLAGS_FILE = 'outliers.u1'
+
+
+def columnar_path(file_path):
+    return f'{file_path}{COLUMNAR_SUFFIX}'
+
+
+def remove_columnar(file_path):
+    shutil.rmtree(columnar_path(file_path), ignore_errors=True)
+
+
+def temp_path(path):
+    """Sibling of ``path`` to write into before ``os.replace`` moves it in place.
+
+    Unique to the process and thread, so concurrent builds of the same file
+    (say two requests filling in a missing cache) never touch each other's
+    output.
+    """
+    return f'{path}.{os.getpid()}.{threading.get_ident()}.tmp'
+
+
+class ColumnarWriter:
+    """Appends parsed chunks to a columnar cache directory.
+
+    A new cache is written to a temporary sibling directory that is renamed
+    into place by ``close()``, so readers never see a half-written cache;
+    when a concurrent build of the same file got there first, its cache is
+    kept and this one discarded.
+    ``ColumnarWriter.extend()`` instead grows an existing cache in place:
+    the row count in meta.json only moves forward on ``close()``, and
+    ``abort()`` truncates every file back to where it started.
+    """
+
+    DATA_FILES = [*METRIC_FILES.values(), TYPE_FILE, NAME_OFFSETS_FILE, NAME_DATA_FILE]
+
+    def __init__(self, path):
+        self.path = path
+        self.tmp_path = temp_path(path)
+        shutil.rmtree(self.tmp_path, ignore_errors=True)
+        os.makedirs(self.tmp_path)
+
+        self.rows = 0
+        self.categories = {}
+        self._name_end = 0
+        self._start_sizes = None
+        self._files = {name: open(os.path.join(self.tmp_path, name), 'ab') for name in self.DATA_FILES}
+        np.zeros(1, dtype='<i8').tofile(self._files[NAME_OFFSETS_FILE])
+
+    @classmethod
+    def extend(cls, path):
+        """Writer that appends rows to the existing cache at ``path``."""
+        writer = cls.__new__(cls)
+        writer.path = writer.tmp_path = path
+        with open(os.path.join(path, META_FILE)) as handle:
+            meta = json.load(handle)
+        writer.rows = meta['rows']
+        writer.categories = {label: code for code, label in enumerate(meta['categories'])}
+
+        # Sizes implied by the committed row count; anything past them is a
+        # leftover from an earlier aborted append and is cut off first
+        writer._start_sizes = {name: writer.rows * 8 for name in METRIC_FILES.values()}
+        writer._start_sizes[TYPE_FILE] = writer.rows * 4
+        writer._start_sizes[NAME_OFFSETS_FILE] = (writer.rows + 1) * 8
+        offsets = np.memmap(os.path.join(path, NAME_OFFSETS_FILE), dtype='<i8', mode='r',
+                            shape=(writer.rows + 1,))
+        writer._name_end = int(offsets[-1])
+        del offsets
+        writer._start_sizes[NAME_DATA_FILE] = writer._name_end
+
+        writer._files = {}
+        for name in cls.DATA_FILES:
+            handle = open(os.path.join(path, name), 'r+b')
+            handle.truncate(writer._start_sizes[name])
+            handle.seek(0, os.SEEK_END)
+            writer._files[name] = handle
+        return writer
+
+    def append(self, chunk):
+        if chunk.empty:
+            return
+
+        for column, name in METRIC_FILES.items():
+            chunk[column].to_numpy(dtype='<f8').tofile(self._files[name])
+
+        # Chunk-local category codes are remapped onto one code table for the whole file
+        types = chunk['Type'].astype('category')
+        local_to_global = np.array(
+            [self.categories.setdefault(value, len(self.categories)) for value in types.cat.categories],
+            dtype='<i4',
+        )
+        local_codes = types.cat.codes.to_numpy()
+        codes = np.full(len(local_codes), -1, dtype='<i4')
+        present = local_codes >= 0
+        codes[present] = local_to_global[local_codes[present]]
+        codes.tofile(self._files[TYPE_FILE])
+
+        encoded = [name.encode('utf-8') for name in chunk['Equipment Name'].fillna('')]
+        lengths = np.fromiter(map(len, encoded), dtype='<i8', count=len(encoded))
+        (self._name_end + np.cumsum(lengths)).astype('<i8').tofile(self._files[NAME_OFFSETS_FILE])
+        self._files[NAME_DATA_FILE].write(b''.join(encoded))
+        self._name_end += int(lengths.sum())
+
+        self.rows += len(chunk)
+
+    def close(self):
+        for handle in self._files.values():
+            handle.close()
+        meta = {
+            'version': FORMAT_VERSION,
+            'rows': self.rows,
+            'categories': list(self.categories),
+        }
+        meta_path = os.path.join(self.tmp_path, META_FILE)
+        meta_tmp_path = temp_path(meta_path)
+        with open(meta_tmp_path, 'w') as handle:
+            json.dump(meta, handle)
+        os.replace(meta_tmp_path, meta_path)
+
+        if self._start_sizes is None:
+            try:
+                os.replace(self.tmp_path, self.path)
+            except OSError:
+                if not os.path.isdir(self.path):
+                    raise
+                # Readers may already be mapping the files of the cache in place
+                shutil.rmtree(self.tmp_path, ignore_errors=True)
+        else:
+            # Sort orders and outlier flags describe the old rows only
+            for name in os.listdir(self.path):
+                if name.startswith('order.') or name == OUTLIER_FLAGS_FILE:
+                    os.remove(os.path.join(self.path, name))
+
+    def abort(self):
+        for handle in self._files.values():
+            handle.close()
+        if self._start_sizes is None:
+            shutil.rmtree(self.tmp_path, ignore_errors=True)
+        else:
+            for name, size in self._start_sizes.items():
+                os.truncate(os.path.join(self.path, name), size)
+
+
+class ColumnarDataset:
+    """Read-only, memory-mapped view of a columnar cache directory."""
+
+    def __init__(self, path):
+        self.path = path
+        with open(os.path.join(path, META_FILE)) as handle:
+            meta = json.load(handle)
+        if meta.get('version') != FORMAT_VERSION:
+            raise ValueError(f"Unsupported columnar cache version: {meta.get('version')}")
+        self.rows = meta['rows']
+        self.categories = meta['categories']
+        self._maps = {}
+
+    def __len__(self):
+        return self.rows
+
+    def _map(self, name, dtype, length):
+        if name not in self._maps:
+            if length == 0:
+                self._maps[name] = np.empty(0, dtype=dtype)
+            else:
+                self._maps[name] = np.memmap(os.path.join(self.path, name), dtype=dtype,
+                                             mode='r', shape=(length,))
+        return self._maps[name]
+
+    def metric(self, column):
+        return self._map(METRIC_FILES[column], '<f8', self.rows)
+
+    @property
+    def type_codes(self):
+        return self._map(TYPE_FILE, '<i4', self.rows)
+
+    def names(self, indices):
+        offsets = self._map(NAME_OFFSETS_FILE, '<i8', self.rows + 1)
+        data = self._map(NAME_DATA_FILE, 'u1', int(offsets[-1]))
+        return [bytes(data[offsets[i]:offsets[i + 1]]).decode('utf-8') for i in indices]
+
+    def types(self, indices):
+        codes = self.type_codes[indices]
+        return [self.categories[code] if code >= 0 else None for code in codes]
+
+    def outlier_flags(self):
+        """Stored per-row outlier bits, or None if they were never computed."""
+        if not os.path.exists(os.path.join(self.path, OUTLIER_FLAGS_FILE)):
+            return None
+        return self._map(OUTLIER_FLAGS_FILE, 'u1', self.rows)
+
+    def sort_index(self, column):
+        """Stable ascending row order by ``column`` ('Type' or a metric).
+
+        Computed with one argsort on first use and stored in the cache
+        directory, so later sorted reads only memory-map it.
+        """
+        name = f'order.{column.lower()}.i64'
+        file_path = os.path.join(self.path, name)
+        if name not in self._maps and not os.path.exists(file_path):
+            if column == 'Type':
+                # Order by label, not by code; missing types sort last
+                label_rank = np.argsort(np.argsort(self.categories, kind='stable')).astype('<i4')
+                keys = np.append(label_rank, len(self.categories))[self.type_codes]
+            else:
+                keys = self.metric(column)
+            tmp_path = temp_path(file_path)
+            np.argsort(keys, kind='stable').astype('<i8').tofile(tmp_path)
+            os.replace(tmp_path, file_path)
+        return self._map(name, '<i8', self.rows)
+
+    def metric_frames(self, block_rows=1_000_000):
+        """Type and metric columns (no names) in DataFrame blocks of ``block_rows``."""
+        for start in range(0, self.rows, block_rows):
+            block = slice(start, min(start + block_rows, self.rows))
+            frame = pd.DataFrame({
+                'Type': pd.Categorical.from_codes(self.type_codes[block], categories=self.categories),
+            })
+            for column in METRIC_COLUMNS:
+                frame[column] = self.metric(column)[block]
+            yield frame
+
+    def to_frame(self, indices=None):
+        """Materialise the given rows (all rows when None) as a DataFrame."""
+        if indices is None:
+            indices = np.arange(self.rows)
+        indices = np.asarray(indices, dtype=np.int64)
+        frame = pd.DataFrame({
+            'Equipment Name': self.names(indices),
+            'Type': pd.Categorical.from_codes(self.type_codes[indices], categories=self.categories),
+        })
+        for column in METRIC_COLUMNS:
+            frame[column] = self.metric(column)[indices]
+        return frame
+
+
+def build_columnar(file_path):
+    """Convert a CSV into its columnar cache and return a reader for it."""
+    path = columnar_path(file_path)
+    writer = ColumnarWriter(path)
+    try:
+        for chunk in iter_chunks(file_path):
+            writer.append(chunk)
+    except BaseException:
+        writer.abort()
+        raise
+    writer.close()
+    return ColumnarDataset(path)
@@ -0,0 +1,208 @@
+"""Streaming decompression of compressed uploads.
+
+Files named ``*.gz`` or ``*.zst`` (e.g. ``equipment.csv.gz``) and request
+bodies sent with ``Content-Encoding: gzip`` or ``zstd`` are decompressed
+block by block on their way into the CSV parser; no uncompressed copy is
+written. Compressed files are stored as they were uploaded and decompressed
+again whenever the CSV is read. zstd needs the optional ``zstandard`` package.
+"""
+from django.conf import settings
+import gzip
+import io
+import os
+import zlib
+from .ingest import DatasetError
+
+try:
+    import zstandard
+except ImportError: # pragma: no cover - zstd support is optional
+    zstandard = None
+
+GZIP = 'gzip'
+ZSTD = 'zstd'
+
+SUFFIXES = {'.gz': GZIP, '.zst': ZSTD}
+ENCODINGS = {'gzip': GZIP, 'x-gzip': GZIP, 'zstd': ZSTD}
+
+# Largest piece of decompressed output handed on at once, and how much of a
+# stored compressed file is read per step
+BLOCK_SIZE = 1 << 20
+READ_SIZE = 1 << 16
+
+
+def compression_for_name(name):
+    """``GZIP``, ``ZSTD`` or None, from a file name's last suffix."""
+    return SUFFIXES.get(os.path.splitext(str(name).lower())[1])
+
+
+def compression_for_encoding(value):
+    """``GZIP``, ``ZSTD`` or None for a Content-Encoding header value."""
+    value = (value or '').strip().lower()
+    if value in ('', 'identity'):
+        return None
+    if value not in ENCODINGS:
+        raise DatasetError(f"Unsupported Content-Encoding: {value}. Use gzip or zstd.",
+                           reason='unsupported_encoding')
+    return ENCODINGS[value]
+
+
+class Decompressor:
+    """Decompresses a gzip or zstd stream pushed to it in pieces.
+
+    ``write(data)`` passes the decompressed bytes on to ``sink`` in blocks of
+    at most BLOCK_SIZE, so input that expands a lot never sits in memory at
+    once. Concatenated gzip members and zstd frames form one stream. More than
+    ``limit`` decompressed bytes, or bytes that do not decompress, raise a
+    DatasetError; ``close()`` also raises when a gzip stream was cut short.
+    """
+
+    def __init__(self, compression, sink, limit=None):
+        if compression == ZSTD and zstandard is None:
+            raise DatasetError("zstd compressed uploads need the zstandard package on the server.",
+                               reason='unsupported_encoding')
+        self.compression = compression
+        self.sink = sink
+        self.limit = limit
+        self.size = 0
+        self._member = None
+        if compression == ZSTD:
+            self._zstd = zstandard.ZstdDecompressor().stream_writer(
+                _Sink(self._emit), write_size=BLOCK_SIZE, closefd=False
+            )
+
+    def write(self, data):
+        try:
+            if self.compression == GZIP:
+                self._write_gzip(data)
+            else:
+                self._zstd.write(data)
+        except (zlib.error, *((zstandard.ZstdError,) if zstandard else ())) as e:
+            raise DatasetError(f"The upload is not valid {self.compression} data: {e}",
+                               reason='invalid_compression') from e
+
+    def close(self):
+        if self.compression == ZSTD:
+            self._zstd.flush()
+            return
+        if self._member is not None:
+            self._emit(self._member.flush())
+            if not self._member.eof:
+                raise DatasetError("The gzip data ends before the end of the compressed stream.",
+                                   reason='invalid_compression')
+
+    def _write_gzip(self, data):
+        while data:
+            if self._member is None:
+                self._member = zlib.decompressobj(16 + zlib.MAX_WBITS)
+            self._emit(self._member.decompress(data, BLOCK_SIZE))
+            if self._member.eof:
+                data = self._member.unused_data
+                self._member = None
+            else:
+                data = self._member.unconsumed_tail
+
+    def _emit(self, block):
+        if not block:
+            return
+        self.size += len(block)
+        if self.limit is not None and self.size > self.limit:
+            raise DatasetError(f"The upload expands to more than {self.limit} bytes when decompressed.",
+                               reason='decompressed_too_large')
+        self.sink(block)
+
+
+class _Sink:
+    # zstandard's stream writer hands its output to an object with write()
+
+    def __init__(self, emit):
+        self.emit = emit
+
+    def write(self, data):
+        self.emit(bytes(data))
+        return len(data)
+
+
+class DecompressedFile(io.RawIOBase):
+    """Read-only view of the decompressed bytes of the binary file ``raw``.
+
+    Seeking only supports rewinding to the start, which restarts the
+    decompression; ``raw`` itself is read in order, so it may also be a
+    request body. Use ``open_decompressed()`` for a buffered reader.
+    """
+
+    def __init__(self, raw, compression, limit=None):
+        self.raw = raw
+        self.compression = compression
+        self.limit = limit
+        self._start()
+
+    def _start(self):
+        self._pending = bytearray()
+        self._position = 0
+        self._eof = False
+        self._decompressor = Decompressor(self.compression, self._pending.extend, self.limit)
+
+    def readable(self):
+        return True
+
+    def seekable(self):
+        return True
+
+    def readinto(self, buffer):
+        while len(self._pending) < len(buffer) and not self._eof:
+            data = self.raw.read(READ_SIZE)
+            if data:
+                self._decompressor.write(data)
+            else:
+                self._decompressor.close()
+                self._eof = True
+        size = min(len(buffer), len(self._pending))
+        buffer[:size] = self._pending[:size]
+        del self._pending[:size]
+        self._position += size
+        return size
+
+    def seek(self, offset, whence=io.SEEK_SET):
+        if whence == io.SEEK_CUR and offset == 0:
+            return self._position
+        if whence == io.SEEK_SET and offset == 0:
+            self.raw.seek(0)
+            self._start()
+            return 0
+        raise io.UnsupportedOperation("compressed files can only be rewound")
+
+    def tell(self):
+        return self._position
+
+
+def open_decompressed(raw, compression, limit=None):
+    """Buffered binary reader over the decompressed bytes of ``raw``."""
+    return io.BufferedReader(DecompressedFile(raw, compression, limit), BLOCK_SIZE)
+
+
+def open_compressor(target, compression):
+    """Writable that appends to ``target`` as one new gzip member or zstd frame.
+
+    Closing it finishes the member or frame but leaves ``target`` open.
+    """
+    if compression == GZIP:
+        return gzip.GzipFile(fileobj=target, mode='wb')
+    if zstandard is None:
+        raise DatasetError("zstd compressed datasets need the zstandard package on the server.",
+                           reason='unsupported_encoding')
+    return zstandard.ZstdCompressor().stream_writer(target, closefd=False)
+
+
+def decompress_request_body(request):
+    """Decompress the body of a request sent with ``Content-Encoding`` on the fly.
+
+    Must run before the body is read; uploaded files then arrive as plain
+    CSV. Raises a DatasetError for an unsupported encoding.
+    """
+    compression = compression_for_encoding(request.META.get('HTTP_CONTENT_ENCODING'))
+    if compression:
+        # DRF's Request wraps Django's, whose read() goes through _stream
+        http_request = getattr(request, '_request', request)
+        http_request._stream = open_decompressed(http_request._stream, compression,
+                                                 settings.UPLOAD_MAX_DECOMPRESSED_SIZE)
+    return compression
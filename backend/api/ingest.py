@@ -0,0 +1,251 @@
+from contextlib import ExitStack, contextmanager
+from django.conf import settings
+import csv
+import io
+import os
+import numpy as np
+import pandas as pd
+from pandas._libs.parsers import STR_NA_VALUES
+from .metrics import bytes_read, rows_parsed
+
+try:
+    import pyarrow as pa
+    import pyarrow.csv as pa_csv
+except ImportError: # pragma: no cover - pyarrow is an optional speed-up
+    pa = pa_csv = None
+
+REQUIRED_COLUMNS = {'Equipment Name', 'Type', 'Flowrate', 'Pressure', 'Temperature'}
+METRIC_COLUMNS = ('Flowrate', 'Pressure', 'Temperature')
+# Column order used for every parsed chunk, whatever order the file uses
+COLUMNS = ['Equipment Name', 'Type', *METRIC_COLUMNS]
+COLUMN_DTYPES = {
+    'Equipment Name': str,
+    'Type': 'category',
+    'Flowrate': 'float64',
+    'Pressure': 'float64',
+    'Temperature': 'float64',
+}
+# pandas' default NA markers, so every engine reads the same cells as missing
+NA_VALUES = sorted(STR_NA_VALUES)
+
+
+class DatasetError(ValueError):
+    """Raised when an uploaded CSV cannot be turned into statistics.
+
+    ``reason`` is a short machine-readable label used for the rejection metrics.
+    """
+
+    def __init__(self, message, reason='parse_error'):
+        super().__init__(message)
+        self.reason = reason
+
+
+def read_header(handle):
+    """Return the column names on the first line of a binary CSV handle.
+
+    The handle is rewound afterwards so the body can be parsed from the start.
+    """
+    first_line = handle.readline()
+    handle.seek(0)
+    text = first_line.decode('utf-8-sig', errors='replace')
+    return next(csv.reader(io.StringIO(text)), [])
+
+
+def validate_header(columns):
+    if not REQUIRED_COLUMNS.issubset(columns):
+        raise DatasetError(f"Missing columns. Required: {REQUIRED_COLUMNS}", reason='missing_columns')
+
+
+def resolve_engine(engine=None):
+    engine = engine or settings.CSV_ENGINE
+    if engine == 'auto':
+        return 'pyarrow' if pa_csv is not None else 'c'
+    return engine
+
+
+@contextmanager
+def open_source(source):
+    """Binary handles for a path or an already open (seekable) file object.
+
+    Yields ``(handle, raw)``: ``raw`` is the file itself and ``handle`` reads
+    the CSV, decompressing it on the fly when the name ends in ``.gz`` or
+    ``.zst`` (see api.compression), so progress is measured on ``raw``.
+    """
+    # api.compression imports this module
+    from .compression import compression_for_name, open_decompressed
+    compression = compression_for_name(getattr(source, 'name', source))
+    with ExitStack() as stack:
+        if hasattr(source, 'read'):
+            raw = source
+            raw.seek(0)
+        else:
+            raw = stack.enter_context(open(source, 'rb'))
+        if compression:
+            yield stack.enter_context(
+                open_decompressed(raw, compression, settings.UPLOAD_MAX_DECOMPRESSED_SIZE)
+            ), raw
+        else:
+            yield raw, raw
+
+
+def iter_chunks(source, chunksize=None, engine=None, progress=None):
+    """Yield typed DataFrame chunks holding only the required columns.
+
+    ``source`` is a path or a seekable binary file object such as an
+    UploadedFile. The header is checked before any of the body is read, so a
+    file with missing columns is rejected without parsing it. ``progress`` is
+    called after every chunk with the fraction of bytes consumed.
+    """
+    chunksize = chunksize or settings.CSV_CHUNK_SIZE
+    engine = resolve_engine(engine)
+
+    with open_source(source) as (handle, raw):
+        size = raw.seek(0, os.SEEK_END) or 1
+        raw.seek(0)
+        validate_header(read_header(handle))
+
+        if engine == 'pyarrow':
+            chunks = _pyarrow_chunks(handle, chunksize)
+        else:
+            chunks = pd.read_csv(handle, usecols=COLUMNS, dtype=COLUMN_DTYPES,
+                                 engine=engine, chunksize=chunksize)
+
+        try:
+            for chunk in chunks:
+                rows_parsed.inc(len(chunk))
+                yield chunk[COLUMNS]
+                if progress:
+                    progress(min(raw.tell() / size, 1.0))
+        finally:
+            bytes_read.inc(handle.tell())
+
+
+def _block_size(chunksize):
+    # Byte-oriented readers assume ~64 bytes per row so a block holds roughly
+    # ``chunksize`` rows
+    return max(chunksize * 64, 1 << 20)
+
+
+def _pyarrow_convert_options():
+    return pa_csv.ConvertOptions(
+        include_columns=COLUMNS,
+        column_types={
+            'Equipment Name': pa.string(),
+            'Type': pa.dictionary(pa.int32(), pa.string()),
+            'Flowrate': pa.float64(),
+            'Pressure': pa.float64(),
+            'Temperature': pa.float64(),
+        },
+        # Without these an empty or 'NA' Type becomes a category of its own,
+        # where the pandas engines count it as missing
+        null_values=NA_VALUES,
+        strings_can_be_null=True,
+    )
+
+
+def _pyarrow_chunks(handle, chunksize):
+    reader = pa_csv.open_csv(
+        handle,
+        read_options=pa_csv.ReadOptions(block_size=_block_size(chunksize)),
+        convert_options=_pyarrow_convert_options(),
+    )
+    for batch in reader:
+        yield batch.to_pandas()
+
+
+class CSVStreamParser:
+    """Push parser: ``feed()`` raw bytes as they arrive, get typed chunks back.
+
+    Incoming bytes are cut at the last record terminator that is not inside a
+    quoted field (a newline where the count of ``"`` since the last cut is
+    even), so a record split across network reads is never parsed in halves.
+    Complete records are buffered until about ``chunksize`` rows' worth of
+    bytes is available, then parsed in one go with the configured engine,
+    yielding the same chunks ``iter_chunks()`` would.
+    """
+
+    def __init__(self, chunksize=None, engine=None):
+        self.chunksize = chunksize or settings.CSV_CHUNK_SIZE
+        self.engine = resolve_engine(engine)
+        self.header = None
+        self._block_size = _block_size(self.chunksize)
+        self._records = []
+        self._buffered = 0
+        self._pending = b''
+        self._odd_quotes = False
+
+    def feed(self, data):
+        """Consume ``data`` and return the chunks that became complete."""
+        if not data:
+            return []
+        bytes_read.inc(len(data))
+        raw = np.frombuffer(data, dtype=np.uint8)
+        odd = (np.cumsum(raw == ord('"')) + self._odd_quotes) & 1 == 1
+        ends = np.flatnonzero((raw == ord('\n')) & ~odd)
+        if not ends.size:
+            self._pending += data
+            self._odd_quotes = bool(odd[-1])
+            return []
+
+        cut = int(ends[-1]) + 1
+        complete, self._pending = self._pending + data[:cut], data[cut:]
+        self._odd_quotes = bool(odd[-1])
+        if self.header is None:
+            complete = self._read_header(complete)
+        self._records.append(complete)
+        self._buffered += len(complete)
+        if self._buffered < self._block_size:
+            return []
+        return self._flush()
+
+    @classmethod
+    def resume(cls, header, pending, odd_quotes, **kwargs):
+        """Parser continuing a stream whose earlier bytes went to another parser.
+
+        The arguments are that parser's ``state`` after a ``flush()``.
+        """
+        parser = cls(**kwargs)
+        parser.header, parser._pending, parser._odd_quotes = header, pending, odd_quotes
+        return parser
+
+    @property
+    def state(self):
+        """``(header, pending, odd_quotes)``: the header line, the unfinished
+        last record and whether it is inside a quoted field."""
+        return self.header, self._pending, self._odd_quotes
+
+    def flush(self):
+        """Parse every complete record buffered so far; the unfinished one stays pending."""
+        return self._flush()
+
+    def close(self):
+        """Parse whatever is left, including a last record without a newline."""
+        if self._pending.strip():
+            if self.header is None:
+                self._pending = self._read_header(self._pending + b'\n')
+            self._records.append(self._pending)
+        self._pending = b''
+        if self.header is None:
+            raise DatasetError(f"Missing columns. Required: {REQUIRED_COLUMNS}", reason='missing_columns')
+        return self._flush()
+
+    def _read_header(self, data):
+        line, _, body = data.partition(b'\n')
+        line = line.removeprefix(b'\xef\xbb\xbf')
+        columns = next(csv.reader(io.StringIO(line.decode('utf-8', errors='replace'))), [])
+        validate_header(columns)
+        self.header = line + b'\n'
+        return body
+
+    def _flush(self):
+        body = b''.join(self._records)
+        self._records, self._buffered = [], 0
+        if not body.strip():
+            return []
+        source = io.BytesIO(self.header + body)
+        if self.engine == 'pyarrow':
+            frame = pa_csv.read_csv(source, convert_options=_pyarrow_convert_options()).to_pandas()
+        else:
+            frame = pd.read_csv(source, usecols=COLUMNS, dtype=COLUMN_DTYPES, engine=self.engine)
+        rows_parsed.inc(len(frame))
+        return [frame[COLUMNS]]
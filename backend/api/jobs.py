@@ -0,0 +1,93 @@
+from concurrent.futures import ThreadPoolExecutor
+from django.conf import settings
+from django.db import close_old_connections, transaction
+from django.utils import timezone
+import asyncio
+import contextvars
+import functools
+import logging
+import threading
+from .metrics import track_upload, upload_rejections
+from .models import UploadJob
+from .processing import process_dataset
+from .ingest import DatasetError
+
+logger = logging.getLogger(__name__)
+
+_executor = None
+_executor_lock = threading.Lock()
+
+
+def get_executor():
+    # Created lazily so management commands and migrations never spawn threads
+    global _executor
+    with _executor_lock:
+        if _executor is None:
+            _executor = ThreadPoolExecutor(max_workers=settings.UPLOAD_WORKERS,
+                                           thread_name_prefix='upload-worker')
+    return _executor
+
+
+async def run_in_worker(func, *args, **kwargs):
+    """Await blocking ``func`` on the worker pool, keeping the event loop free.
+
+    The caller's context variables (the upload's stage timings) carry over,
+    and the worker's database connection is released afterwards.
+    """
+    call = functools.partial(contextvars.copy_context().run, _call_in_worker, func, *args, **kwargs)
+    return await asyncio.get_running_loop().run_in_executor(get_executor(), call)
+
+
+def _call_in_worker(func, *args, **kwargs):
+    try:
+        return func(*args, **kwargs)
+    finally:
+        close_old_connections()
+
+
+def enqueue_upload_job(dataset, percentiles=None):
+    """Create a job for ``dataset`` and hand it to the worker pool once committed."""
+    job = UploadJob.objects.create(dataset=dataset)
+    transaction.on_commit(lambda: get_executor().submit(run_upload_job, job.pk, percentiles))
+    return job
+
+
+def completed_upload_job(dataset):
+    """A job already done for ``dataset``, for an async upload answered from a stored summary."""
+    return UploadJob.objects.create(dataset=dataset, status=UploadJob.DONE, progress=1)
+
+
+def _update_job(job_id, **fields):
+    # Queryset updates only touch the given columns, even after the dataset is deleted
+    UploadJob.objects.filter(pk=job_id).update(updated_at=timezone.now(), **fields)
+
+
+def run_upload_job(job_id, percentiles=None):
+    close_old_connections()
+    try:
+        job = UploadJob.objects.select_related('dataset').get(pk=job_id)
+        if job.dataset is None:
+            # Pruned or deleted while the job was queued (the FK is SET_NULL)
+            _update_job(job_id, status=UploadJob.FAILED,
+                        error="The dataset was removed before it could be processed.")
+            return
+        _update_job(job_id, status=UploadJob.RUNNING)
+
+        def report(fraction):
+            _update_job(job_id, progress=round(fraction, 4))
+
+        with track_upload('upload_job') as timings:
+            timings.fields['job'] = str(job_id)
+            try:
+                process_dataset(job.dataset, progress=report, percentiles=percentiles)
+            except DatasetError as e:
+                upload_rejections.inc(reason=e.reason)
+                timings.fields['rejected'] = e.reason
+                _update_job(job_id, status=UploadJob.FAILED, error=str(e))
+            else:
+                _update_job(job_id, status=UploadJob.DONE, progress=1.0)
+    except Exception:
+        logger.exception("Upload job %s crashed", job_id)
+        _update_job(job_id, status=UploadJob.FAILED, error="Internal error")
+    finally:
+        close_old_connections()
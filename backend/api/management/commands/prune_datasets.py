@@ -0,0 +1,15 @@
+from django.core.management.base import BaseCommand
+from api.retention import prune_chunked_uploads, prune_datasets, prune_summaries
+
+
+class Command(BaseCommand):
+    help = ("Apply the DATASET_RETENTION and SUMMARY_RETENTION policies and discard stale "
+            "chunked uploads, e.g. from cron for time-based expiry.")
+
+    def handle(self, *args, **options):
+        pruned = prune_datasets()
+        self.stdout.write(f"Pruned {pruned} dataset(s)")
+        pruned = prune_summaries()
+        self.stdout.write(f"Pruned {pruned} summary(ies)")
+        pruned = prune_chunked_uploads()
+        self.stdout.write(f"Discarded {pruned} stale chunked upload(s)")
@@ -0,0 +1,226 @@
+from contextlib import contextmanager
+from django.conf import settings
+import contextvars
+import json
+import logging
+import math
+import threading
+import time
+
+timing_logger = logging.getLogger('api.timing')
+
+
+def _label_key(labels):
+    return tuple(sorted(labels.items()))
+
+
+def _format_labels(key):
+    if not key:
+        return ''
+    return '{' + ','.join(f'{name}="{_escape(value)}"' for name, value in key) + '}'
+
+
+def _escape(value):
+    return str(value).replace('\\', '\\\\').replace('"', '\\"').replace('\n', '\\n')
+
+
+def _format_value(value):
+    if value == math.inf:
+        return '+Inf'
+    return repr(float(value)) if isinstance(value, float) else str(value)
+
+
+class Counter:
+    """Process-local, thread-safe, monotonically increasing counter.
+
+    Keyword arguments to ``inc()`` are Prometheus labels; ``value`` is the
+    total over every label set.
+    """
+
+    kind = 'counter'
+
+    def __init__(self, name, documentation):
+        self.name = name
+        self.documentation = documentation
+        self._values = {}
+        self._lock = threading.Lock()
+
+    def inc(self, amount=1, **labels):
+        key = _label_key(labels)
+        with self._lock:
+            self._values[key] = self._values.get(key, 0) + amount
+
+    @property
+    def value(self):
+        with self._lock:
+            return sum(self._values.values())
+
+    def get(self, **labels):
+        with self._lock:
+            return self._values.get(_label_key(labels), 0)
+
+    def samples(self):
+        with self._lock:
+            return [(self.name, key, value) for key, value in self._values.items()]
+
+
+class Histogram:
+    """Process-local histogram with cumulative buckets, as Prometheus expects."""
+
+    kind = 'histogram'
+    DEFAULT_BUCKETS = (0.005, 0.01, 0.025, 0.05, 0.1, 0.25, 0.5, 1, 2.5, 5, 10, 30, 60)
+
+    def __init__(self, name, documentation, buckets=None):
+        self.name = name
+        self.documentation = documentation
+        self.buckets = tuple(sorted(buckets or self.DEFAULT_BUCKETS)) + (math.inf,)
+        self._series = {}
+        self._lock = threading.Lock()
+
+    def observe(self, value, **labels):
+        key = _label_key(labels)
+        with self._lock:
+            series = self._series.setdefault(key, {'buckets': [0] * len(self.buckets), 'sum': 0.0, 'count': 0})
+            for i, bound in enumerate(self.buckets):
+                if value <= bound:
+                    series['buckets'][i] += 1
+            series['sum'] += value
+            series['count'] += 1
+
+    def count(self, **labels):
+        with self._lock:
+            return self._series.get(_label_key(labels), {}).get('count', 0)
+
+    def total(self, **labels):
+        with self._lock:
+            return self._series.get(_label_key(labels), {}).get('sum', 0.0)
+
+    def label_values(self, name):
+        with self._lock:
+            return sorted({dict(key)[name] for key in self._series if name in dict(key)})
+
+    def samples(self):
+        result = []
+        with self._lock:
+            for key, series in self._series.items():
+                for bound, count in zip(self.buckets, series['buckets']):
+                    result.append((f'{self.name}_bucket', key + (('le', _format_value(bound)),), count))
+                result.append((f'{self.name}_sum', key, series['sum']))
+                result.append((f'{self.name}_count', key, series['count']))
+        return result
+
+
+REGISTRY = {}
+
+
+def counter(name, documentation):
+    """Return the counter registered under ``name``, creating it on first use."""
+    if name not in REGISTRY:
+        REGISTRY[name] = Counter(name, documentation)
+    return REGISTRY[name]
+
+
+def histogram(name, documentation, buckets=None):
+    """Return the histogram registered under ``name``, creating it on first use."""
+    if name not in REGISTRY:
+        REGISTRY[name] = Histogram(name, documentation, buckets)
+    return REGISTRY[name]
+
+
+def render_text():
+    """Every registered metric in the Prometheus text exposition format."""
+    lines = []
+    for metric in REGISTRY.values():
+        lines.append(f'# HELP {metric.name} {metric.documentation}')
+        lines.append(f'# TYPE {metric.name} {metric.kind}')
+        for name, key, value in metric.samples():
+            lines.append(f'{name}{_format_labels(key)} {_format_value(value)}')
+    return '\n'.join(lines) + '\n'
+
+
+upload_cache_hits = counter('upload_cache_hits_total', 'Uploads answered from the content-hash cache')
+upload_cache_misses = counter('upload_cache_misses_total', 'Uploads whose content had not been processed before')
+upload_rejections = counter('upload_rejections_total', 'Uploads and appends answered with 400, by reason')
+rows_parsed = counter('csv_rows_parsed_total', 'CSV rows parsed into chunks')
+bytes_read = counter('csv_bytes_read_total', 'CSV bytes consumed by the parsers')
+stage_seconds = histogram('upload_stage_seconds', 'Wall time per upload stage, summed over chunks')
+request_seconds = histogram('upload_request_seconds', 'Wall time of upload requests and jobs')
+upload_size = histogram('upload_size_bytes', 'Size of uploaded CSV files',
+                        buckets=[1 << shift for shift in range(10, 34, 2)])
+
+
+_current_timings = contextvars.ContextVar('upload_timings', default=None)
+
+
+class StageTimings:
+    """Wall time per stage for one upload request or job.
+
+    Stages may nest (``receive`` contains the parsing done while the body
+    streams in) and a stage entered once per chunk is summed. ``fields`` is
+    extra context for the structured timing log line.
+    """
+
+    def __init__(self, operation):
+        self.operation = operation
+        self.stages = {}
+        self.fields = {}
+        self.started = time.perf_counter()
+
+    def add(self, name, seconds):
+        self.stages[name] = self.stages.get(name, 0.0) + seconds
+
+
+@contextmanager
+def stage(name):
+    """Time a block as upload stage ``name``.
+
+    Inside ``track_upload()`` the time is added to the request's timings and
+    observed once when it ends; elsewhere it is observed directly.
+    """
+    started = time.perf_counter()
+    try:
+        yield
+    finally:
+        elapsed = time.perf_counter() - started
+        timings = _current_timings.get()
+        if timings is None:
+            stage_seconds.observe(elapsed, stage=name)
+        else:
+            timings.add(name, elapsed)
+
+
+def timed_chunks(chunks, name='parse'):
+    """Yield from ``chunks``, timing the production of each one as stage ``name``."""
+    iterator = iter(chunks)
+    while True:
+        with stage(name):
+            chunk = next(iterator, None)
+        if chunk is None:
+            return
+        yield chunk
+
+
+@contextmanager
+def track_upload(operation):
+    """Collect the stage timings of one upload request or job.
+
+    On exit each stage and the total are observed, and with
+    UPLOAD_TIMING_LOGS on one JSON line is logged to ``api.timing``.
+    """
+    timings = StageTimings(operation)
+    token = _current_timings.set(timings)
+    try:
+        yield timings
+    finally:
+        _current_timings.reset(token)
+        total = time.perf_counter() - timings.started
+        for name, seconds in timings.stages.items():
+            stage_seconds.observe(seconds, stage=name)
+        request_seconds.observe(total, operation=operation)
+        if settings.UPLOAD_TIMING_LOGS:
+            timing_logger.info(json.dumps({
+                "operation": operation,
+                "seconds": round(total, 6),
+                "stages": {name: round(seconds, 6) for name, seconds in timings.stages.items()},
+                **timings.fields
+            }))
@@ -0,0 +1,25 @@
+from django.db import migrations, models
+import django.db.models.deletion
+
+
+class Migration(migrations.Migration):
+
+    dependencies = [
+        ('api', '0001_initial'),
+    ]
+
+    operations = [
+        migrations.CreateModel(
+            name='DatasetSummary',
+            fields=[
+                ('id', models.BigAutoField(auto_created=True, primary_key=True, serialize=False, verbose_name='ID')),
+                ('total_equipment_count', models.PositiveIntegerField(default=0)),
+                ('average_flowrate', models.FloatField(default=0)),
+                ('average_pressure', models.FloatField(default=0)),
+                ('average_temperature', models.FloatField(default=0)),
+                ('equipment_type_distribution', models.JSONField(default=dict)),
+                ('computed_at', models.DateTimeField(auto_now=True)),
+                ('dataset', models.OneToOneField(on_delete=django.db.models.deletion.CASCADE, related_name='summary', to='api.dataset')),
+            ],
+        ),
+    ]
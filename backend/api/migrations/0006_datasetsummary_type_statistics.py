@@ -0,0 +1,21 @@
+from django.db import migrations, models
+
+
+class Migration(migrations.Migration):
+
+    dependencies = [
+        ('api', '0005_dataset_retention'),
+    ]
+
+    operations = [
+        migrations.AddField(
+            model_name='datasetsummary',
+            name='type_statistics',
+            field=models.JSONField(default=dict),
+        ),
+        migrations.AddField(
+            model_name='datasetsummary',
+            name='percentile_mode',
+            field=models.CharField(default='approximate', max_length=12),
+        ),
+    ]
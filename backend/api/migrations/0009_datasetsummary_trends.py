@@ -0,0 +1,37 @@
+import os
+from django.db import migrations, models
+import django.db.models.deletion
+
+
+def copy_dataset_fields(apps, schema_editor):
+    DatasetSummary = apps.get_model('api', 'DatasetSummary')
+    for summary in DatasetSummary.objects.select_related('dataset').filter(dataset__isnull=False):
+        summary.dataset_name = os.path.basename(summary.dataset.file.name)
+        summary.uploaded_at = summary.dataset.uploaded_at
+        summary.save(update_fields=['dataset_name', 'uploaded_at'])
+
+
+class Migration(migrations.Migration):
+
+    dependencies = [
+        ('api', '0008_datasetsummary_aggregates'),
+    ]
+
+    operations = [
+        migrations.AlterField(
+            model_name='datasetsummary',
+            name='dataset',
+            field=models.OneToOneField(blank=True, null=True, on_delete=django.db.models.deletion.SET_NULL, related_name='summary', to='api.dataset'),
+        ),
+        migrations.AddField(
+            model_name='datasetsummary',
+            name='dataset_name',
+            field=models.CharField(blank=True, max_length=255),
+        ),
+        migrations.AddField(
+            model_name='datasetsummary',
+            name='uploaded_at',
+            field=models.DateTimeField(db_index=True, null=True),
+        ),
+        migrations.RunPython(copy_dataset_fields, migrations.RunPython.noop),
+    ]
@@ -0,0 +1,32 @@
+from django.db import migrations, models
+import django.db.models.deletion
+import uuid
+
+
+class Migration(migrations.Migration):
+
+    dependencies = [
+        ('api', '0009_datasetsummary_trends'),
+    ]
+
+    operations = [
+        migrations.CreateModel(
+            name='ChunkedUpload',
+            fields=[
+                ('id', models.UUIDField(default=uuid.uuid4, editable=False, primary_key=True, serialize=False)),
+                ('filename', models.CharField(max_length=255)),
+                ('status', models.CharField(choices=[('receiving', 'Receiving'), ('complete', 'Complete'), ('failed', 'Failed')], default='receiving', max_length=10)),
+                ('next_chunk', models.PositiveIntegerField(default=0)),
+                ('bytes_received', models.BigIntegerField(default=0)),
+                ('rows', models.BigIntegerField(default=0)),
+                ('header', models.BinaryField(null=True)),
+                ('pending', models.BinaryField(default=bytes)),
+                ('odd_quotes', models.BooleanField(default=False)),
+                ('aggregates', models.JSONField(default=dict)),
+                ('error', models.TextField(blank=True)),
+                ('created_at', models.DateTimeField(auto_now_add=True)),
+                ('updated_at', models.DateTimeField(auto_now=True, db_index=True)),
+                ('dataset', models.ForeignKey(blank=True, null=True, on_delete=django.db.models.deletion.SET_NULL, related_name='chunked_uploads', to='api.dataset')),
+            ],
+        ),
+    ]
@@ -0,0 +1,16 @@
+from django.db import migrations, models
+
+
+class Migration(migrations.Migration):
+
+    dependencies = [
+        ('api', '0010_chunkedupload'),
+    ]
+
+    operations = [
+        migrations.AddField(
+            model_name='dataset',
+            name='head_hash',
+            field=models.CharField(blank=True, db_index=True, max_length=64),
+        ),
+    ]
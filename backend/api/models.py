@@ -1,25 +1,158 @@
 from django.db import models
 import os
+import uuid
+from .columnar import ColumnarDataset, build_columnar, columnar_path, remove_columnar
+from .metrics import stage
 
 class Dataset(models.Model):
     file = models.FileField(upload_to='datasets/')
-    uploaded_at = models.DateTimeField(auto_now_add=True)
+    uploaded_at = models.DateTimeField(auto_now_add=True, db_index=True)
+    # Kept on the row so the byte-budget retention policy never has to stat files
+    file_size = models.BigIntegerField(default=0)
+    # SHA-256 of the uploaded bytes, used to answer repeated uploads from the stored summary
+    content_hash = models.CharField(max_length=64, blank=True, db_index=True)
+    # SHA-256 of the first DEDUP_HEAD_SIZE bytes, known early enough to hold off the streamed parse
+    head_hash = models.CharField(max_length=64, blank=True, db_index=True)
+
+    @property
+    def columnar_path(self):
+        return columnar_path(self.file.path)
+
+    def columnar(self):
+        """Memory-mapped columns of this dataset, converting the CSV on first use."""
+        if os.path.isdir(self.columnar_path):
+            return ColumnarDataset(self.columnar_path)
+        return build_columnar(self.file.path)
 
     def delete(self, *args, **kwargs):
-        # Clean up file on delete
+        # Clean up file and its columnar cache on delete
         if self.file:
             if os.path.isfile(self.file.path):
                 os.remove(self.file.path)
+            remove_columnar(self.file.path)
         super().delete(*args, **kwargs)
 
     def save(self, *args, **kwargs):
-        super().save(*args, **kwargs)
-        # Keep only 5 most recent datasets
-        # We order by uploaded_at descending (newest first)
-        datasets = Dataset.objects.all().order_by('-uploaded_at')
-        if datasets.count() > 5:
-            for dataset in datasets[5:]:
-                dataset.delete()
+        adding = self._state.adding
+        if adding and self.file:
+            self.file_size = self.file.size
+        with stage('store'):
+            super().save(*args, **kwargs)
+        # Apply the retention policy once per new upload (see DATASET_RETENTION)
+        if adding:
+            from .retention import prune_datasets
+            with stage('retention'):
+                prune_datasets()
 
     def __str__(self):
         return f"Dataset {self.id} uploaded at {self.uploaded_at}"
+
+
+class DatasetSummary(models.Model):
+    """Statistics computed at upload time, so old datasets never need re-parsing.
+
+    Summaries outlive their dataset (``dataset`` is cleared when it is pruned)
+    so trends can span more uploads than are kept on disk; they have their own
+    retention policy, ``SUMMARY_RETENTION``.
+    """
+    dataset = models.OneToOneField(Dataset, on_delete=models.SET_NULL, null=True, blank=True,
+                                   related_name='summary')
+    # Copied from the dataset so the summary stands on its own once it is pruned
+    dataset_name = models.CharField(max_length=255, blank=True)
+    uploaded_at = models.DateTimeField(null=True, db_index=True)
+    total_equipment_count = models.PositiveIntegerField(default=0)
+    average_flowrate = models.FloatField(default=0)
+    average_pressure = models.FloatField(default=0)
+    average_temperature = models.FloatField(default=0)
+    equipment_type_distribution = models.JSONField(default=dict)
+    # Per-Type mean/min/max/std and p50/p95/p99 for each metric
+    type_statistics = models.JSONField(default=dict)
+    percentile_mode = models.CharField(max_length=12, default='approximate')
+    # Per-Type mean/std/quartiles used to flag outliers; internal, not part of to_stats()
+    outlier_baselines = models.JSONField(default=dict)
+    # Serialized StatsAccumulator (sums, counts, moments, sketches) that appends merge into
+    aggregates = models.JSONField(default=dict)
+    computed_at = models.DateTimeField(auto_now=True)
+
+    def to_stats(self):
+        return {
+            "total_equipment_count": self.total_equipment_count,
+            "average_flowrate": self.average_flowrate,
+            "average_pressure": self.average_pressure,
+            "average_temperature": self.average_temperature,
+            "equipment_type_distribution": self.equipment_type_distribution,
+            "type_statistics": self.type_statistics,
+            "percentile_mode": self.percentile_mode
+        }
+
+    def save(self, *args, **kwargs):
+        if self._state.adding and self.dataset is not None:
+            self.dataset_name = self.dataset_name or os.path.basename(self.dataset.file.name)
+            self.uploaded_at = self.uploaded_at or self.dataset.uploaded_at
+        super().save(*args, **kwargs)
+
+    def __str__(self):
+        return f"Summary of dataset {self.dataset_id}"
+
+
+class UploadJob(models.Model):
+    """Tracks a dataset being processed on the background worker pool."""
+    PENDING = 'pending'
+    RUNNING = 'running'
+    DONE = 'done'
+    FAILED = 'failed'
+    STATUS_CHOICES = [
+        (PENDING, 'Pending'),
+        (RUNNING, 'Running'),
+        (DONE, 'Done'),
+        (FAILED, 'Failed'),
+    ]
+
+    id = models.UUIDField(primary_key=True, default=uuid.uuid4, editable=False)
+    dataset = models.ForeignKey(Dataset, on_delete=models.SET_NULL, null=True, related_name='jobs')
+    status = models.CharField(max_length=10, choices=STATUS_CHOICES, default=PENDING)
+    progress = models.FloatField(default=0)
+    error = models.TextField(blank=True)
+    created_at = models.DateTimeField(auto_now_add=True)
+    updated_at = models.DateTimeField(auto_now=True)
+
+    def __str__(self):
+        return f"Upload job {self.id} ({self.status})"
+
+
+class ChunkedUpload(models.Model):
+    """A chunked, resumable upload in progress (see ``api.chunked``).
+
+    Between chunk requests the row holds everything needed to continue: how
+    far the staged file got and the stream parser's position in it, and the
+    statistics merged from the rows parsed so far.
+    """
+    RECEIVING = 'receiving'
+    COMPLETE = 'complete'
+    FAILED = 'failed'
+    STATUS_CHOICES = [
+        (RECEIVING, 'Receiving'),
+        (COMPLETE, 'Complete'),
+        (FAILED, 'Failed'),
+    ]
+
+    id = models.UUIDField(primary_key=True, default=uuid.uuid4, editable=False)
+    filename = models.CharField(max_length=255)
+    status = models.CharField(max_length=10, choices=STATUS_CHOICES, default=RECEIVING)
+    next_chunk = models.PositiveIntegerField(default=0)
+    bytes_received = models.BigIntegerField(default=0)
+    # Rows in the staged columnar cache
+    rows = models.BigIntegerField(default=0)
+    # CSVStreamParser state: header line, unfinished last record, open quote
+    header = models.BinaryField(null=True)
+    pending = models.BinaryField(default=bytes)
+    odd_quotes = models.BooleanField(default=False)
+    aggregates = models.JSONField(default=dict)
+    error = models.TextField(blank=True)
+    dataset = models.ForeignKey(Dataset, on_delete=models.SET_NULL, null=True, blank=True,
+                                related_name='chunked_uploads')
+    created_at = models.DateTimeField(auto_now_add=True)
+    updated_at = models.DateTimeField(auto_now=True, db_index=True)
+
+    def __str__(self):
+        return f"Chunked upload {self.id} ({self.status})"
@@ -0,0 +1,132 @@
+from django.conf import settings
+import os
+import numpy as np
+import pandas as pd
+from .columnar import OUTLIER_FLAGS_FILE, temp_path
+from .ingest import METRIC_COLUMNS
+from .stats import QUARTILES, exact_type_percentiles
+
+ZSCORE = 'zscore'
+IQR = 'iqr'
+METHODS = (ZSCORE, IQR)
+
+# Rows flagged per vectorised step when precomputing the stored flags
+FLAG_BLOCK = 1 << 20
+
+
+def default_threshold(method):
+    return settings.OUTLIER_ZSCORE_THRESHOLD if method == ZSCORE else settings.OUTLIER_IQR_MULTIPLIER
+
+
+def flag_bit(method, column):
+    # Bits 0-2 hold the z-score flags of each metric, bits 3-5 the IQR flags
+    return 1 << (METRIC_COLUMNS.index(column) + (0 if method == ZSCORE else len(METRIC_COLUMNS)))
+
+
+def type_bounds(baselines, categories, method, threshold):
+    """Per-metric (lower, upper) arrays indexed by Type code.
+
+    The extra last slot catches rows without a Type (code -1); like any type
+    without a usable baseline it gets infinite bounds and is never flagged.
+    """
+    bounds = {}
+    for column in METRIC_COLUMNS:
+        lower = np.full(len(categories) + 1, -np.inf)
+        upper = np.full(len(categories) + 1, np.inf)
+        for code, equipment_type in enumerate(categories):
+            baseline = baselines.get(equipment_type, {}).get(column)
+            if not baseline:
+                continue
+            if method == ZSCORE:
+                if baseline['std']:
+                    lower[code] = baseline['mean'] - threshold * baseline['std']
+                    upper[code] = baseline['mean'] + threshold * baseline['std']
+            elif baseline['q1'] is not None and baseline['q3'] is not None:
+                spread = baseline['q3'] - baseline['q1']
+                lower[code] = baseline['q1'] - threshold * spread
+                upper[code] = baseline['q3'] + threshold * spread
+        bounds[column] = (lower, upper)
+    return bounds
+
+
+class OutlierDetector:
+    """Flags rows outside their Type's baseline, reading only memory-mapped columns.
+
+    With the default threshold the per-row bits stored at upload are used;
+    any other threshold is evaluated against the stored baselines on the fly.
+    """
+
+    def __init__(self, columns, baselines, method=ZSCORE, threshold=None, metrics=None):
+        self.columns = columns
+        self.method = method
+        self.threshold = default_threshold(method) if threshold is None else threshold
+        self.metrics = metrics or METRIC_COLUMNS
+
+        self.stored = None
+        if self.threshold == default_threshold(method):
+            self.stored = columns.outlier_flags()
+        if self.stored is None:
+            self.bounds = type_bounds(baselines, columns.categories, method, self.threshold)
+
+    def flags(self, indices):
+        """Boolean outlier mask per metric for the given row indices."""
+        if self.stored is not None:
+            bits = self.stored[indices]
+            return {column: (bits & flag_bit(self.method, column)) != 0 for column in self.metrics}
+
+        codes = self.columns.type_codes[indices]
+        result = {}
+        for column in self.metrics:
+            lower, upper = self.bounds[column]
+            values = self.columns.metric(column)[indices]
+            # NaN compares False both ways, so blank readings are never flagged
+            result[column] = (values < lower[codes]) | (values > upper[codes])
+        return result
+
+    def matches(self, indices):
+        mask = np.zeros(len(indices), dtype=bool)
+        for flagged in self.flags(indices).values():
+            mask |= flagged
+        return mask
+
+
+def store_outlier_flags(columns, baselines):
+    """Precompute the default-threshold flags of every row into the columnar cache."""
+    bounds = {method: type_bounds(baselines, columns.categories, method, default_threshold(method))
+              for method in METHODS}
+    file_path = os.path.join(columns.path, OUTLIER_FLAGS_FILE)
+    tmp_path = temp_path(file_path)
+    with open(tmp_path, 'wb') as handle:
+        for start in range(0, len(columns), FLAG_BLOCK):
+            block = slice(start, min(start + FLAG_BLOCK, len(columns)))
+            codes = columns.type_codes[block]
+            bits = np.zeros(len(codes), dtype='u1')
+            for method, method_bounds in bounds.items():
+                for column, (lower, upper) in method_bounds.items():
+                    values = columns.metric(column)[block]
+                    flagged = (values < lower[codes]) | (values > upper[codes])
+                    bits[flagged] |= flag_bit(method, column)
+            bits.tofile(handle)
+    os.replace(tmp_path, file_path)
+
+
+def baselines_from_columns(columns):
+    """Exact baselines for datasets processed before baselines were stored."""
+    frame = pd.DataFrame({column: np.asarray(columns.metric(column)) for column in METRIC_COLUMNS})
+    frame['Type'] = pd.Categorical.from_codes(np.asarray(columns.type_codes), categories=columns.categories)
+    moments = frame.groupby('Type', observed=True)[list(METRIC_COLUMNS)].agg(['mean', 'std'])
+    quartiles = exact_type_percentiles(columns)
+
+    baselines = {}
+    for equipment_type, row in moments.iterrows():
+        baselines[equipment_type] = {}
+        for column in METRIC_COLUMNS:
+            mean, std = row[(column, 'mean')], row[(column, 'std')]
+            q1, q3 = (quartiles.get(equipment_type, {}).get(column, {}).get(q) for q in QUARTILES)
+            baselines[equipment_type][column] = {
+                "mean": None if pd.isna(mean) else float(mean),
+                "std": None if pd.isna(std) else float(std),
+                "q1": q1,
+                "q3": q3,
+            }
+    return baselines
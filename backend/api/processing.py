@@ -0,0 +1,186 @@
+from django.conf import settings
+from django.db import transaction
+import os
+import shutil
+from .columnar import ColumnarDataset, ColumnarWriter, remove_columnar
+from .compression import compression_for_name, open_compressor
+from .ingest import DatasetError, iter_chunks, open_source, read_header
+from .metrics import stage, timed_chunks
+from .models import DatasetSummary
+from .outliers import store_outlier_flags
+from .stats import EXACT, StatsAccumulator, exact_type_percentiles
+
+
+def feed_chunks(chunks, accumulator, writer=None):
+    """Fold parsed chunks into ``accumulator`` and ``writer``, timing each stage."""
+    for chunk in timed_chunks(chunks):
+        with stage('aggregate'):
+            accumulator.update(chunk)
+        if writer:
+            with stage('columnar'):
+                writer.append(chunk)
+
+
+def process_dataset(dataset, progress=None, percentiles=None):
+    """Aggregate a stored dataset's CSV and persist its summary.
+
+    The same pass also writes the columnar cache next to the upload (when
+    DATASET_COLUMNAR_CACHE is on), so later reads never re-tokenize the CSV.
+    ``percentiles`` picks the per-Type percentile mode and defaults to
+    STATS_PERCENTILE_MODE. A file that cannot be processed is deleted together
+    with its Dataset row and the failure is re-raised as a DatasetError
+    carrying the client message.
+    """
+    accumulator = StatsAccumulator()
+    writer = ColumnarWriter(dataset.columnar_path) if settings.DATASET_COLUMNAR_CACHE else None
+    try:
+        feed_chunks(iter_chunks(dataset.file.path, progress=progress), accumulator, writer)
+    except DatasetError:
+        if writer:
+            writer.abort()
+        dataset.delete() # Invalid file, don't keep it
+        raise
+    except Exception as e:
+        if writer:
+            writer.abort()
+        dataset.delete() # Error processing, don't keep
+        raise DatasetError(f"Error processing CSV: {str(e)}") from e
+
+    if writer:
+        writer.close()
+    return _save_summary(dataset, accumulator, percentiles)
+
+
+def process_streamed_upload(dataset, upload, percentiles=None):
+    """Persist the summary of an upload parsed by ``StreamingStatsUploadHandler``.
+
+    The statistics were accumulated while the bytes arrived, so only the
+    staged columnar cache has to be moved next to the stored file. Errors
+    are handled like in ``process_dataset()``.
+    """
+    if upload.error is not None:
+        dataset.delete()
+        raise upload.error
+    if upload.columnar_staging:
+        shutil.rmtree(dataset.columnar_path, ignore_errors=True)
+        os.replace(upload.columnar_staging, dataset.columnar_path)
+        upload.columnar_staging = None
+    return _save_summary(dataset, upload.accumulator, percentiles)
+
+
+def _save_summary(dataset, accumulator, percentiles=None):
+    with stage('summary'):
+        return _create_summary(dataset, accumulator, percentiles)
+
+
+def _create_summary(dataset, accumulator, percentiles):
+    exact = None
+    if (percentiles or settings.STATS_PERCENTILE_MODE) == EXACT:
+        exact = exact_type_percentiles(dataset.columnar())
+    stats = accumulator.to_stats(exact)
+
+    # Baselines are fixed at upload; the default-threshold flags are stored with the columns
+    baselines = accumulator.grouped.baselines(exact)
+    if os.path.isdir(dataset.columnar_path):
+        store_outlier_flags(ColumnarDataset(dataset.columnar_path), baselines)
+    DatasetSummary.objects.create(dataset=dataset, outlier_baselines=baselines,
+                                  aggregates=accumulator.to_dict(), **stats)
+    return stats
+
+
+def _stored_accumulator(dataset, summary):
+    if summary.aggregates:
+        return StatsAccumulator.from_dict(summary.aggregates)
+    # Summaries from before aggregates were stored are rebuilt once, preferably
+    # from the columnar cache rather than the CSV
+    accumulator = StatsAccumulator()
+    if settings.DATASET_COLUMNAR_CACHE:
+        frames = dataset.columnar().metric_frames()
+    else:
+        frames = iter_chunks(dataset.file.path)
+    for frame in frames:
+        accumulator.update(frame)
+    return accumulator
+
+
+def append_to_dataset(dataset, upload):
+    """Merge the rows of ``upload`` into an existing dataset and return its new stats.
+
+    Only the new rows are parsed. They are folded into the stored aggregates
+    and appended to the CSV and the columnar cache, so the cost grows with the
+    appended rows, not with the dataset. Exact percentiles cannot be merged,
+    so the summary falls back to the approximate mode. If anything fails
+    before the transaction commits, the CSV and the cache are cut back to
+    the rows the stored summary describes.
+    """
+    with open_source(dataset.file.path) as (handle, _), open_source(upload) as (body, _):
+        if read_header(body) != read_header(handle):
+            raise DatasetError("Appended rows must use the same header as the dataset.",
+                               reason='header_mismatch')
+
+    writer = None
+    csv_size = None
+    closed = False
+    try:
+        with transaction.atomic():
+            summary = DatasetSummary.objects.select_for_update().get(dataset=dataset)
+            accumulator = _stored_accumulator(dataset, summary)
+
+            added = StatsAccumulator()
+            if os.path.isdir(dataset.columnar_path):
+                writer = ColumnarWriter.extend(dataset.columnar_path)
+            csv_size = os.path.getsize(dataset.file.path)
+            feed_chunks(iter_chunks(upload), added, writer)
+
+            # The header matches, so the body bytes can be appended verbatim
+            compression = compression_for_name(dataset.file.path)
+            with open(dataset.file.path, 'r+b') as target, open_source(upload) as (body, _):
+                body.readline()
+                if compression:
+                    # One more gzip member or zstd frame. The last byte of the
+                    # stored CSV is unknown without decompressing all of it, so
+                    # a line break always comes first; parsers skip empty lines
+                    target.seek(0, os.SEEK_END)
+                    with open_compressor(target, compression) as output:
+                        output.write(b'\n')
+                        shutil.copyfileobj(body, output)
+                else:
+                    if csv_size:
+                        target.seek(-1, os.SEEK_END)
+                        if target.read(1) != b'\n':
+                            target.write(b'\n')
+                    target.seek(0, os.SEEK_END)
+                    shutil.copyfileobj(body, target)
+
+            accumulator.merge(added)
+            stats = accumulator.to_stats()
+            for field, value in stats.items():
+                setattr(summary, field, value)
+            summary.outlier_baselines = accumulator.grouped.baselines()
+            summary.aggregates = accumulator.to_dict()
+            summary.save()
+
+            # The bytes changed, so the old hashes no longer identify this content
+            dataset.file_size = os.path.getsize(dataset.file.path)
+            dataset.content_hash = ''
+            dataset.head_hash = ''
+            dataset.save(update_fields=['file_size', 'content_hash', 'head_hash'])
+
+            # Last, while the summary row is still locked against other appends
+            if writer:
+                writer.close()
+                closed = True
+    except Exception as e:
+        # Nothing was committed, so the files go back to the rows the summary describes
+        if closed:
+            # meta.json already counts the new rows; the cache is rebuilt on next use
+            remove_columnar(dataset.file.path)
+        elif writer:
+            writer.abort()
+        if csv_size is not None:
+            os.truncate(dataset.file.path, csv_size)
+        if isinstance(e, (DatasetError, DatasetSummary.DoesNotExist)):
+            raise
+        raise DatasetError(f"Error processing CSV: {str(e)}") from e
+
+    return dict(stats, appended_rows=added.rows)
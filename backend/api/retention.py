@@ -0,0 +1,118 @@
+from datetime import timedelta
+from django.conf import settings
+from django.core.files.storage import default_storage
+from django.db import transaction
+from django.db.models import F, Q, Sum, Window
+from django.db.models.functions import RowNumber
+from django.utils import timezone
+import logging
+from .columnar import remove_columnar
+from .jobs import get_executor
+from .models import ChunkedUpload, Dataset, DatasetSummary
+
+logger = logging.getLogger(__name__)
+
+
+def _expired(queryset, policy, size_field=None):
+    """Rows of ``queryset`` outside ``policy``, newest always kept.
+
+    Each row is ranked newest-first together with the running total of bytes
+    kept up to and including it, so all three limits are evaluated in a
+    single query.
+    """
+    newest_first = [F('uploaded_at').desc(), F('pk').desc()]
+    ranked = queryset.annotate(rank=Window(RowNumber(), order_by=newest_first))
+
+    expired = Q()
+    if policy.get('MAX_COUNT'):
+        expired |= Q(rank__gt=policy['MAX_COUNT'])
+    if policy.get('MAX_AGE_DAYS'):
+        expired |= Q(uploaded_at__lt=timezone.now() - timedelta(days=policy['MAX_AGE_DAYS']))
+    if policy.get('MAX_BYTES') and size_field:
+        ranked = ranked.annotate(kept_bytes=Window(Sum(size_field), order_by=newest_first))
+        expired |= Q(kept_bytes__gt=policy['MAX_BYTES'])
+    if not expired:
+        return queryset.none()
+    return ranked.filter(expired, rank__gt=1)
+
+
+def expired_datasets(policy=None):
+    """Queryset of datasets that fall outside the retention policy.
+
+    Every dataset is ranked, including the upload whose save triggered the
+    prune, but only processed ones (those with a summary) are returned, so an
+    upload still being parsed, here or by a job, is never pruned from under
+    itself.
+    """
+    ranked = _expired(Dataset.objects.all(), policy or settings.DATASET_RETENTION, 'file_size')
+    # Filtered outside the ranking query; beside the window filter Django would
+    # apply it before ranking and the new upload would not count
+    return Dataset.objects.filter(pk__in=ranked.values('pk'), summary__isnull=False)
+
+
+def expired_summaries(policy=None):
+    """Queryset of summaries that fall outside the summary retention policy.
+
+    Every summary counts towards the limits, including those whose dataset is
+    still stored; ``prune_summaries()`` only deletes the orphaned ones.
+    """
+    return _expired(DatasetSummary.objects.all(), policy or settings.SUMMARY_RETENTION)
+
+
+def prune_datasets(policy=None):
+    """Bulk-delete expired datasets and remove their files off the request path."""
+    candidates = list(expired_datasets(policy).values_list('pk', flat=True))
+    if not candidates:
+        return 0
+
+    # One write transaction, so concurrent uploads queue on the lock once per
+    # prune. Re-reading the rows under the lock means only the prune that
+    # actually deletes a row removes its file; a concurrent prune that picked
+    # the same rows must not delete a new upload that reused the freed name.
+    with transaction.atomic():
+        doomed = list(Dataset.objects.select_for_update().filter(pk__in=candidates).values_list('pk', 'file'))
+        if not doomed:
+            return 0
+        pks = [pk for pk, _ in doomed]
+        # Summaries stay behind for trends; the merge state is only useful for appends
+        DatasetSummary.objects.filter(dataset__in=pks).update(dataset=None, aggregates={}, outlier_baselines={})
+        Dataset.objects.filter(pk__in=pks).delete()
+        prune_summaries()
+    file_names = [name for _, name in doomed if name]
+    if file_names:
+        transaction.on_commit(lambda: get_executor().submit(delete_files, file_names))
+    return len(doomed)
+
+
+def prune_summaries(policy=None):
+    """Delete summaries of pruned datasets that fall outside SUMMARY_RETENTION."""
+    pks = list(expired_summaries(policy).values_list('pk', flat=True))
+    if not pks:
+        return 0
+    # A window filter cannot also exclude live datasets without changing the ranking
+    deleted, _ = DatasetSummary.objects.filter(pk__in=pks, dataset__isnull=True).delete()
+    return deleted
+
+
+def delete_files(file_names):
+    for name in file_names:
+        try:
+            # Cache first: the name is only free for reuse once the CSV is gone
+            remove_columnar(default_storage.path(name))
+            default_storage.delete(name)
+        except OSError:
+            logger.warning("Could not remove pruned dataset file %s", name, exc_info=True)
+
+
+def prune_chunked_uploads(max_age_hours=None):
+    """Discard chunked uploads untouched for CHUNKED_UPLOAD_EXPIRY_HOURS, staged files included."""
+    from .chunked import UploadConflict, discard_upload
+    hours = max_age_hours or settings.CHUNKED_UPLOAD_EXPIRY_HOURS
+    pruned = 0
+    for upload in ChunkedUpload.objects.filter(updated_at__lt=timezone.now() - timedelta(hours=hours)):
+        try:
+            discard_upload(upload)
+        except UploadConflict:
+            continue
+        pruned += 1
+    return pruned
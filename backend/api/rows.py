@@ -0,0 +1,148 @@
+from base64 import b64decode, b64encode
+from urllib.parse import parse_qs, urlencode
+import numpy as np
+from rest_framework.exceptions import NotFound
+from .ingest import METRIC_COLUMNS
+
+# API field name -> column in the columnar cache
+ORDERING_FIELDS = {
+    'type': 'Type',
+    'flowrate': 'Flowrate',
+    'pressure': 'Pressure',
+    'temperature': 'Temperature',
+}
+RANGE_FIELDS = {column.lower(): column for column in METRIC_COLUMNS}
+
+# Rows examined per vectorised step while looking for matches
+SCAN_BLOCK = 8192
+
+
+def encode_cursor(position, reverse=False):
+    query = urlencode({'p': position, 'r': int(reverse)})
+    return b64encode(query.encode('ascii')).decode('ascii')
+
+
+def decode_cursor(cursor):
+    try:
+        query = parse_qs(b64decode(cursor.encode('ascii')).decode('ascii'), strict_parsing=True)
+        position = int(query['p'][0])
+        reverse = bool(int(query.get('r', ['0'])[0]))
+    except (TypeError, ValueError, KeyError, UnicodeError):
+        raise NotFound("Invalid cursor")
+    if position < 0:
+        raise NotFound("Invalid cursor")
+    return position, reverse
+
+
+class RowQuery:
+    """Filters and ordering applied to the memory-mapped columns of one dataset.
+
+    Rows are addressed by their position in the chosen ordering, which is what
+    the cursors encode; filters are evaluated block by block while scanning,
+    so a page only ever touches the rows it needs to find its matches.
+    ``predicate`` optionally narrows the matches further; it receives an
+    array of row indices and returns a boolean mask.
+    """
+
+    def __init__(self, columns, types=None, ranges=None, ordering=None, predicate=None):
+        self.columns = columns
+        self.ranges = ranges or {}
+        self.predicate = predicate
+        self.type_codes = None
+        if types:
+            lookup = {label: code for code, label in enumerate(columns.categories)}
+            self.type_codes = np.array([lookup[label] for label in types if label in lookup], dtype='<i4')
+
+        self.order = None
+        self.descending = False
+        if ordering:
+            self.descending = ordering.startswith('-')
+            self.order = columns.sort_index(ORDERING_FIELDS[ordering.lstrip('-')])
+
+    def rows_at(self, positions):
+        """Row indices for positions in the (possibly descending) ordering."""
+        if self.descending:
+            positions = len(self.columns) - 1 - positions
+        if self.order is None:
+            return positions
+        return np.asarray(self.order[positions])
+
+    def matches(self, indices):
+        mask = np.ones(len(indices), dtype=bool)
+        if self.type_codes is not None:
+            mask &= np.isin(self.columns.type_codes[indices], self.type_codes)
+        for column, (low, high) in self.ranges.items():
+            values = self.columns.metric(column)[indices]
+            if low is not None:
+                mask &= values >= low
+            if high is not None:
+                mask &= values <= high
+        if self.predicate is not None:
+            mask &= self.predicate(indices)
+        return mask
+
+    def scan(self, start, limit, reverse=False):
+        """Return up to ``limit`` matching positions starting at ``start``.
+
+        Forward scans cover ``[start, len)``; reverse scans cover ``[0, start)``
+        walking backwards. One extra match is looked for so the caller knows
+        whether another page exists.
+        """
+        total = len(self.columns)
+        found = []
+        position = start
+        while len(found) <= limit and (position > 0 if reverse else position < total):
+            if reverse:
+                block = np.arange(position - 1, max(position - SCAN_BLOCK, 0) - 1, -1)
+                position = max(position - SCAN_BLOCK, 0)
+            else:
+                block = np.arange(position, min(position + SCAN_BLOCK, total))
+                position = min(position + SCAN_BLOCK, total)
+            found.extend(block[self.matches(self.rows_at(block))][:limit + 1 - len(found)].tolist())
+        return found[:limit], len(found) > limit
+
+    def page(self, cursor=None, page_size=100, offset=0):
+        """One page from ``cursor``, or else from position ``offset`` going forward."""
+        position, reverse = decode_cursor(cursor) if cursor else (min(offset, len(self.columns)), False)
+        positions, has_more = self.scan(position, page_size, reverse)
+        if reverse:
+            positions.reverse()
+
+        # A reverse page was reached from a later one, and a forward page that
+        # does not start at 0 from an earlier one, so those links always exist
+        next_cursor = previous_cursor = None
+        if reverse:
+            next_cursor = encode_cursor(positions[-1] + 1 if positions else position)
+            if has_more:
+                previous_cursor = encode_cursor(positions[0], reverse=True)
+        else:
+            if has_more:
+                next_cursor = encode_cursor(positions[-1] + 1)
+            if position > 0:
+                previous_cursor = encode_cursor(positions[0] if positions else position, reverse=True)
+
+        return self.serialize(positions), next_cursor, previous_cursor
+
+    def serialize(self, positions):
+        if not positions:
+            return []
+        indices = self.rows_at(np.asarray(positions, dtype=np.int64))
+        names = self.columns.names(indices)
+        types = self.columns.types(indices)
+        metrics = {column: self.columns.metric(column)[indices] for column in METRIC_COLUMNS}
+        return [
+            {
+                "row": int(index),
+                "equipment_name": names[i],
+                "type": types[i],
+                "flowrate": _json_float(metrics['Flowrate'][i]),
+                "pressure": _json_float(metrics['Pressure'][i]),
+                "temperature": _json_float(metrics['Temperature'][i]),
+            }
+            for i, index in enumerate(indices)
+        ]
+
+
+def _json_float(value):
+    # NaN is not valid JSON; blanks in the CSV come back as null
+    return None if np.isnan(value) else float(value)
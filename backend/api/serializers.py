@@ -1,5 +1,7 @@
+from django.conf import settings
 from rest_framework import serializers
-from .models import Dataset
+from .compression import compression_for_name
+from .models import ChunkedUpload, Dataset, DatasetSummary, UploadJob
 import os
 
 class DatasetSerializer(serializers.ModelSerializer):
@@ -16,3 +18,112 @@ class DatasetHistorySerializer(serializers.ModelSerializer):
 
     def get_dataset_name(self, obj):
         return os.path.basename(obj.file.name)
+
+class DatasetStatsSerializer(serializers.ModelSerializer):
+    class Meta:
+        model = DatasetSummary
+        fields = ['dataset', 'total_equipment_count', 'average_flowrate', 'average_pressure',
+                  'average_temperature', 'equipment_type_distribution', 'type_statistics',
+                  'percentile_mode', 'computed_at']
+
+class UploadJobSerializer(serializers.ModelSerializer):
+    stats = serializers.SerializerMethodField()
+
+    class Meta:
+        model = UploadJob
+        fields = ['id', 'status', 'progress', 'dataset', 'error', 'stats', 'created_at', 'updated_at']
+
+    def get_stats(self, obj):
+        if obj.status != UploadJob.DONE or obj.dataset is None:
+            return None
+        return obj.dataset.summary.to_stats()
+
+class ChunkedUploadSerializer(serializers.ModelSerializer):
+    chunk_size = serializers.SerializerMethodField()
+
+    class Meta:
+        model = ChunkedUpload
+        fields = ['id', 'filename', 'status', 'next_chunk', 'bytes_received', 'chunk_size', 'dataset', 'error',
+                  'created_at', 'updated_at']
+        read_only_fields = ['status', 'next_chunk', 'bytes_received', 'dataset', 'error']
+
+    def get_chunk_size(self, obj):
+        return settings.UPLOAD_CHUNK_SIZE
+
+    def validate_filename(self, value):
+        # Stored like an uploaded file's name: the base name only
+        name = os.path.basename(value.replace('\\', '/'))
+        if not name:
+            raise serializers.ValidationError("Enter a file name.")
+        if compression_for_name(name):
+            # A decompressor's state cannot be kept between chunk requests
+            raise serializers.ValidationError(
+                "Compressed files cannot be uploaded in chunks; send each chunk with "
+                "Content-Encoding: gzip instead, or post the file to api/upload/."
+            )
+        return name
+
+class DatasetRowsQuerySerializer(serializers.Serializer):
+    cursor = serializers.CharField(required=False)
+    # Position in the ordering to start at, for clients that jump to any page
+    offset = serializers.IntegerField(required=False, min_value=0)
+    page_size = serializers.IntegerField(required=False, min_value=1, max_value=settings.ROWS_MAX_PAGE_SIZE)
+    ordering = serializers.ChoiceField(required=False, choices=[
+        'type', '-type', 'flowrate', '-flowrate', 'pressure', '-pressure', 'temperature', '-temperature'
+    ])
+    type = serializers.ListField(child=serializers.CharField(), required=False)
+    flowrate_min = serializers.FloatField(required=False)
+    flowrate_max = serializers.FloatField(required=False)
+    pressure_min = serializers.FloatField(required=False)
+    pressure_max = serializers.FloatField(required=False)
+    temperature_min = serializers.FloatField(required=False)
+    temperature_max = serializers.FloatField(required=False)
+
+    def validate(self, data):
+        if 'cursor' in data and 'offset' in data:
+            raise serializers.ValidationError("Send either cursor or offset, not both.")
+        return data
+
+class DatasetOutliersQuerySerializer(serializers.Serializer):
+    method = serializers.ChoiceField(choices=['zscore', 'iqr'], default='zscore')
+    # z-score limit for 'zscore', IQR multiplier for 'iqr'; defaults come from settings
+    threshold = serializers.FloatField(required=False, min_value=0)
+    metric = serializers.ListField(
+        child=serializers.ChoiceField(choices=['flowrate', 'pressure', 'temperature']), required=False
+    )
+    type = serializers.ListField(child=serializers.CharField(), required=False)
+    cursor = serializers.CharField(required=False)
+    page_size = serializers.IntegerField(required=False, min_value=1, max_value=settings.ROWS_MAX_PAGE_SIZE)
+
+class DatasetTrendSerializer(serializers.ModelSerializer):
+    types = serializers.SerializerMethodField()
+
+    class Meta:
+        model = DatasetSummary
+        fields = ['dataset', 'dataset_name', 'uploaded_at', 'total_equipment_count', 'average_flowrate',
+                  'average_pressure', 'average_temperature', 'types']
+
+    def get_types(self, obj):
+        # Per-Type count and metric means; summaries from before type_statistics only have counts
+        selected = self.context.get('types')
+        result = {}
+        for equipment_type, count in obj.equipment_type_distribution.items():
+            if selected and equipment_type not in selected:
+                continue
+            statistics = obj.type_statistics.get(equipment_type, {})
+            result[equipment_type] = {"count": count}
+            for field in ('flowrate', 'pressure', 'temperature'):
+                result[equipment_type][field] = statistics.get(field, {}).get('mean')
+        return result
+
+class DatasetTrendQuerySerializer(serializers.Serializer):
+    since = serializers.DateTimeField(required=False)
+    until = serializers.DateTimeField(required=False)
+    type = serializers.ListField(child=serializers.CharField(), required=False)
+    limit = serializers.IntegerField(required=False, min_value=1, max_value=settings.TRENDS_MAX_POINTS)
+
+class DatasetChartQuerySerializer(serializers.Serializer):
+    theme = serializers.ChoiceField(choices=['dark', 'light'], default='dark')
+    # Image size in pixels
+    width = serializers.IntegerField(default=1000, min_value=200, max_value=settings.CHART_MAX_SIZE)
+    height = serializers.IntegerField(default=400, min_value=200, max_value=settings.CHART_MAX_SIZE)
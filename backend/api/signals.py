@@ -0,0 +1,16 @@
+from django.db.models.signals import post_delete, post_save
+from django.dispatch import receiver
+from .caching import invalidate
+from .models import Dataset, DatasetSummary
+
+
+@receiver(post_save, sender=Dataset)
+@receiver(post_delete, sender=Dataset)
+def invalidate_dataset(sender, instance, **kwargs):
+    invalidate(instance.pk)
+
+
+@receiver(post_save, sender=DatasetSummary)
+@receiver(post_delete, sender=DatasetSummary)
+def invalidate_summary(sender, instance, **kwargs):
+    invalidate(instance.dataset_id)
@@ -0,0 +1,394 @@
+from django.conf import settings
+import math
+import numpy as np
+import pandas as pd
+from .ingest import METRIC_COLUMNS, iter_chunks
+
+PERCENTILES = (50, 95, 99)
+# Quartiles behind the IQR outlier baselines
+QUARTILES = (25, 75)
+APPROXIMATE = 'approximate'
+EXACT = 'exact'
+PERCENTILE_MODES = (APPROXIMATE, EXACT)
+
+# Magnitudes below this are counted as zero by the quantile sketch
+SKETCH_MIN_VALUE = 1e-9
+
+
+def _round(value):
+    if value is None or (isinstance(value, float) and math.isnan(value)):
+        return None
+    return round(float(value), 2)
+
+
+class QuantileSketch:
+    """Mergeable log-bucket quantile sketch (DDSketch-style).
+
+    Values are counted in buckets whose bounds grow geometrically by ``gamma``,
+    so every quantile estimate is within ``relative_accuracy`` of the true
+    value while the sketch only holds a few hundred buckets, whatever the
+    number of rows.
+    """
+
+    def __init__(self, relative_accuracy=None):
+        self.relative_accuracy = relative_accuracy or settings.STATS_SKETCH_ACCURACY
+        self.gamma = (1 + self.relative_accuracy) / (1 - self.relative_accuracy)
+        self.positive = {}
+        self.negative = {}
+        self.zero = 0
+        self.count = 0
+
+    @staticmethod
+    def bucket_keys(values, gamma):
+        """Vectorised (sign, key) for each value; sign is 0 for zeros."""
+        signs = np.sign(values).astype(np.int8)
+        magnitudes = np.abs(values)
+        signs[magnitudes < SKETCH_MIN_VALUE] = 0
+        keys = np.zeros(len(values), dtype=np.int64)
+        nonzero = signs != 0
+        keys[nonzero] = np.ceil(np.log(magnitudes[nonzero]) / math.log(gamma))
+        return signs, keys
+
+    def add_bucket(self, sign, key, count):
+        if sign > 0:
+            self.positive[key] = self.positive.get(key, 0) + count
+        elif sign < 0:
+            self.negative[key] = self.negative.get(key, 0) + count
+        else:
+            self.zero += count
+        self.count += count
+
+    def merge(self, other):
+        for key, count in other.positive.items():
+            self.positive[key] = self.positive.get(key, 0) + count
+        for key, count in other.negative.items():
+            self.negative[key] = self.negative.get(key, 0) + count
+        self.zero += other.zero
+        self.count += other.count
+
+    def to_dict(self):
+        # JSON object keys must be strings, so buckets are stored as [key, count] pairs
+        return {
+            "positive": [[key, count] for key, count in self.positive.items()],
+            "negative": [[key, count] for key, count in self.negative.items()],
+            "zero": self.zero,
+        }
+
+    @classmethod
+    def from_dict(cls, data, relative_accuracy=None):
+        sketch = cls(relative_accuracy)
+        sketch.positive = {key: count for key, count in data["positive"]}
+        sketch.negative = {key: count for key, count in data["negative"]}
+        sketch.zero = data["zero"]
+        sketch.count = sketch.zero + sum(sketch.positive.values()) + sum(sketch.negative.values())
+        return sketch
+
+    def _value(self, key):
+        return 2 * self.gamma ** key / (self.gamma + 1)
+
+    def quantile(self, q):
+        if not self.count:
+            return None
+        rank = q * (self.count - 1)
+        seen = 0
+        # Most negative first, then zeros, then positives in increasing order
+        for key in sorted(self.negative, reverse=True):
+            seen += self.negative[key]
+            if seen > rank:
+                return -self._value(key)
+        seen += self.zero
+        if seen > rank:
+            return 0.0
+        for key in sorted(self.positive):
+            seen += self.positive[key]
+            if seen > rank:
+                return self._value(key)
+        return self._value(max(self.positive)) if self.positive else 0.0
+
+
+class MetricMoments:
+    """Count, mean, sum of squared deviations, min and max of one metric.
+
+    Partial results are combined with Chan's parallel update, which stays
+    numerically stable where a running sum of squares would not.
+    """
+
+    def __init__(self):
+        self.count = 0
+        self.mean = 0.0
+        self.m2 = 0.0
+        self.min = math.inf
+        self.max = -math.inf
+
+    def merge(self, count, mean, m2, minimum, maximum):
+        if not count:
+            return
+        total = self.count + count
+        delta = mean - self.mean
+        self.mean += delta * count / total
+        self.m2 += m2 + delta * delta * self.count * count / total
+        self.count = total
+        self.min = min(self.min, minimum)
+        self.max = max(self.max, maximum)
+
+    def to_list(self):
+        if not self.count:
+            return [0, 0.0, 0.0, None, None]
+        return [self.count, float(self.mean), float(self.m2), float(self.min), float(self.max)]
+
+    @classmethod
+    def from_list(cls, values):
+        moments = cls()
+        count, mean, m2, minimum, maximum = values
+        moments.merge(count, mean, m2, minimum, maximum)
+        return moments
+
+    def std(self):
+        # Sample standard deviation, like pandas' default ddof=1
+        if self.count < 2:
+            return None
+        return math.sqrt(self.m2 / (self.count - 1))
+
+
+class GroupedStats:
+    """Per-Type moments and quantile sketches for every metric."""
+
+    def __init__(self, relative_accuracy=None):
+        self.relative_accuracy = relative_accuracy or settings.STATS_SKETCH_ACCURACY
+        self.gamma = (1 + self.relative_accuracy) / (1 - self.relative_accuracy)
+        self.moments = {}
+        self.sketches = {}
+
+    def _group(self, equipment_type):
+        if equipment_type not in self.moments:
+            self.moments[equipment_type] = {column: MetricMoments() for column in METRIC_COLUMNS}
+            self.sketches[equipment_type] = {column: QuantileSketch(self.relative_accuracy)
+                                             for column in METRIC_COLUMNS}
+        return self.moments[equipment_type], self.sketches[equipment_type]
+
+    def merge(self, other):
+        for equipment_type, other_moments in other.moments.items():
+            moments, sketches = self._group(equipment_type)
+            for column in METRIC_COLUMNS:
+                metric = other_moments[column]
+                moments[column].merge(metric.count, metric.mean, metric.m2, metric.min, metric.max)
+                sketches[column].merge(other.sketches[equipment_type][column])
+
+    def to_dict(self):
+        return {
+            "relative_accuracy": self.relative_accuracy,
+            "groups": [
+                [equipment_type, {
+                    column: {
+                        "moments": moments[column].to_list(),
+                        "sketch": self.sketches[equipment_type][column].to_dict(),
+                    }
+                    for column in METRIC_COLUMNS
+                }]
+                for equipment_type, moments in self.moments.items()
+            ],
+        }
+
+    @classmethod
+    def from_dict(cls, data):
+        grouped = cls(data["relative_accuracy"])
+        for equipment_type, columns in data["groups"]:
+            grouped.moments[equipment_type] = {
+                column: MetricMoments.from_list(columns[column]["moments"]) for column in METRIC_COLUMNS
+            }
+            grouped.sketches[equipment_type] = {
+                column: QuantileSketch.from_dict(columns[column]["sketch"], grouped.relative_accuracy)
+                for column in METRIC_COLUMNS
+            }
+        return grouped
+
+    def update(self, chunk):
+        types = chunk['Type'].astype('category')
+
+        # One groupby pass yields every per-Type moment for every metric
+        aggregated = chunk[list(METRIC_COLUMNS)].groupby(types, observed=True, sort=False).agg(
+            ['count', 'mean', 'var', 'min', 'max']
+        )
+        for equipment_type, row in aggregated.iterrows():
+            moments, _ = self._group(equipment_type)
+            for column in METRIC_COLUMNS:
+                count = int(row[(column, 'count')])
+                variance = row[(column, 'var')]
+                m2 = 0.0 if count < 2 or math.isnan(variance) else variance * (count - 1)
+                moments[column].merge(count, row[(column, 'mean')], m2,
+                                      row[(column, 'min')], row[(column, 'max')])
+
+        # Sketch buckets are tallied per (type, sign, key), so the Python loop
+        # below runs once per distinct bucket rather than once per row
+        codes = types.cat.codes.to_numpy()
+        labels = types.cat.categories
+        for column in METRIC_COLUMNS:
+            values = chunk[column].to_numpy(dtype='float64')
+            valid = (codes >= 0) & ~np.isnan(values)
+            if not valid.any():
+                continue
+            signs, keys = QuantileSketch.bucket_keys(values[valid], self.gamma)
+            buckets = pd.DataFrame({'type': codes[valid], 'sign': signs, 'key': keys}).value_counts()
+            for (code, sign, key), count in buckets.items():
+                _, sketches = self._group(labels[code])
+                sketches[column].add_bucket(int(sign), int(key), int(count))
+
+    def percentile(self, equipment_type, column, percentile, exact_percentiles=None):
+        if exact_percentiles is not None:
+            return exact_percentiles.get(equipment_type, {}).get(column, {}).get(percentile)
+        moments, sketches = self._group(equipment_type)
+        estimate = sketches[column].quantile(percentile / 100)
+        if estimate is None:
+            return None
+        # Bucket midpoints can fall just outside the observed range
+        return min(max(estimate, moments[column].min), moments[column].max)
+
+    def summary(self, type_counts, exact_percentiles=None):
+        result = {}
+        for equipment_type, count in type_counts.items():
+            moments, _ = self._group(equipment_type)
+            entry = {"count": count}
+            for column in METRIC_COLUMNS:
+                metric = moments[column]
+                values = {
+                    "mean": _round(metric.mean) if metric.count else None,
+                    "min": _round(metric.min) if metric.count else None,
+                    "max": _round(metric.max) if metric.count else None,
+                    "std": _round(metric.std()),
+                }
+                for percentile in PERCENTILES:
+                    estimate = self.percentile(equipment_type, column, percentile, exact_percentiles)
+                    values[f"p{percentile}"] = _round(estimate)
+                entry[column.lower()] = values
+            result[equipment_type] = entry
+        return result
+
+    def baselines(self, exact_percentiles=None):
+        """Unrounded per-Type mean, std and quartiles used to flag outliers."""
+        result = {}
+        for equipment_type, moments in self.moments.items():
+            result[equipment_type] = {}
+            for column in METRIC_COLUMNS:
+                q1, q3 = (self.percentile(equipment_type, column, quartile, exact_percentiles)
+                          for quartile in QUARTILES)
+                result[equipment_type][column] = {
+                    "mean": float(moments[column].mean) if moments[column].count else None,
+                    "std": moments[column].std(),
+                    "q1": None if q1 is None else float(q1),
+                    "q3": None if q3 is None else float(q3),
+                }
+        return result
+
+
+def exact_type_percentiles(columns):
+    """Exact per-Type percentiles (and quartiles) from memory-mapped columns.
+
+    Unlike the sketches this needs every metric value in memory at once.
+    """
+    frame = pd.DataFrame({column: np.asarray(columns.metric(column)) for column in METRIC_COLUMNS})
+    frame['Type'] = pd.Categorical.from_codes(np.asarray(columns.type_codes), categories=columns.categories)
+    quantiles = frame.groupby('Type', observed=True)[list(METRIC_COLUMNS)].quantile(
+        [percentile / 100 for percentile in sorted({*PERCENTILES, *QUARTILES})]
+    )
+    result = {}
+    for (equipment_type, q), row in quantiles.iterrows():
+        for column in METRIC_COLUMNS:
+            value = None if pd.isna(row[column]) else float(row[column])
+            result.setdefault(equipment_type, {}).setdefault(column, {})[round(q * 100)] = value
+    return result
+
+
+class StatsAccumulator:
+    """Running sums, counts and per-Type tallies over a stream of DataFrame chunks.
+
+    Only a handful of numbers are kept between chunks, so memory stays bounded
+    by the chunk size no matter how many rows the file has.
+    """
+
+    def __init__(self):
+        self.rows = 0
+        self.sums = {column: 0.0 for column in METRIC_COLUMNS}
+        self.counts = {column: 0 for column in METRIC_COLUMNS}
+        self.type_counts = {}
+        self.grouped = GroupedStats()
+
+    def update(self, chunk):
+        if chunk.empty:
+            return
+
+        for column in METRIC_COLUMNS:
+            values = chunk[column]
+            if not pd.api.types.is_numeric_dtype(values):
+                raise TypeError(f"Column '{column}' must contain only numeric values")
+            # sum()/count() skip NaN, matching what DataFrame.mean() does
+            self.sums[column] += float(values.sum())
+            self.counts[column] += int(values.count())
+
+        # Tallied in order of first appearance, which to_stats() breaks ties by;
+        # value_counts() alone lists a categorical column in category order
+        types = chunk['Type'].dropna()
+        for equipment_type, count in types.value_counts(sort=False).reindex(types.unique()).items():
+            self.type_counts[equipment_type] = self.type_counts.get(equipment_type, 0) + int(count)
+
+        self.grouped.update(chunk)
+        self.rows += len(chunk)
+
+    def merge(self, other):
+        """Fold another accumulator in, as if its chunks had been read by this one."""
+        self.rows += other.rows
+        for column in METRIC_COLUMNS:
+            self.sums[column] += other.sums[column]
+            self.counts[column] += other.counts[column]
+        for equipment_type, count in other.type_counts.items():
+            self.type_counts[equipment_type] = self.type_counts.get(equipment_type, 0) + count
+        self.grouped.merge(other.grouped)
+
+    def to_dict(self):
+        """JSON-safe state, stored with the summary so later appends can resume it."""
+        return {
+            "rows": self.rows,
+            "sums": self.sums,
+            "counts": self.counts,
+            "type_counts": [[equipment_type, count] for equipment_type, count in self.type_counts.items()],
+            "grouped": self.grouped.to_dict(),
+        }
+
+    @classmethod
+    def from_dict(cls, data):
+        accumulator = cls()
+        accumulator.rows = data["rows"]
+        accumulator.sums = dict(data["sums"])
+        accumulator.counts = dict(data["counts"])
+        accumulator.type_counts = {equipment_type: count for equipment_type, count in data["type_counts"]}
+        accumulator.grouped = GroupedStats.from_dict(data["grouped"])
+        return accumulator
+
+    def mean(self, column):
+        if not self.counts[column]:
+            return 0
+        return round(self.sums[column] / self.counts[column], 2)
+
+    def to_stats(self, exact_percentiles=None):
+        """Summary JSON; pass ``exact_percentiles`` to replace the sketch estimates."""
+        # Most frequent first; the sort is stable, so ties keep their order of first appearance
+        distribution = dict(sorted(self.type_counts.items(), key=lambda item: -item[1]))
+        return {
+            "total_equipment_count": self.rows,
+            "average_flowrate": self.mean('Flowrate'),
+            "average_pressure": self.mean('Pressure'),
+            "average_temperature": self.mean('Temperature'),
+            "equipment_type_distribution": distribution,
+            "type_statistics": self.grouped.summary(distribution, exact_percentiles),
+            "percentile_mode": EXACT if exact_percentiles is not None else APPROXIMATE
+        }
+
+
+def aggregate_csv(file_path, chunksize=None, progress=None):
+    """Stream a CSV in bounded chunks and return its summary statistics.
+
+    ``progress`` is called after every chunk with the fraction of bytes read.
+    """
+    accumulator = StatsAccumulator()
+    for chunk in iter_chunks(file_path, chunksize=chunksize, progress=progress):
+        accumulator.update(chunk)
+    return accumulator.to_stats()
@@ -0,0 +1,37 @@
+from django.core.files.move import file_move_safe
+from django.core.files.storage import FileSystemStorage
+import os
+
+
+class DatasetStorage(FileSystemStorage):
+    """FileSystemStorage whose moves of temporary uploads cannot collide.
+
+    Django moves a temporary upload with a check-then-rename, so two
+    concurrent uploads of the same name can both be given it and the second
+    silently replaces the first (and, through the shared name, its columnar
+    cache). The name is claimed with an exclusive create first and the
+    upload is then moved over its own claim.
+    """
+
+    def _save(self, name, content):
+        if not hasattr(content, 'temporary_file_path'):
+            return super()._save(name, content)
+
+        os.makedirs(os.path.dirname(self.path(name)), exist_ok=True)
+        while True:
+            try:
+                os.close(os.open(self.path(name), os.O_WRONLY | os.O_CREAT | os.O_EXCL, 0o666))
+            except FileExistsError:
+                name = self.get_available_name(name)
+            else:
+                break
+
+        full_path = self.path(name)
+        try:
+            file_move_safe(content.temporary_file_path(), full_path, allow_overwrite=True)
+        except BaseException:
+            os.remove(full_path)
+            raise
+        if self.file_permissions_mode is not None:
+            os.chmod(full_path, self.file_permissions_mode)
+        return os.path.relpath(full_path, self.location).replace('\\', '/')
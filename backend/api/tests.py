@@ -1,3 +1,904 @@
-from django.test import TestCase
+import gzip
+import hashlib
+import importlib
+import io
+import os
+import shutil
+import tempfile
+import zipfile
+from concurrent.futures import Future
+from datetime import datetime, timedelta
+from unittest import mock
+import numpy as np
+import pandas as pd
+from django.core.cache import cache
+from django.core.files.uploadedfile import SimpleUploadedFile
+from django.test.client import BOUNDARY, encode_multipart
+from django.test import SimpleTestCase, TestCase, TransactionTestCase, override_settings
+from django.urls import clear_url_caches, resolve
+from django.utils import timezone
+from .charts import render_chart
+from .columnar import ColumnarDataset
+from .compression import zstandard
+from .ingest import CSVStreamParser, iter_chunks, pa_csv
+from .metrics import rows_parsed
+from .models import ChunkedUpload, Dataset, DatasetSummary, UploadJob
+from .outliers import IQR, ZSCORE, flag_bit
+from .stats import StatsAccumulator
+from .views import AsyncHistoryView, AsyncUploadView
 
-# Create your tests here.
+HEADER = b'Equipment Name,Type,Flowrate,Pressure,Temperature\n'
+
+
+def parse(data, engine):
+    return pd.concat(iter_chunks(io.BytesIO(data), engine=engine), ignore_index=True)
+
+
+def assert_same_rows(frame, expected):
+    # Chunks parsed separately carry their own categories, so Types are compared as text
+    pd.testing.assert_frame_equal(frame.astype({'Type': str}), expected.astype({'Type': str}))
+
+
+def make_csv(rows, seed=0, header=True):
+    """Random equipment rows, with some missing metrics, as CSV bytes."""
+    rng = np.random.default_rng(seed)
+    lines = [HEADER] if header else []
+    for i in range(rows):
+        flowrate = '' if i % 37 == 0 else f'{rng.normal(100, 25):.3f}'
+        lines.append(f'EQ-{seed}-{i},{rng.choice(["Pump", "Valve", "Tank", "Reactor"])},{flowrate},'
+                     f'{rng.uniform(1, 10):.4f},{rng.integers(-20, 300)}\n'.encode())
+    return b''.join(lines)
+
+
+class TempMediaMixin:
+    """Uploads go to a throwaway MEDIA_ROOT, removed after the class."""
+
+    @classmethod
+    def setUpClass(cls):
+        cls.media_root = tempfile.mkdtemp(prefix='api-tests-')
+        cls.media_override = override_settings(MEDIA_ROOT=cls.media_root)
+        cls.media_override.enable()
+        super().setUpClass()
+
+    @classmethod
+    def tearDownClass(cls):
+        super().tearDownClass()
+        cls.media_override.disable()
+        shutil.rmtree(cls.media_root, ignore_errors=True)
+
+    def setUp(self):
+        # Cached responses are keyed by dataset pk, which rolled back tests reuse
+        cache.clear()
+
+    def upload(self, data, name='equipment.csv', query=''):
+        response = self.client.post(f'/api/upload/{query}', {'file': SimpleUploadedFile(name, data)})
+        self.assertIn(response.status_code, (201, 202), response.content)
+        return response
+
+
+class ApiTestCase(TempMediaMixin, TestCase):
+    pass
+
+
+class InlineExecutor:
+    """Stands in for the upload worker pool: runs each submitted call at once."""
+
+    def submit(self, func, *args, **kwargs):
+        future = Future()
+        try:
+            future.set_result(func(*args, **kwargs))
+        except BaseException as e:
+            future.set_exception(e)
+        return future
+
+
+class ParserEngineParityTests(SimpleTestCase):
+    """Every CSV engine reads a file into the same typed frame."""
+
+    CSV = (
+        HEADER +
+        b'P-1,Pump,120.5,5.2,110\n'
+        b'P-2,,98,NA,105\n'
+        b',NA,1,2,3\n'
+        b'V-1,Valve,n/a,4.1,#N/A\n'
+        b'P-3,Pump,101,5.0,null\n'
+        b'T-1,null,50,1.5,80\n'
+    )
+
+    def setUp(self):
+        self.engines = ['c', 'python'] + (['pyarrow'] if pa_csv is not None else [])
+
+    def test_engines_agree(self):
+        expected = parse(self.CSV, 'c')
+        self.assertEqual(expected['Type'].value_counts().to_dict(), {'Pump': 2, 'Valve': 1})
+        for engine in self.engines:
+            with self.subTest(engine=engine):
+                frame = parse(self.CSV, engine)
+                self.assertEqual(frame['Type'].value_counts().to_dict(), {'Pump': 2, 'Valve': 1})
+                assert_same_rows(frame, expected)
+
+    def test_stream_parser_matches_engines(self):
+        expected = parse(self.CSV, 'c')
+        for engine in self.engines:
+            with self.subTest(engine=engine):
+                parser = CSVStreamParser(engine=engine)
+                frame = pd.concat(parser.feed(self.CSV) + parser.close(), ignore_index=True)
+                assert_same_rows(frame, expected)
+
+
+class CSVStreamParserTests(SimpleTestCase):
+    """Records split across feeds are parsed whole, wherever the cut falls."""
+
+    CSV = (
+        HEADER +
+        b'"Pump, main",Pump,120.5,5.2,110\n'
+        b'"Valve\nwith a newline",Valve,98,4.1,105\n'
+        b'"Tank ""T-1""\r\nspare",Tank,50,1.5,80\n'
+        b'Reactor,Reactor,75.25,3.3,350'
+    )
+
+    def parse_stream(self, pieces, resume=False):
+        parser = CSVStreamParser(engine='c')
+        frames = []
+        for piece in pieces:
+            frames += parser.feed(piece)
+            if resume:
+                # As between chunked upload requests: flush, then carry on in a new parser
+                frames += parser.flush()
+                parser = CSVStreamParser.resume(*parser.state, engine='c')
+        frames += parser.close()
+        return pd.concat(frames, ignore_index=True)
+
+    def test_every_split_point(self):
+        expected = parse(self.CSV, 'c')
+        self.assertEqual(len(expected), 4)
+        for cut in range(1, len(self.CSV)):
+            for resume in (False, True):
+                with self.subTest(cut=cut, resume=resume):
+                    frame = self.parse_stream([self.CSV[:cut], self.CSV[cut:]], resume)
+                    assert_same_rows(frame, expected)
+
+    def test_byte_at_a_time(self):
+        pieces = [self.CSV[i:i + 1] for i in range(len(self.CSV))]
+        frame = self.parse_stream(pieces, resume=True)
+        assert_same_rows(frame, parse(self.CSV, 'c'))
+        self.assertEqual(frame['Equipment Name'][1], 'Valve\nwith a newline')
+        self.assertEqual(frame['Equipment Name'][2], 'Tank "T-1"\r\nspare')
+
+
+class ChunkedUploadTests(ApiTestCase):
+    """The chunked protocol: order, retries, dropped bodies and finalizing."""
+
+    def setUp(self):
+        super().setUp()
+        self.data = make_csv(400, seed=1)
+        # Cut mid-record, so records span chunks
+        self.chunks = [self.data[i:i + 4000] for i in range(0, len(self.data), 4000)]
+        response = self.client.post('/api/upload/chunked/', {'filename': 'equipment.csv'},
+                                    content_type='application/json')
+        self.assertEqual(response.status_code, 201)
+        self.id = response.json()['id']
+
+    def put(self, index, body, **extra):
+        return self.client.put(f'/api/upload/chunked/{self.id}/chunks/{index}/', body,
+                               content_type='application/octet-stream', **extra)
+
+    def complete(self):
+        return self.client.post(f'/api/upload/chunked/{self.id}/complete/')
+
+    def expected_stats(self):
+        stats = self.upload(self.data, name='direct.csv').json()
+        stats.pop('percentile_mode', None)
+        return stats
+
+    def assert_stats(self, response):
+        self.assertEqual(response.status_code, 201, response.content)
+        stats = response.json()
+        stats.pop('percentile_mode', None)
+        # Otherwise the direct upload would be answered from this summary
+        Dataset.objects.all().delete()
+        self.assertEqual(stats, self.expected_stats())
+
+    def test_chunks_in_order(self):
+        for index, chunk in enumerate(self.chunks):
+            response = self.put(index, chunk)
+            self.assertEqual(response.status_code, 200, response.content)
+            self.assertEqual(response.json()['next_chunk'], index + 1)
+        self.assert_stats(self.complete())
+
+    def test_out_of_order_chunk_is_refused(self):
+        self.assertEqual(self.put(0, self.chunks[0]).status_code, 200)
+        response = self.put(2, self.chunks[2])
+        self.assertEqual(response.status_code, 409)
+        self.assertEqual(response.json()['next_chunk'], 1)
+
+    def test_repeated_chunk_is_ignored(self):
+        for index, chunk in enumerate(self.chunks):
+            self.assertEqual(self.put(index, chunk).status_code, 200)
+            # A retry of a chunk whose response was lost changes nothing
+            response = self.put(index, chunk)
+            self.assertEqual(response.status_code, 200)
+            self.assertEqual(response.json()['next_chunk'], index + 1)
+        self.assert_stats(self.complete())
+
+    def test_resume_after_dropped_body(self):
+        self.assertEqual(self.put(0, self.chunks[0]).status_code, 200)
+        # The connection drops partway: fewer bytes arrive than announced
+        partial = self.chunks[1][:1500]
+        response = self.put(1, partial, CONTENT_LENGTH=str(len(self.chunks[1])))
+        self.assertEqual(response.status_code, 400)
+        self.assertIn('chunk', response.json()['error'])
+        upload = ChunkedUpload.objects.get(pk=self.id)
+        self.assertEqual(upload.status, ChunkedUpload.RECEIVING)
+        self.assertEqual(upload.next_chunk, 1)
+
+        response = self.client.get(f'/api/upload/chunked/{self.id}/')
+        self.assertEqual(response.json()['next_chunk'], 1)
+        for index in range(1, len(self.chunks)):
+            self.assertEqual(self.put(index, self.chunks[index]).status_code, 200)
+        self.assert_stats(self.complete())
+
+    def test_finalize_twice(self):
+        for index, chunk in enumerate(self.chunks):
+            self.put(index, chunk)
+        first = self.complete()
+        second = self.complete()
+        self.assertEqual(second.status_code, 201)
+        self.assertEqual(first.json(), second.json())
+        self.assertEqual(Dataset.objects.count(), 1)
+        self.assertEqual(self.put(len(self.chunks), b'late,Pump,1,2,3\n').status_code, 409)
+
+
+class AppendTests(ApiTestCase):
+    """Appending merges into the stored aggregates like a full recompute."""
+
+    def test_append_matches_recompute(self):
+        first, second = make_csv(500, seed=2), make_csv(300, seed=3)
+        self.upload(first)
+        dataset = Dataset.objects.get()
+        response = self.client.post(f'/api/datasets/{dataset.pk}/append/',
+                                    {'file': SimpleUploadedFile('more.csv', second)})
+        self.assertEqual(response.status_code, 200, response.content)
+        appended = response.json()
+        self.assertEqual(appended.pop('appended_rows'), 300)
+
+        combined = first + second[len(HEADER):]
+        with open(dataset.file.path, 'rb') as handle:
+            self.assertEqual(handle.read(), combined)
+        dataset.delete()
+        self.assertEqual(appended, self.upload(combined, name='combined.csv').json())
+
+    def test_append_with_another_header_is_refused(self):
+        self.upload(make_csv(10))
+        dataset = Dataset.objects.get()
+        other = make_csv(10, seed=4).replace(b'Temperature', b'Temp', 1)
+        response = self.client.post(f'/api/datasets/{dataset.pk}/append/',
+                                    {'file': SimpleUploadedFile('more.csv', other)})
+        self.assertEqual(response.status_code, 400)
+
+    def test_failed_append_leaves_the_dataset_as_it_was(self):
+        first = make_csv(200, seed=2)
+        stats = self.upload(first).json()
+        dataset = Dataset.objects.get()
+        # The last write before the commit fails, after the summary was saved
+        with mock.patch.object(Dataset, 'save', side_effect=OSError('disk full')):
+            response = self.client.post(f'/api/datasets/{dataset.pk}/append/',
+                                        {'file': SimpleUploadedFile('more.csv', make_csv(50, seed=3))})
+        self.assertEqual(response.status_code, 400)
+
+        with open(dataset.file.path, 'rb') as handle:
+            self.assertEqual(handle.read(), first)
+        self.assertEqual(len(ColumnarDataset(dataset.columnar_path)), 200)
+        self.assertEqual(DatasetSummary.objects.get(dataset=dataset).to_stats(), stats)
+
+
+class RowPaginationTests(ApiTestCase):
+    """Cursor and offset pagination of the rows endpoint."""
+
+    def setUp(self):
+        super().setUp()
+        self.upload(make_csv(50, seed=5))
+        self.url = f'/api/datasets/{Dataset.objects.get().pk}/rows/'
+
+    def rows(self, response):
+        self.assertEqual(response.status_code, 200, response.content)
+        return [result['row'] for result in response.json()['results']]
+
+    def test_cursor_walks_every_row_both_ways(self):
+        url, pages = f'{self.url}?page_size=7&ordering=-flowrate', []
+        while url:
+            response = self.client.get(url)
+            pages.append(self.rows(response))
+            url = response.json()['next']
+        self.assertEqual(sorted(row for page in pages for row in page), list(range(50)))
+
+        url, back = response.json()['previous'], []
+        while url:
+            response = self.client.get(url)
+            back.insert(0, self.rows(response))
+            url = response.json()['previous']
+        self.assertEqual(back, pages[:-1])
+
+    def test_offset_links_continue_with_cursors(self):
+        response = self.client.get(f'{self.url}?page_size=2&offset=10')
+        self.assertEqual(self.rows(response), [10, 11])
+        links = response.json()
+        for link in (links['next'], links['previous']):
+            self.assertNotIn('offset=', link)
+        self.assertEqual(self.rows(self.client.get(links['next'])), [12, 13])
+        self.assertEqual(self.rows(self.client.get(links['previous'])), [8, 9])
+
+    def test_cursor_and_offset_together_are_refused(self):
+        response = self.client.get(f'{self.url}?page_size=2')
+        cursor_url = response.json()['next']
+        self.assertEqual(self.client.get(f'{cursor_url}&offset=4').status_code, 400)
+
+
+class RetentionTests(ApiTestCase):
+    """The dataset being uploaded counts towards the retention limits."""
+
+    def test_max_count(self):
+        with override_settings(DATASET_RETENTION={'MAX_COUNT': 3}):
+            for seed in range(5):
+                self.upload(make_csv(5, seed=seed))
+        kept = set(Dataset.objects.values_list('content_hash', flat=True))
+        self.assertEqual(kept, {hashlib.sha256(make_csv(5, seed=seed)).hexdigest() for seed in (2, 3, 4)})
+
+    def test_max_bytes(self):
+        sizes = [len(make_csv(5, seed=seed)) for seed in range(5)]
+        with override_settings(DATASET_RETENTION={'MAX_BYTES': sum(sizes[-2:])}):
+            for seed in range(5):
+                self.upload(make_csv(5, seed=seed))
+        self.assertEqual(sorted(Dataset.objects.values_list('file_size', flat=True)), sorted(sizes[-2:]))
+
+    def test_newest_is_always_kept(self):
+        with override_settings(DATASET_RETENTION={'MAX_BYTES': 1}):
+            self.upload(make_csv(5, seed=1))
+            self.upload(make_csv(5, seed=2))
+        self.assertEqual(Dataset.objects.count(), 1)
+
+
+class DatasetStatsTests(ApiTestCase):
+    """Uploads store a summary that the stats endpoint serves as is."""
+
+    @override_settings(UPLOAD_STREAMING_PARSE=False)
+    def test_stored_summary_matches_endpoint(self):
+        data = make_csv(200, seed=6)
+        uploaded = self.upload(data).json()
+        dataset = Dataset.objects.get()
+        summary = DatasetSummary.objects.get(dataset=dataset)
+        self.assertEqual(summary.to_stats(), uploaded)
+
+        frame = parse(data, 'c')
+        self.assertEqual(summary.total_equipment_count, len(frame))
+        self.assertEqual(summary.average_flowrate, round(frame['Flowrate'].mean(), 2))
+        self.assertEqual(summary.equipment_type_distribution, frame['Type'].value_counts().to_dict())
+
+        response = self.client.get(f'/api/datasets/{dataset.pk}/stats/')
+        self.assertEqual(response.status_code, 200)
+        served = response.json()
+        self.assertEqual(served.pop('dataset'), dataset.pk)
+        self.assertTrue(served.pop('computed_at'))
+        self.assertEqual(served, uploaded)
+
+    def test_unknown_dataset(self):
+        self.assertEqual(self.client.get('/api/datasets/999/stats/').status_code, 404)
+
+
+class AsyncUploadJobTests(TempMediaMixin, TransactionTestCase):
+    """?async=1 uploads: 202, then the job moves to done or failed.
+
+    Jobs are handed over on commit, so this runs outside a test transaction
+    and the worker pool is replaced by an inline executor.
+    """
+
+    def setUp(self):
+        super().setUp()
+        patcher = mock.patch('api.jobs.get_executor', return_value=InlineExecutor())
+        patcher.start()
+        self.addCleanup(patcher.stop)
+
+    def submit(self, data):
+        response = self.upload(data, query='?async=1')
+        self.assertEqual(response.status_code, 202)
+        body = response.json()
+        self.assertEqual(response['Location'], body['status_url'])
+        return self.client.get(body['status_url']).json()
+
+    def test_done(self):
+        data = make_csv(50, seed=7)
+        job = self.submit(data)
+        self.assertEqual((job['status'], job['progress'], job['error']), ('done', 1.0, ''))
+        self.assertEqual(job['stats']['total_equipment_count'], 50)
+        self.assertEqual(job['stats'], Dataset.objects.get(pk=job['dataset']).summary.to_stats())
+
+    def test_failed(self):
+        job = self.submit(HEADER + b'P-1,Pump,high,5.2,110\n')
+        self.assertEqual(job['status'], 'failed')
+        self.assertIn('Error processing CSV', job['error'])
+        self.assertIsNone(job['stats'])
+        self.assertFalse(Dataset.objects.exists())
+
+    def test_dataset_removed_before_the_job_runs(self):
+        queued = []
+        with mock.patch('api.jobs.get_executor') as get_executor:
+            get_executor.return_value.submit.side_effect = lambda *call: queued.append(call)
+            response = self.upload(make_csv(10, seed=8), query='?async=1')
+        Dataset.objects.all().delete()
+        func, *args = queued[0]
+        func(*args)
+        job = UploadJob.objects.get(pk=response.json()['job_id'])
+        self.assertEqual(job.status, UploadJob.FAILED)
+        self.assertEqual(job.error, "The dataset was removed before it could be processed.")
+
+
+class UploadDedupTests(ApiTestCase):
+    """A repeated upload is answered from the stored summary without being parsed."""
+
+    def test_duplicate_is_not_parsed(self):
+        data = make_csv(300)
+        self.assertEqual(self.upload(data)['X-Upload-Cache'], 'miss')
+        parsed = rows_parsed.value
+        response = self.upload(data)
+        self.assertEqual(response['X-Upload-Cache'], 'hit')
+        self.assertEqual(response.json()['total_equipment_count'], 300)
+        self.assertEqual(rows_parsed.value, parsed)
+
+    @mock.patch('api.uploads.DEDUP_HEAD_SIZE', 4096)
+    def test_same_head_other_tail(self):
+        data = make_csv(300)
+        self.upload(data)
+        response = self.upload(data + make_csv(50, seed=1, header=False))
+        self.assertEqual(response['X-Upload-Cache'], 'miss')
+        self.assertEqual(response.json()['total_equipment_count'], 350)
+        dataset = Dataset.objects.latest('uploaded_at')
+        self.assertEqual(dataset.summary.total_equipment_count, 350)
+        # Only the head matched, so the stored file was processed after all
+        self.assertEqual(len(ColumnarDataset(dataset.columnar_path)), 350)
+
+
+class GroupedStatsTests(ApiTestCase):
+    """Per-Type statistics agree with pandas over the whole file."""
+
+    def setUp(self):
+        super().setUp()
+        self.data = make_csv(2000, seed=5)
+        self.groups = parse(self.data, 'c').astype({'Type': str}).groupby('Type')
+
+    def test_moments_and_exact_percentiles(self):
+        stats = self.upload(self.data, query='?percentiles=exact').json()
+        self.assertEqual(stats['percentile_mode'], 'exact')
+        for equipment_type, group in self.groups:
+            entry = stats['type_statistics'][equipment_type]
+            self.assertEqual(entry['count'], len(group))
+            for column in ('Flowrate', 'Pressure', 'Temperature'):
+                with self.subTest(type=equipment_type, column=column):
+                    values = entry[column.lower()]
+                    series = group[column]
+                    self.assertAlmostEqual(values['mean'], series.mean(), places=2)
+                    self.assertAlmostEqual(values['std'], series.std(), places=2)
+                    self.assertEqual(values['min'], round(series.min(), 2))
+                    self.assertEqual(values['max'], round(series.max(), 2))
+                    for percentile in (50, 95, 99):
+                        self.assertAlmostEqual(values[f'p{percentile}'],
+                                               series.quantile(percentile / 100), places=2)
+
+    def test_sketch_percentiles_within_accuracy(self):
+        stats = self.upload(self.data).json()
+        self.assertEqual(stats['percentile_mode'], 'approximate')
+        for equipment_type, group in self.groups:
+            for column in ('Flowrate', 'Pressure', 'Temperature'):
+                values = np.sort(group[column].dropna().to_numpy())
+                for percentile in (50, 95, 99):
+                    with self.subTest(type=equipment_type, column=column, percentile=percentile):
+                        # The sketch answers with the value at rank floor(q * (n - 1))
+                        expected = values[int(percentile / 100 * (len(values) - 1))]
+                        estimate = stats['type_statistics'][equipment_type][column.lower()][f'p{percentile}']
+                        self.assertLessEqual(abs(estimate - expected), 0.01 * abs(expected) + 0.01)
+
+    def test_ties_keep_order_of_first_appearance(self):
+        rows = [b'V-1,Valve,1,1,1\n', b'P-1,Pump,1,1,1\n', b'P-2,Pump,1,1,1\n',
+                b'V-2,Valve,1,1,1\n', b'T-1,Tank,1,1,1\n']
+        stats = self.upload(HEADER + b''.join(rows)).json()
+        self.assertEqual(list(stats['equipment_type_distribution']), ['Valve', 'Pump', 'Tank'])
+        self.assertEqual(list(stats['type_statistics']), ['Valve', 'Pump', 'Tank'])
+
+        # A categorical Type column lists its categories sorted, not as they appear
+        chunk = parse(HEADER + b''.join(rows), 'c').astype({'Type': 'category'})
+        accumulator = StatsAccumulator()
+        accumulator.update(chunk)
+        self.assertEqual(list(accumulator.to_stats()['equipment_type_distribution']), ['Valve', 'Pump', 'Tank'])
+
+
+class OutlierTests(ApiTestCase):
+    """One planted outlier per Type is flagged against that Type's own baseline."""
+
+    def setUp(self):
+        super().setUp()
+        lines = [HEADER]
+        for i in range(400):
+            lines.append(f'P-{i},Pump,{95 + i % 11},{5 + i % 5 / 10},{100 + i % 7}\n'.encode())
+            lines.append(f'V-{i},Valve,{18 + i % 5},{2 + i % 5 / 10},{50 + i % 7}\n'.encode())
+        # A Valve flowrate that would be ordinary for a Pump
+        lines.insert(101, b'P-OUT,Pump,300,5.2,103\n')
+        lines.insert(502, b'V-OUT,Valve,100,2.2,53\n')
+        self.planted = {100: 'Pump', 501: 'Valve'}
+        self.data = b''.join(lines)
+        self.upload(self.data)
+        self.dataset = Dataset.objects.get()
+
+    def test_stored_baselines_and_flags(self):
+        baselines = self.dataset.summary.outlier_baselines
+        flowrates = parse(self.data, 'c').astype({'Type': str}).groupby('Type')['Flowrate']
+        for equipment_type, series in flowrates:
+            self.assertAlmostEqual(baselines[equipment_type]['Flowrate']['mean'], series.mean())
+            self.assertAlmostEqual(baselines[equipment_type]['Flowrate']['std'], series.std())
+        for equipment_type, low, high in (('Pump', 95, 105), ('Valve', 18, 22)):
+            quartiles = baselines[equipment_type]['Flowrate']
+            self.assertTrue(low <= quartiles['q1'] <= quartiles['q3'] <= high, quartiles)
+
+        flags = ColumnarDataset(self.dataset.columnar_path).outlier_flags()
+        self.assertEqual(np.flatnonzero(flags).tolist(), sorted(self.planted))
+        for row in self.planted:
+            self.assertEqual(flags[row], flag_bit(ZSCORE, 'Flowrate') | flag_bit(IQR, 'Flowrate'))
+
+    def outliers(self, query):
+        response = self.client.get(f'/api/datasets/{self.dataset.pk}/outliers/{query}')
+        self.assertEqual(response.status_code, 200, response.content)
+        return response.json()
+
+    def test_endpoint(self):
+        # The default thresholds read the stored flags, any other is evaluated on the fly
+        for query in ('?method=zscore', '?method=iqr', '?method=zscore&threshold=4',
+                      '?method=iqr&threshold=3'):
+            with self.subTest(query=query):
+                results = self.outliers(query)['results']
+                self.assertEqual({row['row']: row['type'] for row in results}, self.planted)
+                self.assertEqual([row['outliers'] for row in results], [['flowrate'], ['flowrate']])
+
+        self.assertEqual([row['equipment_name'] for row in self.outliers('?type=Valve')['results']], ['V-OUT'])
+        self.assertEqual(self.outliers('?metric=pressure')['results'], [])
+
+
+class TrendsTests(ApiTestCase):
+    """Trend points come oldest first, windowed by time and capped at the newest."""
+
+    def trends(self, query=''):
+        response = self.client.get(f'/api/trends/{query}')
+        self.assertEqual(response.status_code, 200, response.content)
+        return response.json()
+
+    def counts(self, query):
+        return [point['total_equipment_count'] for point in self.trends(query)]
+
+    def add_summaries(self, days):
+        start = timezone.make_aware(datetime(2024, 1, 1))
+        for day in days:
+            DatasetSummary.objects.create(
+                dataset_name=f'day-{day}.csv', uploaded_at=start + timedelta(days=day),
+                total_equipment_count=day, equipment_type_distribution={'Pump': day, 'Valve': 1},
+                type_statistics={'Pump': {'flowrate': {'mean': 10.0 * day}}},
+            )
+
+    def test_empty_history(self):
+        self.assertEqual(self.trends(), [])
+
+    def test_oldest_first(self):
+        self.add_summaries([3, 1, 2])
+        points = self.trends()
+        self.assertEqual([point['dataset_name'] for point in points], ['day-1.csv', 'day-2.csv', 'day-3.csv'])
+        self.assertEqual(points[1]['types'], {'Pump': {'count': 2, 'flowrate': 20.0, 'pressure': None,
+                                                       'temperature': None},
+                                              'Valve': {'count': 1, 'flowrate': None, 'pressure': None,
+                                                        'temperature': None}})
+
+    def test_window_and_limit(self):
+        self.add_summaries(range(10))
+        self.assertEqual(self.counts('?since=2024-01-03T00:00:00Z&until=2024-01-05T00:00:00Z'), [2, 3, 4])
+        # The newest points win, still listed oldest first
+        self.assertEqual(self.counts('?limit=3'), [7, 8, 9])
+        self.assertEqual(self.counts('?until=2024-01-05T00:00:00Z&limit=2'), [3, 4])
+        self.assertEqual(list(self.trends('?type=Valve')[0]['types']), ['Valve'])
+        self.assertEqual(self.client.get('/api/trends/?limit=0').status_code, 400)
+
+    def test_pruned_datasets_stay_on_the_trend(self):
+        for seed in range(7):
+            self.upload(make_csv(10 + seed, seed=seed), name=f'upload-{seed}.csv')
+        points = self.trends()
+        self.assertEqual([point['total_equipment_count'] for point in points], list(range(10, 17)))
+        self.assertEqual([point['dataset'] is None for point in points], [True] * 2 + [False] * 5)
+
+
+class ResponseCacheTests(ApiTestCase):
+    """History and stats answer 304 while current and change ETag with the data."""
+
+    def get(self, url, etag=None, expected=200):
+        headers = {'If-None-Match': etag} if etag else {}
+        response = self.client.get(url, headers=headers)
+        self.assertEqual(response.status_code, expected, response.content)
+        return response
+
+    def test_history(self):
+        self.upload(make_csv(10, seed=1))
+        etag = self.get('/api/history/')['ETag']
+        self.assertEqual(self.get('/api/history/', etag, 304)['ETag'], etag)
+        self.get('/api/history/', '*', 304)
+
+        self.upload(make_csv(10, seed=2), name='second.csv')
+        response = self.get('/api/history/', etag)
+        self.assertNotEqual(response['ETag'], etag)
+        self.assertEqual(len(response.json()), 2)
+
+        etag = response['ETag']
+        Dataset.objects.order_by('uploaded_at').first().delete()
+        response = self.get('/api/history/', etag)
+        self.assertNotEqual(response['ETag'], etag)
+        self.assertEqual(len(response.json()), 1)
+
+    def test_stats(self):
+        self.upload(make_csv(20, seed=1))
+        dataset = Dataset.objects.get()
+        url = f'/api/datasets/{dataset.pk}/stats/'
+        etag = self.get(url)['ETag']
+        self.get(url, etag, 304)
+
+        # Appending saves the summary, which drops the cached response
+        response = self.client.post(f'/api/datasets/{dataset.pk}/append/',
+                                    {'file': SimpleUploadedFile('more.csv', make_csv(5, seed=2))})
+        self.assertEqual(response.status_code, 200, response.content)
+        response = self.get(url, etag)
+        self.assertNotEqual(response['ETag'], etag)
+        self.assertEqual(response.json()['total_equipment_count'], 25)
+
+        dataset.delete()
+        self.get(url, response['ETag'], 404)
+
+
+@mock.patch('api.batch.get_process_pool', InlineExecutor)
+class BatchUploadTests(ApiTestCase):
+    """Batches of CSVs and zip archives are summarized per file and combined."""
+
+    def post(self, *files, expected=200):
+        response = self.client.post('/api/upload/batch/',
+                                    {'files': [SimpleUploadedFile(name, data) for name, data in files]})
+        self.assertEqual(response.status_code, expected, response.content)
+        return response.json()
+
+    def zip(self, members):
+        buffer = io.BytesIO()
+        with zipfile.ZipFile(buffer, 'w', zipfile.ZIP_DEFLATED) as archive:
+            for name, data in members:
+                archive.writestr(name, data)
+        return buffer.getvalue()
+
+    def test_files_and_archives(self):
+        first, second, third = make_csv(30, seed=1), make_csv(40, seed=2), make_csv(50, seed=3)
+        archive = self.zip([('inner/second.csv', second), ('notes.txt', b'skipped'), ('third.CSV', third)])
+        body = self.post(('first.csv', first), ('more.zip', archive))
+
+        self.assertEqual([result['name'] for result in body['files']],
+                         ['first.csv', 'inner/second.csv', 'third.CSV'])
+        self.assertEqual([result['stats']['total_equipment_count'] for result in body['files']], [30, 40, 50])
+        combined = self.upload(first + second[len(HEADER):] + third[len(HEADER):]).json()
+        self.assertEqual(body['combined']['total_equipment_count'], 120)
+        self.assertEqual(body['combined']['equipment_type_distribution'], combined['equipment_type_distribution'])
+        self.assertAlmostEqual(body['combined']['average_flowrate'], combined['average_flowrate'])
+
+    def test_partial_failure(self):
+        broken = make_csv(10, seed=2).replace(b'Flowrate', b'Flow', 1)
+        body = self.post(('good.csv', make_csv(20, seed=1)), ('broken.csv', broken))
+        good, failed = body['files']
+        self.assertEqual(good['stats']['total_equipment_count'], 20)
+        self.assertIn('error', failed)
+        self.assertEqual(body['combined'], good['stats'])
+
+    def test_extracted_size_cap(self):
+        data = make_csv(500, seed=1)
+        with self.settings(UPLOAD_MAX_DECOMPRESSED_SIZE=len(data) * 3 // 2):
+            self.post(('one.zip', self.zip([('a.csv', data)])))
+            # Each member fits, together they do not
+            body = self.post(('two.zip', self.zip([('a.csv', data), ('b.csv', data)])), expected=400)
+            self.assertIn('expands to more than', body['error'])
+            body = self.post(('big.zip', self.zip([('big.csv', data * 2)])), expected=400)
+            self.assertIn('expands to more than', body['error'])
+
+    def test_invalid_archive_and_empty_batch(self):
+        self.assertIn('not a valid zip archive', self.post(('bad.zip', b'not a zip'), expected=400)['error'])
+        self.assertEqual(self.client.post('/api/upload/batch/', {}).status_code, 400)
+
+
+class ChartTests(ApiTestCase):
+    """Charts render as PNG or SVG from the stored summary."""
+
+    def setUp(self):
+        super().setUp()
+        self.upload(make_csv(50, seed=1))
+        self.url = f'/api/datasets/{Dataset.objects.get().pk}/chart'
+
+    def test_formats(self):
+        response = self.client.get(f'{self.url}.png')
+        self.assertEqual(response.status_code, 200)
+        self.assertEqual(response['Content-Type'], 'image/png')
+        self.assertTrue(response.content.startswith(b'\x89PNG\r\n\x1a\n'))
+
+        response = self.client.get(f'{self.url}.svg?theme=light&width=600&height=300')
+        self.assertEqual(response.status_code, 200)
+        self.assertEqual(response['Content-Type'], 'image/svg+xml')
+        self.assertIn(b'<svg', response.content)
+
+    def test_invalid_parameters(self):
+        for query in ('?theme=neon', '?width=10', '?height=100000'):
+            with self.subTest(query=query):
+                response = self.client.get(f'{self.url}.png{query}')
+                self.assertEqual(response.status_code, 400)
+                self.assertEqual(response['Content-Type'], 'application/json')
+        self.assertEqual(self.client.get('/api/datasets/999999/chart.png').status_code, 404)
+
+    def test_rendered_once_per_variant(self):
+        with mock.patch('api.views.render_chart', wraps=render_chart) as render:
+            first = self.client.get(f'{self.url}.png')
+            second = self.client.get(f'{self.url}.png')
+            self.client.get(f'{self.url}.png?theme=light')
+        self.assertEqual(render.call_count, 2)
+        self.assertEqual(first.content, second.content)
+        self.assertEqual(first['ETag'], second['ETag'])
+
+
+class MetricsTests(ApiTestCase):
+    """/metrics exports the upload counters and stage timings as Prometheus text."""
+
+    def scrape(self):
+        response = self.client.get('/metrics')
+        self.assertEqual(response.status_code, 200)
+        self.assertTrue(response['Content-Type'].startswith('text/plain; version=0.0.4'))
+        samples = {}
+        for line in response.content.decode().splitlines():
+            if line and not line.startswith('#'):
+                name, value = line.rsplit(' ', 1)
+                samples[name] = float(value)
+        return samples
+
+    def test_upload_is_counted(self):
+        before = self.scrape()
+        data = make_csv(120)
+        self.upload(data)
+        after = self.scrape()
+
+        def grew(name):
+            return after.get(name, 0) - before.get(name, 0)
+
+        self.assertEqual(grew('csv_rows_parsed_total'), 120)
+        self.assertEqual(grew('csv_bytes_read_total'), len(data))
+        self.assertEqual(grew('upload_cache_misses_total'), 1)
+        self.assertEqual(grew('upload_request_seconds_count{operation="upload"}'), 1)
+        for name in ('receive', 'parse', 'aggregate', 'columnar', 'dedup', 'store', 'summary'):
+            with self.subTest(stage=name):
+                self.assertEqual(grew(f'upload_stage_seconds_count{{stage="{name}"}}'), 1)
+
+        self.upload(data)
+        self.assertEqual(self.scrape()['upload_cache_hits_total'] - before.get('upload_cache_hits_total', 0), 1)
+
+
+def reload_urls():
+    # api.urls picks the upload and history views at import (API_ASYNC_VIEWS)
+    for name in ('api.urls', 'config.urls'):
+        importlib.reload(importlib.import_module(name))
+    clear_url_caches()
+
+
+class AsyncViewTests(TempMediaMixin, TransactionTestCase):
+    """The ASGI upload and history views, driven through AsyncClient.
+
+    Parsing runs on the real worker pool, whose threads need their own
+    connections, so this runs outside a test transaction.
+    """
+
+    def setUp(self):
+        super().setUp()
+        self.addCleanup(reload_urls)
+        override = override_settings(API_ASYNC_VIEWS=True)
+        override.enable()
+        self.addCleanup(override.disable)
+        reload_urls()
+
+    async def post(self, data, name='equipment.csv'):
+        response = await self.async_client.post('/api/upload/', {'file': SimpleUploadedFile(name, data)})
+        self.assertEqual(response.status_code, 201, response.content)
+        return response
+
+    async def test_upload_dedup_and_history(self):
+        self.assertIs(resolve('/api/upload/').func.view_class, AsyncUploadView)
+        self.assertIs(resolve('/api/history/').func.view_class, AsyncHistoryView)
+        data = make_csv(80, seed=1)
+
+        first = await self.post(data)
+        self.assertEqual(first['X-Upload-Cache'], 'miss')
+        self.assertEqual(first.json()['total_equipment_count'], 80)
+        summary = await DatasetSummary.objects.aget()
+        self.assertEqual(first.json(), summary.to_stats())
+
+        second = await self.post(data, name='again.csv')
+        self.assertEqual(second['X-Upload-Cache'], 'hit')
+        self.assertEqual(second.json(), first.json())
+        self.assertEqual(await Dataset.objects.acount(), 1)
+
+        history = await self.async_client.get('/api/history/')
+        self.assertEqual(history.status_code, 200)
+        self.assertEqual([entry['id'] for entry in history.json()], [summary.dataset_id])
+
+        await self.post(make_csv(20, seed=2), name='other.csv')
+        current = await self.async_client.get('/api/history/', headers={'If-None-Match': history['ETag']})
+        self.assertEqual(current.status_code, 200)
+        self.assertEqual(len(current.json()), 2)
+        unchanged = await self.async_client.get('/api/history/', headers={'If-None-Match': current['ETag']})
+        self.assertEqual(unchanged.status_code, 304)
+
+    async def test_invalid_file(self):
+        response = await self.async_client.post(
+            '/api/upload/', {'file': SimpleUploadedFile('broken.csv', HEADER + b'P-1,Pump,high,5.2,110\n')}
+        )
+        self.assertEqual(response.status_code, 400)
+        self.assertIn('Error processing CSV', response.json()['error'])
+        self.assertFalse(await Dataset.objects.aexists())
+
+
+class CompressedUploadTests(ApiTestCase):
+    """gzip and zstd files and request bodies are read like the plain CSV."""
+
+    def setUp(self):
+        super().setUp()
+        self.data = make_csv(300, seed=6)
+
+    def post_encoded(self, body, encoding='gzip'):
+        return self.client.post('/api/upload/', body, content_type=f'multipart/form-data; boundary={BOUNDARY}',
+                                headers={'Content-Encoding': encoding})
+
+    def upload_raw(self, data, name):
+        return self.client.post('/api/upload/', {'file': SimpleUploadedFile(name, data)})
+
+    def multipart(self, data):
+        return encode_multipart(BOUNDARY, {'file': SimpleUploadedFile('equipment.csv', data)})
+
+    def assert_rejected(self, response, message):
+        self.assertEqual(response.status_code, 400, response.content)
+        self.assertIn(message, response.json()['error'])
+        self.assertFalse(Dataset.objects.exists())
+        staging = os.path.join(self.media_root, 'datasets', '.incoming')
+        self.assertEqual(os.listdir(staging) if os.path.isdir(staging) else [], [])
+
+    def test_compressed_files(self):
+        expected = parse(self.data, 'c')
+        compressors = {'equipment.csv.gz': gzip.compress}
+        if zstandard is not None:
+            compressors['equipment.csv.zst'] = zstandard.ZstdCompressor().compress
+        for name, compress in compressors.items():
+            with self.subTest(name=name):
+                stats = self.upload(compress(self.data), name=name).json()
+                self.assertEqual(stats['total_equipment_count'], 300)
+                dataset = Dataset.objects.latest('uploaded_at')
+                self.assertTrue(dataset.file.name.endswith(name[-4:]))
+                assert_same_rows(dataset.columnar().to_frame(), expected)
+
+    def test_gzip_request_body(self):
+        response = self.post_encoded(gzip.compress(self.multipart(self.data)))
+        self.assertEqual(response.status_code, 201, response.content)
+        self.assertEqual(response.json()['total_equipment_count'], 300)
+        with open(Dataset.objects.get().file.path, 'rb') as handle:
+            self.assertEqual(handle.read(), self.data)
+
+    def test_corrupt_streams(self):
+        compressed = gzip.compress(self.data)
+        self.assert_rejected(self.upload_raw(b'not gzip at all', 'equipment.csv.gz'), 'not valid gzip data')
+        self.assert_rejected(self.upload_raw(compressed[:len(compressed) // 2], 'equipment.csv.gz'),
+                             'ends before the end')
+        self.assert_rejected(self.post_encoded(b'not gzip at all'), 'not valid gzip data')
+        self.assert_rejected(self.post_encoded(gzip.compress(self.multipart(self.data))[:-100]),
+                             'ends before the end')
+        self.assert_rejected(self.post_encoded(self.multipart(self.data), 'br'), 'Unsupported Content-Encoding')
+
+    def test_decompressed_size_cap(self):
+        with self.settings(UPLOAD_MAX_DECOMPRESSED_SIZE=len(self.data) // 2):
+            self.assert_rejected(self.upload_raw(gzip.compress(self.data), 'equipment.csv.gz'),
+                                 'expands to more than')
+            self.assert_rejected(self.post_encoded(gzip.compress(self.multipart(self.data))),
+                                 'expands to more than')
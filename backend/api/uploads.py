@@ -0,0 +1,203 @@
+from django.conf import settings
+from django.core.files.storage import default_storage
+from django.core.files.uploadedfile import UploadedFile
+from django.core.files.uploadhandler import FileUploadHandler
+import hashlib
+import os
+import shutil
+import uuid
+from .columnar import ColumnarWriter, columnar_path
+from .compression import Decompressor, compression_for_name
+from .ingest import CSVStreamParser, DatasetError
+from .metrics import stage
+from .models import Dataset
+from .processing import feed_chunks
+from .stats import StatsAccumulator
+
+# Uploads are written here, inside storage, so saving them is a rename
+STAGING_DIR = 'datasets/.incoming'
+# Leading bytes hashed separately, so a likely duplicate is spotted before it is parsed
+DEDUP_HEAD_SIZE = 1 << 20
+
+
+class HashingUploadHandler(FileUploadHandler):
+    """Hashes every uploaded file while its bytes stream in.
+
+    The data is passed through untouched, so the regular handlers further down
+    the chain still build the UploadedFile; this handler only records the
+    SHA-256 digest of each file field in ``digests``, and in ``head_digests``
+    the digest of its first DEDUP_HEAD_SIZE bytes as soon as those are in.
+    """
+
+    def __init__(self, request=None):
+        super().__init__(request)
+        self.digests = {}
+        self.head_digests = {}
+        self._hash = None
+        self._head = None
+        self._head_size = 0
+
+    def new_file(self, *args, **kwargs):
+        super().new_file(*args, **kwargs)
+        self._hash = hashlib.sha256()
+        self._head = hashlib.sha256()
+        self._head_size = 0
+
+    def receive_data_chunk(self, raw_data, start):
+        self._hash.update(raw_data)
+        if self._head_size < DEDUP_HEAD_SIZE:
+            data = raw_data[:DEDUP_HEAD_SIZE - self._head_size]
+            self._head.update(data)
+            self._head_size += len(data)
+            if self._head_size == DEDUP_HEAD_SIZE:
+                self.head_digests[self.field_name] = self._head.hexdigest()
+        return raw_data
+
+    def file_complete(self, file_size):
+        self.digests[self.field_name] = self._hash.hexdigest()
+        self.head_digests[self.field_name] = self._head.hexdigest()
+        return None
+
+
+class StagedUploadedFile(UploadedFile):
+    """An upload already written to a staging file inside storage.
+
+    It exposes ``temporary_file_path()``, so FileSystemStorage moves it into
+    place instead of copying it. Whatever is still staged when the file is
+    closed (an upload that was rejected or answered from the cache) is removed.
+    """
+
+    def __init__(self, path, name, content_type, size, charset, content_type_extra=None, mode='w+b'):
+        super().__init__(open(path, mode), name, content_type, size, charset, content_type_extra)
+        self.path = path
+        self.accumulator = None
+        self.columnar_staging = None
+        self.error = None
+
+    def temporary_file_path(self):
+        return self.path
+
+    def close(self):
+        self.file.close()
+        if os.path.exists(self.path):
+            os.remove(self.path)
+        if self.columnar_staging:
+            shutil.rmtree(self.columnar_staging, ignore_errors=True)
+
+
+class StreamingStatsUploadHandler(FileUploadHandler):
+    """Parses the uploaded CSV while it is received, reading each byte once.
+
+    Incoming chunks are written to a staging file in storage and pushed
+    through a ``CSVStreamParser`` into a ``StatsAccumulator`` and, when
+    DATASET_COLUMNAR_CACHE is on, a ``ColumnarWriter``. The resulting
+    ``StagedUploadedFile`` carries the accumulator, the staged columnar cache
+    and any parse error for ``api.processing.process_streamed_upload()``.
+    A parse error stops the parsing but not the upload; the view reports it.
+    A ``.gz`` or ``.zst`` file is staged as received and decompressed on its
+    way into the parser.
+
+    Given the ``HashingUploadHandler`` that runs before it, the first
+    DEDUP_HEAD_SIZE bytes are held back until their digest is known. When a
+    stored dataset starts with the same bytes the upload is probably a
+    duplicate, so it is only staged: ``accumulator`` stays None and the view
+    processes the stored file if the dedup check misses after all.
+    """
+
+    def __init__(self, request=None, hasher=None):
+        super().__init__(request)
+        self.hasher = hasher
+
+    def new_file(self, *args, **kwargs):
+        super().new_file(*args, **kwargs)
+        staged_name = default_storage.path(f'{STAGING_DIR}/{uuid.uuid4().hex}.csv')
+        os.makedirs(os.path.dirname(staged_name), exist_ok=True)
+        self.file = StagedUploadedFile(staged_name, self.file_name, self.content_type, 0,
+                                       self.charset, self.content_type_extra)
+        self.file.accumulator = StatsAccumulator()
+        self.parser = CSVStreamParser()
+        self.writer = None
+        if settings.DATASET_COLUMNAR_CACHE:
+            self.file.columnar_staging = columnar_path(staged_name)
+            self.writer = ColumnarWriter(self.file.columnar_staging)
+        self.decompressor = None
+        compression = compression_for_name(self.file_name)
+        if compression:
+            self._consume(self._start_decompressor, compression)
+        self.head = [] if self.hasher else None
+
+    def receive_data_chunk(self, raw_data, start):
+        self.file.write(raw_data)
+        if self.head is not None:
+            self.head.append(raw_data)
+            if self.field_name in self.hasher.head_digests:
+                self._release_head()
+        elif self.file.accumulator is not None:
+            self._feed(raw_data)
+        return None
+
+    def file_complete(self, file_size):
+        if self.head is not None:
+            self._release_head()
+        if self.file.accumulator is None:
+            self.file.seek(0)
+            self.file.size = file_size
+            return self.file
+        if self.file.error is None and self.decompressor:
+            self._consume(self.decompressor.close)
+        if self.file.error is None:
+            self._consume(self._close)
+        if self.writer:
+            if self.file.error is None:
+                self.writer.close()
+            else:
+                self.writer.abort()
+                self.file.columnar_staging = None
+        self.file.seek(0)
+        self.file.size = file_size
+        return self.file
+
+    def upload_interrupted(self):
+        if hasattr(self, 'file'):
+            if self.writer:
+                self.writer.abort()
+            self.file.close()
+
+    def _release_head(self):
+        data, self.head = b''.join(self.head), None
+        head_hash = self.hasher.head_digests[self.field_name]
+        with stage('dedup'):
+            duplicate = Dataset.objects.filter(head_hash=head_hash).exists()
+        if not duplicate:
+            self._feed(data)
+            return
+        self.file.accumulator = None
+        if self.writer:
+            self.writer.abort()
+            self.writer = None
+            self.file.columnar_staging = None
+
+    def _feed(self, data):
+        if self.file.error is None:
+            self._consume(self.decompressor.write if self.decompressor else self._parse, data)
+
+    def _start_decompressor(self, compression):
+        self.decompressor = Decompressor(compression, self._parse, settings.UPLOAD_MAX_DECOMPRESSED_SIZE)
+
+    def _parse(self, data):
+        with stage('parse'):
+            chunks = self.parser.feed(data)
+        feed_chunks(chunks, self.file.accumulator, self.writer)
+
+    def _close(self):
+        with stage('parse'):
+            chunks = self.parser.close()
+        feed_chunks(chunks, self.file.accumulator, self.writer)
+
+    def _consume(self, step, *args):
+        try:
+            step(*args)
+        except DatasetError as e:
+            self.file.error = e
+        except Exception as e:
+            self.file.error = DatasetError(f"Error processing CSV: {str(e)}")
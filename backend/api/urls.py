@@ -1,7 +1,33 @@
+from django.conf import settings
 from django.urls import path
-from .views import UploadView, HistoryView
+from .views import (UploadView, UploadCacheStatsView, HistoryView, DatasetStatsView, DatasetRowsView,
+                    DatasetOutliersView, DatasetAppendView, UploadJobView, TrendsView, BatchUploadView,
+                    DatasetChartView, AsyncUploadView, AsyncHistoryView, ChunkedUploadView,
+                    ChunkedUploadDetailView, ChunkedUploadChunkView, ChunkedUploadCompleteView)
+
+# ASGI deployments serve uploads and history without holding a thread
+if settings.API_ASYNC_VIEWS:
+    upload_view, history_view = AsyncUploadView.as_view(), AsyncHistoryView.as_view()
+else:
+    upload_view, history_view = UploadView.as_view(), HistoryView.as_view()
 
 urlpatterns = [
-    path('upload/', UploadView.as_view(), name='file-upload'),
-    path('history/', HistoryView.as_view(), name='dataset-history'),
+    path('upload/', upload_view, name='file-upload'),
+    path('upload/batch/', BatchUploadView.as_view(), name='batch-upload'),
+    path('upload/cache/', UploadCacheStatsView.as_view(), name='upload-cache-stats'),
+    path('upload/chunked/', ChunkedUploadView.as_view(), name='chunked-uploads'),
+    path('upload/chunked/<uuid:pk>/', ChunkedUploadDetailView.as_view(), name='chunked-upload'),
+    path('upload/chunked/<uuid:pk>/chunks/<int:index>/', ChunkedUploadChunkView.as_view(),
+         name='chunked-upload-chunk'),
+    path('upload/chunked/<uuid:pk>/complete/', ChunkedUploadCompleteView.as_view(),
+         name='chunked-upload-complete'),
+    path('history/', history_view, name='dataset-history'),
+    path('trends/', TrendsView.as_view(), name='dataset-trends'),
+    path('jobs/<uuid:pk>/', UploadJobView.as_view(), name='upload-job'),
+    path('datasets/<int:pk>/stats/', DatasetStatsView.as_view(), name='dataset-stats'),
+    path('datasets/<int:pk>/chart.png', DatasetChartView.as_view(image_format='png'), name='dataset-chart-png'),
+    path('datasets/<int:pk>/chart.svg', DatasetChartView.as_view(image_format='svg'), name='dataset-chart-svg'),
+    path('datasets/<int:pk>/rows/', DatasetRowsView.as_view(), name='dataset-rows'),
+    path('datasets/<int:pk>/outliers/', DatasetOutliersView.as_view(), name='dataset-outliers'),
+    path('datasets/<int:pk>/append/', DatasetAppendView.as_view(), name='dataset-append'),
 ]
@@ -1,11 +1,82 @@
 from rest_framework.views import APIView
-from rest_framework.generics import ListAPIView
+from rest_framework.generics import ListAPIView, RetrieveAPIView, RetrieveDestroyAPIView
 from rest_framework.response import Response
 from rest_framework.parsers import MultiPartParser, FormParser
 from rest_framework import status
-import pandas as pd
-from .models import Dataset
-from .serializers import DatasetSerializer, DatasetHistorySerializer
+from rest_framework.exceptions import NotFound
+from rest_framework.negotiation import BaseContentNegotiation
+from rest_framework.utils.urls import remove_query_param, replace_query_param
+from asgiref.sync import sync_to_async
+from django.conf import settings
+from django.http import HttpResponse
+from django.http.multipartparser import MultiPartParserError
+from django.core.files.uploadhandler import TemporaryFileUploadHandler
+from django.shortcuts import get_object_or_404
+from django.urls import reverse
+from django.views import View
+from django.views.decorators.csrf import csrf_exempt
+from django.utils.http import quote_etag
+import numpy as np
+import tempfile
+from .batch import aggregate_files, extract_archive
+from .charts import CONTENT_TYPES, chart_cache, render_chart
+from .chunked import UploadConflict, discard_upload, finalize_upload, receive_chunk
+from .compression import compression_for_encoding, decompress_request_body
+from .caching import HISTORY_KEY, acached_response, cached_response, json_response, make_etag, stats_key
+from .ingest import DatasetError
+from .jobs import completed_upload_job, enqueue_upload_job, run_in_worker
+from .metrics import (render_text, stage, track_upload, upload_cache_hits, upload_cache_misses,
+                      upload_rejections, upload_size)
+from .models import ChunkedUpload, Dataset, DatasetSummary, UploadJob
+from .outliers import OutlierDetector, baselines_from_columns
+from .processing import append_to_dataset, process_dataset, process_streamed_upload
+from .rows import RANGE_FIELDS, RowQuery
+from .serializers import (DatasetSerializer, DatasetHistorySerializer, DatasetStatsSerializer,
+                          DatasetRowsQuerySerializer, DatasetOutliersQuerySerializer, DatasetTrendSerializer,
+                          DatasetTrendQuerySerializer, DatasetChartQuerySerializer, UploadJobSerializer,
+                          ChunkedUploadSerializer)
+from .stats import PERCENTILE_MODES
+from .uploads import HashingUploadHandler, StagedUploadedFile, StreamingStatsUploadHandler
+
+def reject(reason, data, response_class=Response):
+    """400 response for a rejected upload, counted by ``reason``."""
+    upload_rejections.inc(reason=reason)
+    return response_class(data, status=status.HTTP_400_BAD_REQUEST)
+
+def invalid_percentiles(percentiles):
+    if percentiles is not None and percentiles not in PERCENTILE_MODES:
+        return {"error": f"percentiles must be one of {', '.join(PERCENTILE_MODES)}"}
+    return None
+
+def install_upload_handlers(request, run_async):
+    """Hash, and for synchronous uploads parse, the file while it is received.
+
+    Must run before the multipart body is parsed; returns the hashing handler.
+    The full digest is only known once the whole file is in, so the streamed
+    parse waits for the digest of the file's head and skips an upload whose
+    head matches a stored dataset; the view then answers it from the cache or,
+    if the rest differs, processes the stored file.
+    """
+    hasher = HashingUploadHandler(request)
+    request.upload_handlers.insert(0, hasher)
+    if settings.UPLOAD_STREAMING_PARSE and not run_async:
+        request.upload_handlers.insert(1, StreamingStatsUploadHandler(request, hasher))
+    return hasher
+
+def job_accepted(job, response_class=Response, headers=None):
+    """202 response for an ``?async=1`` upload, pointing at its job."""
+    status_url = reverse('upload-job', args=[job.pk])
+    return response_class(
+        {"job_id": str(job.pk), "status": job.status, "status_url": status_url},
+        status=status.HTTP_202_ACCEPTED,
+        headers={'Location': status_url, **(headers or {})}
+    )
+
+def discard_staged_uploads(request):
+    # A compressed body that broke off mid-file stops the multipart parser
+    # before Django closes that file; this drops whatever the handlers staged
+    for handler in request.upload_handlers:
+        handler.upload_interrupted()
 
 class HistoryView(ListAPIView):
     serializer_class = DatasetHistorySerializer
@@ -14,56 +85,460 @@ class HistoryView(ListAPIView):
         # Returns the last 5 uploaded datasets in reverse chronological order
         return Dataset.objects.all().order_by('-uploaded_at')[:5]
 
+    def list(self, request, *args, **kwargs):
+        def build():
+            datasets = list(self.get_queryset())
+            etag = make_etag(*((dataset.pk, dataset.uploaded_at.isoformat()) for dataset in datasets))
+            return etag, self.get_serializer(datasets, many=True).data
+        return cached_response(request, HISTORY_KEY, build)
+
+class AsyncHistoryView(View):
+    """``HistoryView`` for ASGI servers (API_ASYNC_VIEWS), with the query awaited."""
+
+    async def get(self, request, *args, **kwargs):
+        async def build():
+            datasets = [dataset async for dataset in Dataset.objects.order_by('-uploaded_at')[:5]]
+            etag = make_etag(*((dataset.pk, dataset.uploaded_at.isoformat()) for dataset in datasets))
+            return etag, DatasetHistorySerializer(datasets, many=True).data
+        return await acached_response(request, HISTORY_KEY, build)
+
+class DatasetStatsView(RetrieveAPIView):
+    # Served straight from the stored summary row; the CSV is never opened
+    serializer_class = DatasetStatsSerializer
+    queryset = DatasetSummary.objects.all()
+    lookup_field = 'dataset_id'
+    lookup_url_kwarg = 'pk'
+
+    def retrieve(self, request, *args, **kwargs):
+        def build():
+            summary = self.get_object()
+            # computed_at moves on every append, so it versions the stats
+            return make_etag(summary.dataset_id, summary.computed_at.isoformat()), self.get_serializer(summary).data
+        return cached_response(request, stats_key(kwargs['pk']), build)
+
+class TrendsView(APIView):
+    """Stored summary metrics of many uploads, oldest first, read in one query."""
+
+    def get(self, request, *args, **kwargs):
+        query = DatasetTrendQuerySerializer(data=request.query_params)
+        query.is_valid(raise_exception=True)
+        params = query.validated_data
+
+        summaries = DatasetSummary.objects.filter(uploaded_at__isnull=False).defer('aggregates', 'outlier_baselines')
+        if 'since' in params:
+            summaries = summaries.filter(uploaded_at__gte=params['since'])
+        if 'until' in params:
+            summaries = summaries.filter(uploaded_at__lte=params['until'])
+        # Newest points win when the window holds more than the limit
+        newest = summaries.order_by('-uploaded_at', '-pk')[:params.get('limit', settings.TRENDS_MAX_POINTS)]
+
+        serializer = DatasetTrendSerializer(reversed(list(newest)), many=True,
+                                            context={'request': request, 'types': params.get('type')})
+        return Response(serializer.data)
+
+class ImageContentNegotiation(BaseContentNegotiation):
+    # The URL picks the image format; errors are still rendered as JSON
+    def select_renderer(self, request, renderers, format_suffix=None):
+        return renderers[0], renderers[0].media_type
+
+class DatasetChartView(APIView):
+    """Server-rendered bar and pie charts of a dataset's stored summary."""
+    content_negotiation_class = ImageContentNegotiation
+    image_format = 'png'
+
+    def get(self, request, pk, *args, **kwargs):
+        summary = get_object_or_404(DatasetSummary, dataset_id=pk)
+        query = DatasetChartQuerySerializer(data=request.query_params)
+        query.is_valid(raise_exception=True)
+        params = query.validated_data
+
+        # computed_at changes on append, so images of older stats are never served
+        key = (pk, summary.computed_at.isoformat(), params['theme'], params['width'], params['height'],
+               self.image_format)
+        try:
+            image = chart_cache.get_or_set(key, lambda: render_chart(
+                summary.to_stats(), params['theme'], params['width'], params['height'], self.image_format
+            ))
+        except ImportError:
+            return Response({"error": "Chart rendering requires matplotlib."},
+                            status=status.HTTP_501_NOT_IMPLEMENTED)
+        response = HttpResponse(image, content_type=CONTENT_TYPES[self.image_format])
+        response['ETag'] = quote_etag(make_etag(*key))
+        return response
+
+class DatasetRowsView(APIView):
+    """Cursor-paginated, filtered and sorted rows read from the columnar cache."""
+
+    def get(self, request, pk, *args, **kwargs):
+        dataset = get_object_or_404(Dataset, pk=pk)
+        query = DatasetRowsQuerySerializer(data=request.query_params)
+        query.is_valid(raise_exception=True)
+        params = query.validated_data
+
+        columns = self.get_columns(dataset)
+        ranges = {
+            column: (params.get(f'{field}_min'), params.get(f'{field}_max'))
+            for field, column in RANGE_FIELDS.items()
+            if f'{field}_min' in params or f'{field}_max' in params
+        }
+        rows = RowQuery(columns, types=params.get('type'), ranges=ranges, ordering=params.get('ordering'))
+        results, next_cursor, previous_cursor = rows.page(
+            params.get('cursor'), params.get('page_size', settings.ROWS_PAGE_SIZE), params.get('offset', 0)
+        )
+        return Response({
+            "next": self.cursor_url(request, next_cursor),
+            "previous": self.cursor_url(request, previous_cursor),
+            "results": results
+        })
+
+    def get_columns(self, dataset):
+        try:
+            return dataset.columnar()
+        except FileNotFoundError:
+            raise NotFound("The file for this dataset is no longer available.")
+
+    def cursor_url(self, request, cursor):
+        if cursor is None:
+            return None
+        # An offset only picks the first page; links go on from the cursor
+        url = remove_query_param(request.build_absolute_uri(), 'offset')
+        return replace_query_param(url, 'cursor', cursor)
+
+class DatasetOutliersView(DatasetRowsView):
+    """Rows outside their Type's stored baseline, flagged by z-score or IQR."""
+
+    def get(self, request, pk, *args, **kwargs):
+        summary = get_object_or_404(DatasetSummary.objects.select_related('dataset'), dataset_id=pk)
+        query = DatasetOutliersQuerySerializer(data=request.query_params)
+        query.is_valid(raise_exception=True)
+        params = query.validated_data
+
+        columns = self.get_columns(summary.dataset)
+        if not summary.outlier_baselines and summary.total_equipment_count:
+            # Datasets processed before baselines existed get them once, here
+            summary.outlier_baselines = baselines_from_columns(columns)
+            summary.save(update_fields=['outlier_baselines'])
+
+        metrics = [RANGE_FIELDS[field] for field in params.get('metric', [])] or None
+        detector = OutlierDetector(columns, summary.outlier_baselines, params['method'],
+                                   params.get('threshold'), metrics)
+        rows = RowQuery(columns, types=params.get('type'), predicate=detector.matches)
+        results, next_cursor, previous_cursor = rows.page(
+            params.get('cursor'), params.get('page_size', settings.ROWS_PAGE_SIZE)
+        )
+        if results:
+            flags = detector.flags(np.array([row['row'] for row in results]))
+            for i, row in enumerate(results):
+                row['outliers'] = [column.lower() for column, flagged in flags.items() if flagged[i]]
+
+        return Response({
+            "method": detector.method,
+            "threshold": detector.threshold,
+            "next": self.cursor_url(request, next_cursor),
+            "previous": self.cursor_url(request, previous_cursor),
+            "results": results
+        })
+
+class BatchUploadView(APIView):
+    """Parse many CSVs, or zip archives of CSVs, in parallel; nothing is stored."""
+    parser_classes = (MultiPartParser, FormParser)
+
+    def post(self, request, *args, **kwargs):
+        # Every upload gets a temporary path the worker processes can open
+        request.upload_handlers[:] = [TemporaryFileUploadHandler(request)]
+        uploads = request.FILES.getlist('files')
+        if not uploads:
+            return Response({"files": ["No file was submitted."]}, status=status.HTTP_400_BAD_REQUEST)
+
+        with tempfile.TemporaryDirectory() as extract_dir:
+            files = []
+            try:
+                for upload in uploads:
+                    if upload.name.lower().endswith('.zip'):
+                        files.extend(extract_archive(upload, tempfile.mkdtemp(dir=extract_dir)))
+                    else:
+                        files.append((upload.name, upload.temporary_file_path()))
+                if len(files) > settings.BATCH_MAX_FILES:
+                    raise DatasetError(f"A batch may contain at most {settings.BATCH_MAX_FILES} files.",
+                                       reason='too_many_files')
+            except DatasetError as e:
+                return Response({"error": str(e)}, status=status.HTTP_400_BAD_REQUEST)
+
+            results, combined = aggregate_files(files)
+        return Response({"files": results, "combined": combined})
+
+class DatasetAppendView(APIView):
+    """Append new rows to a stored dataset, updating its summary incrementally."""
+    parser_classes = (MultiPartParser, FormParser)
+
+    def post(self, request, pk, *args, **kwargs):
+        with track_upload('append') as timings:
+            response = self.append(request, pk)
+            timings.fields['status'] = response.status_code
+            return response
+
+    def append(self, request, pk):
+        dataset = get_object_or_404(Dataset.objects.filter(summary__isnull=False), pk=pk)
+        try:
+            decompress_request_body(request)
+            with stage('receive'):
+                upload = request.data.get('file')
+        except DatasetError as e:
+            return reject(e.reason, {"error": str(e)})
+        if upload is None:
+            return reject('no_file', {"file": ["No file was submitted."]})
+        try:
+            stats = append_to_dataset(dataset, upload)
+        except DatasetError as e:
+            return reject(e.reason, {"error": str(e)})
+        return Response(stats)
+
+class ChunkedUploadView(APIView):
+    """Start a chunked, resumable upload (protocol in api/chunked.py)."""
+
+    def post(self, request, *args, **kwargs):
+        serializer = ChunkedUploadSerializer(data=request.data)
+        serializer.is_valid(raise_exception=True)
+        upload = serializer.save()
+        return Response(serializer.data, status=status.HTTP_201_CREATED,
+                        headers={'Location': reverse('chunked-upload', args=[upload.pk])})
+
+class ChunkedUploadDetailView(RetrieveDestroyAPIView):
+    """How far a chunked upload got, to resume it; DELETE abandons it."""
+    serializer_class = ChunkedUploadSerializer
+    queryset = ChunkedUpload.objects.all()
+
+    def perform_destroy(self, instance):
+        try:
+            discard_upload(instance)
+        except UploadConflict:
+            pass # Discarded concurrently
+
+class ChunkedUploadChunkView(APIView):
+    """PUT the raw bytes of chunk ``index`` (counted from 0) of a chunked upload.
+
+    Chunks must arrive in order; resending one that was already received is
+    a no-op, so a client that lost a response can simply retry.
+    """
+
+    def put(self, request, pk, index, *args, **kwargs):
+        upload = get_object_or_404(ChunkedUpload, pk=pk)
+        with track_upload('upload_chunk') as timings:
+            response = self.receive(request, upload, index)
+            timings.fields['status'] = response.status_code
+            return response
+
+    def receive(self, request, upload, index):
+        try:
+            length = int(request.META.get('CONTENT_LENGTH') or 0)
+        except ValueError:
+            length = 0
+        if length <= 0:
+            return reject('empty_chunk', {"error": "A chunk must have a Content-Length and must not be empty."})
+        if length > settings.UPLOAD_CHUNK_MAX_SIZE:
+            upload_rejections.inc(reason='chunk_too_large')
+            return Response({"error": f"Chunks may be at most {settings.UPLOAD_CHUNK_MAX_SIZE} bytes."},
+                            status=status.HTTP_413_REQUEST_ENTITY_TOO_LARGE)
+        try:
+            compression = compression_for_encoding(request.META.get('HTTP_CONTENT_ENCODING'))
+            receive_chunk(upload, index, request.stream, length, compression)
+        except UploadConflict as e:
+            return Response({"error": str(e), "next_chunk": upload.next_chunk}, status=status.HTTP_409_CONFLICT)
+        except DatasetError as e:
+            return reject(e.reason, {"error": str(e)})
+        return Response(ChunkedUploadSerializer(upload).data)
+
+class ChunkedUploadCompleteView(APIView):
+    """Finalize a fully sent chunked upload into a dataset and return its stats."""
+
+    def post(self, request, pk, *args, **kwargs):
+        upload = get_object_or_404(ChunkedUpload, pk=pk)
+        with track_upload('upload_finalize') as timings:
+            response = self.finalize(request, upload)
+            timings.fields['status'] = response.status_code
+            return response
+
+    def finalize(self, request, upload):
+        percentiles = request.query_params.get('percentiles')
+        error = invalid_percentiles(percentiles)
+        if error:
+            return reject('invalid_parameters', error)
+        try:
+            stats = finalize_upload(upload, percentiles=percentiles)
+        except UploadConflict as e:
+            return Response({"error": str(e)}, status=status.HTTP_409_CONFLICT)
+        except DatasetError as e:
+            return reject(e.reason, {"error": str(e)})
+        return Response(stats, status=status.HTTP_201_CREATED)
+
+class UploadJobView(RetrieveAPIView):
+    serializer_class = UploadJobSerializer
+    queryset = UploadJob.objects.select_related('dataset__summary')
+
+class UploadCacheStatsView(APIView):
+    def get(self, request, *args, **kwargs):
+        hits, misses = upload_cache_hits.value, upload_cache_misses.value
+        total = hits + misses
+        return Response({
+            "hits": hits,
+            "misses": misses,
+            "hit_ratio": round(hits / total, 4) if total else 0
+        })
+
 class UploadView(APIView):
     parser_classes = (MultiPartParser, FormParser)
 
     def post(self, request, *args, **kwargs):
-        file_serializer = DatasetSerializer(data=request.data)
-        if file_serializer.is_valid():
-            dataset = file_serializer.save()
-            
-            # Process the file
+        with track_upload('upload') as timings:
+            response = self.upload(request)
+            timings.fields['status'] = response.status_code
+            timings.fields['cache'] = response.get('X-Upload-Cache')
+            return response
+
+    def upload(self, request):
+        percentiles = request.query_params.get('percentiles')
+        error = invalid_percentiles(percentiles)
+        if error:
+            return reject('invalid_parameters', error)
+
+        # Must be installed before request.data triggers multipart parsing
+        run_async = request.query_params.get('async') in ('1', 'true', 'yes')
+        try:
+            decompress_request_body(request)
+        except DatasetError as e:
+            return reject(e.reason, {"error": str(e)})
+        hasher = install_upload_handlers(request, run_async)
+
+        # Receiving the body includes the streamed parse when that is enabled
+        with stage('receive'):
             try:
-                file_path = dataset.file.path
-                df = pd.read_csv(file_path)
-                
-                # Validation: Check columns
-                required_columns = {'Equipment Name', 'Type', 'Flowrate', 'Pressure', 'Temperature'}
-                if not required_columns.issubset(df.columns):
-                    dataset.delete() # Invalid file, don't keep it
-                    return Response(
-                        {"error": f"Missing columns. Required: {required_columns}"}, 
-                        status=status.HTTP_400_BAD_REQUEST
-                    )
-                
-                # Handle empty dataset
-                if df.empty:
-                    stats = {
-                        "total_equipment_count": 0,
-                        "average_flowrate": 0,
-                        "average_pressure": 0,
-                        "average_temperature": 0,
-                        "equipment_type_distribution": {}
-                    }
-                    return Response(stats, status=status.HTTP_201_CREATED)
-
-                # Calculations
-                distribution = df['Type'].value_counts().to_dict()
-                # Ensure values are standard Python ints (not numpy types) for JSON serialization
-                distribution = {k: int(v) for k, v in distribution.items()}
-
-                stats = {
-                    "total_equipment_count": int(len(df)),
-                    "average_flowrate": round(float(df['Flowrate'].mean()), 2),
-                    "average_pressure": round(float(df['Pressure'].mean()), 2),
-                    "average_temperature": round(float(df['Temperature'].mean()), 2),
-                    "equipment_type_distribution": distribution
-                }
-                
-                return Response(stats, status=status.HTTP_201_CREATED)
-
-            except Exception as e:
-                dataset.delete() # Error processing, don't keep
-                return Response({"error": f"Error processing CSV: {str(e)}"}, status=status.HTTP_400_BAD_REQUEST)
-        
-        return Response(file_serializer.errors, status=status.HTTP_400_BAD_REQUEST)
+                file_serializer = DatasetSerializer(data=request.data)
+            except DatasetError as e:
+                discard_staged_uploads(request)
+                return reject(e.reason, {"error": str(e)})
+            valid = file_serializer.is_valid()
+        if not valid:
+            return reject('invalid_file', file_serializer.errors)
+
+        upload = request.data['file']
+        upload_size.observe(upload.size)
+        content_hash = hasher.digests.get('file', '')
+        head_hash = hasher.head_digests.get('file', '')
+
+        # Same bytes already processed: answer from the stored summary without
+        # processing the stored file (the streamed parse skipped it by its head)
+        percentile_mode = percentiles or settings.STATS_PERCENTILE_MODE
+        with stage('dedup'):
+            cached = (Dataset.objects.filter(content_hash=content_hash, summary__percentile_mode=percentile_mode)
+                      .select_related('summary').order_by('-uploaded_at').first())
+        if cached is not None:
+            upload_cache_hits.inc()
+            if run_async:
+                return job_accepted(completed_upload_job(cached), headers={'X-Upload-Cache': 'hit'})
+            return Response(cached.summary.to_stats(), status=status.HTTP_201_CREATED,
+                            headers={'X-Upload-Cache': 'hit'})
+        upload_cache_misses.inc()
+
+        dataset = file_serializer.save(content_hash=content_hash, head_hash=head_hash)
+
+        # ?async=1 answers immediately and leaves parsing to the worker pool
+        if run_async:
+            return job_accepted(enqueue_upload_job(dataset, percentiles))
+
+        # Stats were accumulated while the upload streamed in; otherwise (or if
+        # only its head matched a stored dataset) the stored file is processed
+        # in bounded chunks so memory stays flat
+        try:
+            if isinstance(upload, StagedUploadedFile) and upload.accumulator is not None:
+                stats = process_streamed_upload(dataset, upload, percentiles=percentiles)
+            else:
+                stats = process_dataset(dataset, percentiles=percentiles)
+        except DatasetError as e:
+            return reject(e.reason, {"error": str(e)})
+        return Response(stats, status=status.HTTP_201_CREATED, headers={'X-Upload-Cache': 'miss'})
+
+class AsyncUploadView(View):
+    """``UploadView`` for ASGI servers (API_ASYNC_VIEWS).
+
+    Database access is awaited, while parsing the multipart body (which runs
+    the streamed stats pass) and processing the stored file run on the
+    upload worker pool, so one process keeps serving other requests while
+    many slow uploads are in flight.
+    """
+
+    @classmethod
+    def as_view(cls, **initkwargs):
+        # Token-less API clients, as with DRF's views
+        return csrf_exempt(super().as_view(**initkwargs))
+
+    async def post(self, request, *args, **kwargs):
+        with track_upload('upload') as timings:
+            response = await self.upload(request)
+            timings.fields['status'] = response.status_code
+            timings.fields['cache'] = response.get('X-Upload-Cache')
+            return response
+
+    async def upload(self, request):
+        percentiles = request.GET.get('percentiles')
+        error = invalid_percentiles(percentiles)
+        if error:
+            return reject('invalid_parameters', error, json_response)
+
+        run_async = request.GET.get('async') in ('1', 'true', 'yes')
+        try:
+            decompress_request_body(request)
+        except DatasetError as e:
+            return reject(e.reason, {"error": str(e)}, json_response)
+        hasher = install_upload_handlers(request, run_async)
+        with stage('receive'):
+            try:
+                files = await run_in_worker(lambda: request.FILES)
+            except MultiPartParserError as e:
+                return json_response({"detail": f"Multipart form parse error - {e}"},
+                                     status=status.HTTP_400_BAD_REQUEST)
+            except DatasetError as e:
+                discard_staged_uploads(request)
+                return reject(e.reason, {"error": str(e)}, json_response)
+        file_serializer = DatasetSerializer(data=files)
+        if not file_serializer.is_valid():
+            return reject('invalid_file', file_serializer.errors, json_response)
+
+        upload = files['file']
+        upload_size.observe(upload.size)
+        content_hash = hasher.digests.get('file', '')
+        head_hash = hasher.head_digests.get('file', '')
+
+        percentile_mode = percentiles or settings.STATS_PERCENTILE_MODE
+        with stage('dedup'):
+            cached = await (Dataset.objects.filter(content_hash=content_hash, summary__percentile_mode=percentile_mode)
+                            .select_related('summary').order_by('-uploaded_at').afirst())
+        if cached is not None:
+            upload_cache_hits.inc()
+            if run_async:
+                job = await sync_to_async(completed_upload_job)(cached)
+                return job_accepted(job, json_response, headers={'X-Upload-Cache': 'hit'})
+            return json_response(cached.summary.to_stats(), status=status.HTTP_201_CREATED,
+                                 headers={'X-Upload-Cache': 'hit'})
+        upload_cache_misses.inc()
+
+        dataset = await Dataset.objects.acreate(content_hash=content_hash, head_hash=head_hash,
+                                                **file_serializer.validated_data)
+
+        if run_async:
+            job = await sync_to_async(enqueue_upload_job)(dataset, percentiles)
+            return job_accepted(job, json_response)
+
+        try:
+            if isinstance(upload, StagedUploadedFile) and upload.accumulator is not None:
+                stats = await run_in_worker(process_streamed_upload, dataset, upload, percentiles=percentiles)
+            else:
+                stats = await run_in_worker(process_dataset, dataset, percentiles=percentiles)
+        except DatasetError as e:
+            return reject(e.reason, {"error": str(e)}, json_response)
+        return json_response(stats, status=status.HTTP_201_CREATED, headers={'X-Upload-Cache': 'miss'})
+
+class MetricsView(View):
+    """Process-local upload metrics in the Prometheus text exposition format."""
+
+    def get(self, request, *args, **kwargs):
+        return HttpResponse(render_text(), content_type='text/plain; version=0.0.4; charset=utf-8')
@@ -0,0 +1,58 @@
+"""Compare two benchmark result files and flag regressions.
+
+    python -m benchmarks.compare base.json new.json --threshold 0.10
+
+Exits with status 1 when any shared scenario got slower or used more memory
+than the threshold allows, so it can gate CI.
+"""
+import argparse
+import json
+import sys
+
+# Metric -> True when a higher value is better
+METRICS = {
+    'upload_seconds': False,
+    'rows_per_second': True,
+    'stats_warm_seconds': False,
+    'peak_rss_mb': False,
+}
+
+
+def compare(base, new, threshold):
+    """Yield ``(scenario, metric, old, new, change, regressed)`` for shared scenarios."""
+    for name, old_result in base['scenarios'].items():
+        new_result = new['scenarios'].get(name)
+        if not new_result or 'error' in old_result or 'error' in new_result:
+            continue
+        for metric, higher_is_better in METRICS.items():
+            old, current = old_result[metric], new_result[metric]
+            if not old:
+                continue
+            change = (current - old) / old
+            regressed = -change > threshold if higher_is_better else change > threshold
+            yield name, metric, old, current, change, regressed
+
+
+def main():
+    parser = argparse.ArgumentParser(description="Compare two benchmark result files.")
+    parser.add_argument('base')
+    parser.add_argument('new')
+    parser.add_argument('--threshold', type=float, default=0.10, help="allowed relative change (default 0.10)")
+    args = parser.parse_args()
+
+    with open(args.base) as handle:
+        base = json.load(handle)
+    with open(args.new) as handle:
+        new = json.load(handle)
+
+    print(f"{base.get('commit')} -> {new.get('commit')}")
+    regressions = 0
+    for name, metric, old, current, change, regressed in compare(base, new, args.threshold):
+        regressions += regressed
+        flag = '  REGRESSION' if regressed else ''
+        print(f"{name:<16} {metric:<20} {old:>14,.4f} {current:>14,.4f} {change:>+8.1%}{flag}")
+    sys.exit(1 if regressions else 0)
+
+
+if __name__ == '__main__':
+    main()
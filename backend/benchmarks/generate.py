@@ -0,0 +1,63 @@
+"""Synthetic equipment CSVs for the benchmarks.
+
+    python -m benchmarks.generate out.csv --rows 1m --extra-columns 20
+"""
+import argparse
+import numpy as np
+import pandas as pd
+
+TYPES = ['Pump', 'Valve', 'Compressor', 'HeatExchanger', 'Reactor', 'Condenser', 'Tank', 'Mixer']
+# Written per block so memory stays flat however many rows are generated
+BLOCK_ROWS = 250_000
+
+
+def parse_rows(value):
+    """'10k' -> 10000, '1m' -> 1000000; plain integers pass through."""
+    value = str(value).strip().lower()
+    scale = {'k': 1_000, 'm': 1_000_000}.get(value[-1:], 1)
+    return int(float(value.rstrip('km')) * scale)
+
+
+def generate_csv(path, rows, extra_columns=0, missing=0.0, seed=0):
+    """Write ``rows`` random equipment rows to ``path`` and return its size in bytes.
+
+    ``extra_columns`` adds numeric columns the API ignores, to vary the row
+    width; ``missing`` is the fraction of blank metric readings.
+    """
+    rng = np.random.default_rng(seed)
+    extra = [f'Sensor {i}' for i in range(extra_columns)]
+    with open(path, 'w', newline='') as handle:
+        handle.write(','.join(['Equipment Name', 'Type', 'Flowrate', 'Pressure', 'Temperature', *extra]) + '\n')
+        for start in range(0, rows, BLOCK_ROWS):
+            count = min(BLOCK_ROWS, rows - start)
+            types = rng.choice(TYPES, count)
+            frame = pd.DataFrame({
+                'Equipment Name': pd.Series(types, dtype=object) + '-' + pd.Series(np.arange(start, start + count)).astype(str),
+                'Type': types,
+                'Flowrate': rng.normal(120, 30, count),
+                'Pressure': rng.gamma(4, 1.5, count),
+                'Temperature': rng.normal(110, 15, count),
+            })
+            if missing:
+                for column in ('Flowrate', 'Pressure', 'Temperature'):
+                    frame.loc[rng.random(count) < missing, column] = np.nan
+            for name in extra:
+                frame[name] = rng.random(count)
+            frame.to_csv(handle, header=False, index=False, float_format='%.4f')
+        return handle.tell()
+
+
+def main():
+    parser = argparse.ArgumentParser(description="Generate a synthetic equipment CSV.")
+    parser.add_argument('path')
+    parser.add_argument('--rows', default='10k', help="row count, e.g. 10000, 10k or 1m")
+    parser.add_argument('--extra-columns', type=int, default=0)
+    parser.add_argument('--missing', type=float, default=0.0)
+    parser.add_argument('--seed', type=int, default=0)
+    args = parser.parse_args()
+    size = generate_csv(args.path, parse_rows(args.rows), args.extra_columns, args.missing, args.seed)
+    print(f"Wrote {size} bytes to {args.path}")
+
+
+if __name__ == '__main__':
+    main()
@@ -0,0 +1,175 @@
+"""Concurrent load against a running server: uploads mixed with history reads.
+
+    python manage.py runserver --noreload            # in another terminal
+    python -m benchmarks.load --clients 16 --duration 30 --upload-share 0.2
+
+Each client loops for ``--duration`` seconds (or until ``--requests`` in
+total were sent), picking an upload or a history read at random. Every
+upload carries a unique row, so the duplicate-upload cache never answers it.
+Latency percentiles and error rates are printed per endpoint and can be
+written as JSON with ``--output``.
+"""
+import argparse
+import json
+import os
+import random
+import tempfile
+import threading
+import time
+import urllib.error
+import urllib.request
+import uuid
+from concurrent.futures import ThreadPoolExecutor
+
+from .generate import generate_csv, parse_rows
+
+UPLOAD = 'upload'
+HISTORY = 'history'
+
+
+def percentile(values, q):
+    """Nearest-rank percentile of ``values`` (0 < q <= 100)."""
+    if not values:
+        return None
+    ordered = sorted(values)
+    return ordered[max(0, min(len(ordered) - 1, round(q / 100 * len(ordered) + 0.5) - 1))]
+
+
+def multipart_body(field, filename, content):
+    boundary = uuid.uuid4().hex
+    body = b''.join([
+        f'--{boundary}\r\n'.encode(),
+        f'Content-Disposition: form-data; name="{field}"; filename="{filename}"\r\n'.encode(),
+        b'Content-Type: text/csv\r\n\r\n',
+        content,
+        f'\r\n--{boundary}--\r\n'.encode(),
+    ])
+    return body, f'multipart/form-data; boundary={boundary}'
+
+
+class LoadRun:
+    """Shared state of one run: the request budget and every recorded sample."""
+
+    def __init__(self, base_url, csv_body, upload_share, deadline, max_requests, timeout):
+        self.base_url = base_url.rstrip('/')
+        self.csv_body = csv_body
+        self.upload_share = upload_share
+        self.deadline = deadline
+        self.max_requests = max_requests
+        self.timeout = timeout
+        self.samples = {UPLOAD: [], HISTORY: []}
+        self.errors = {UPLOAD: {}, HISTORY: {}}
+        self._sent = 0
+        self._lock = threading.Lock()
+
+    def claim(self):
+        with self._lock:
+            if time.monotonic() >= self.deadline or (self.max_requests and self._sent >= self.max_requests):
+                return False
+            self._sent += 1
+            return True
+
+    def request(self, kind):
+        if kind == UPLOAD:
+            content = self.csv_body + f'load-{uuid.uuid4().hex},Pump,1,1,1\n'.encode()
+            body, content_type = multipart_body('file', 'load.csv', content)
+            request = urllib.request.Request(f'{self.base_url}/api/upload/', data=body, method='POST',
+                                             headers={'Content-Type': content_type})
+        else:
+            request = urllib.request.Request(f'{self.base_url}/api/history/')
+
+        started = time.perf_counter()
+        error = None
+        try:
+            with urllib.request.urlopen(request, timeout=self.timeout) as response:
+                response.read()
+        except urllib.error.HTTPError as e:
+            error = str(e.code)
+        except (urllib.error.URLError, OSError) as e:
+            error = type(getattr(e, 'reason', e)).__name__
+        except Exception as e:
+            # Anything else (a malformed response, say) is still this request's error
+            error = type(e).__name__
+        elapsed = time.perf_counter() - started
+
+        with self._lock:
+            self.samples[kind].append(elapsed)
+            if error:
+                self.errors[kind][error] = self.errors[kind].get(error, 0) + 1
+
+    def client(self, seed):
+        rng = random.Random(seed)
+        while self.claim():
+            self.request(UPLOAD if rng.random() < self.upload_share else HISTORY)
+
+    def report(self, wall_seconds):
+        result = {}
+        for kind, samples in self.samples.items():
+            errors = sum(self.errors[kind].values())
+            result[kind] = {
+                "requests": len(samples),
+                "errors": errors,
+                "error_rate": round(errors / len(samples), 4) if samples else 0,
+                "errors_by_kind": self.errors[kind],
+                "requests_per_second": round(len(samples) / wall_seconds, 2),
+                "p50_ms": _ms(percentile(samples, 50)),
+                "p95_ms": _ms(percentile(samples, 95)),
+                "p99_ms": _ms(percentile(samples, 99)),
+                "max_ms": _ms(max(samples) if samples else None),
+            }
+        return result
+
+
+def _ms(seconds):
+    return None if seconds is None else round(seconds * 1000, 2)
+
+
+def main():
+    parser = argparse.ArgumentParser(description="Drive concurrent uploads and history reads.")
+    parser.add_argument('--url', default='http://127.0.0.1:8000')
+    parser.add_argument('--clients', type=int, default=8)
+    parser.add_argument('--duration', type=float, default=20, help="seconds to run")
+    parser.add_argument('--requests', type=int, default=0, help="stop after this many requests in total")
+    parser.add_argument('--upload-share', type=float, default=0.2, help="fraction of requests that upload")
+    parser.add_argument('--rows', default='1k', help="rows per uploaded CSV, e.g. 1k or 100k")
+    parser.add_argument('--timeout', type=float, default=60)
+    parser.add_argument('--output', help="write the report as JSON")
+    args = parser.parse_args()
+
+    # Written and read back by name, which an open NamedTemporaryFile does not allow on Windows
+    with tempfile.TemporaryDirectory() as directory:
+        path = os.path.join(directory, 'upload.csv')
+        generate_csv(path, parse_rows(args.rows))
+        with open(path, 'rb') as handle:
+            csv_body = handle.read()
+
+    started = time.monotonic()
+    run = LoadRun(args.url, csv_body, args.upload_share, started + args.duration, args.requests, args.timeout)
+    with ThreadPoolExecutor(max_workers=args.clients) as pool:
+        futures = [pool.submit(run.client, seed) for seed in range(args.clients)]
+    wall_seconds = time.monotonic() - started
+    # A client that raised stopped early; its requests are missing, so say so
+    client_errors = [repr(future.exception()) for future in futures if future.exception() is not None]
+
+    report = {
+        "url": args.url,
+        "clients": args.clients,
+        "rows_per_upload": parse_rows(args.rows),
+        "seconds": round(wall_seconds, 2),
+        "endpoints": run.report(wall_seconds),
+        "client_errors": client_errors,
+    }
+    for kind, stats in report["endpoints"].items():
+        print(f"{kind:<8} {stats['requests']:>6} req  {stats['requests_per_second']:>8} req/s  "
+              f"p50 {stats['p50_ms']} ms  p99 {stats['p99_ms']} ms  errors {stats['error_rate']:.2%} "
+              f"{stats['errors_by_kind'] or ''}")
+    if client_errors:
+        print(f"{len(client_errors)} of {args.clients} clients stopped early: {', '.join(client_errors)}")
+    if args.output:
+        os.makedirs(os.path.dirname(os.path.abspath(args.output)), exist_ok=True)
+        with open(args.output, 'w') as handle:
+            json.dump(report, handle, indent=2)
+
+
+if __name__ == '__main__':
+    main()
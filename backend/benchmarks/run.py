@@ -0,0 +1,197 @@
+"""Upload -> stats benchmarks, run in-process with the Django test client.
+
+    cd backend
+    python -m benchmarks.run                          # 10k and 1m rows, narrow and wide
+    python -m benchmarks.run --sizes 10k 1m 10m --repeat 3
+    python -m benchmarks.compare benchmarks/results/<base>.json benchmarks/results/<new>.json
+
+Every scenario runs in a fresh interpreter against a throwaway test database
+and MEDIA_ROOT, so its peak RSS is its own. The test client builds the whole
+multipart body in memory, so peak memory includes roughly one copy of the
+file on top of what the server side needs; compare runs with each other, not
+with the file size. Generated CSVs are kept in benchmarks/data/ and reused.
+"""
+import argparse
+import json
+import os
+import platform
+import resource
+import shutil
+import statistics
+import subprocess
+import sys
+import tempfile
+import time
+from datetime import datetime, timezone
+
+from .generate import generate_csv, parse_rows
+
+BACKEND_DIR = os.path.dirname(os.path.dirname(os.path.abspath(__file__)))
+DATA_DIR = os.path.join(BACKEND_DIR, 'benchmarks', 'data')
+RESULTS_DIR = os.path.join(BACKEND_DIR, 'benchmarks', 'results')
+
+WIDTHS = {'narrow': 0, 'wide': 20}
+STATS_REQUESTS = 20
+
+
+def scenario_name(rows, width):
+    return f'{rows}-{width}'
+
+
+def dataset_path(rows, width):
+    return os.path.join(DATA_DIR, f'equipment-{rows}-{width}.csv')
+
+
+def ensure_dataset(rows, width):
+    path = dataset_path(rows, width)
+    if not os.path.exists(path):
+        os.makedirs(DATA_DIR, exist_ok=True)
+        tmp_path = f'{path}.tmp'
+        generate_csv(tmp_path, parse_rows(rows), extra_columns=WIDTHS[width], missing=0.01)
+        os.replace(tmp_path, path)
+    return path
+
+
+def peak_rss_mb():
+    peak = resource.getrusage(resource.RUSAGE_SELF).ru_maxrss
+    # Kilobytes on Linux, bytes on macOS
+    return round(peak / (1 << 20 if sys.platform == 'darwin' else 1 << 10), 1)
+
+
+def run_scenario(path, repeat, settings_overrides):
+    """Child process body: upload ``path`` ``repeat`` times and time the stats reads."""
+    os.environ.setdefault('DJANGO_SETTINGS_MODULE', 'config.settings')
+    import django
+    django.setup()
+    from django.conf import settings
+    from django.db import connection
+    from django.test import Client
+    from django.test.utils import setup_test_environment
+    from api.ingest import resolve_engine
+    from api.metrics import stage_seconds
+    from api.models import Dataset
+
+    # Bulk deletes leave the uploaded files behind, so the whole directory goes
+    original_media_root = settings.MEDIA_ROOT
+    media_root = settings.MEDIA_ROOT = tempfile.mkdtemp(prefix='bench-media-')
+    try:
+        for name, value in settings_overrides.items():
+            setattr(settings, name, value)
+        setup_test_environment()
+        connection.creation.create_test_db(verbosity=0)
+        client = Client()
+
+        baseline_rss = peak_rss_mb()
+        upload_seconds, stats_seconds, stats_cold = [], [], []
+        for _ in range(repeat):
+            # Deleting earlier uploads keeps the content-hash cache from answering
+            Dataset.objects.all().delete()
+            with open(path, 'rb') as handle:
+                started = time.perf_counter()
+                response = client.post('/api/upload/', {'file': handle})
+                upload_seconds.append(time.perf_counter() - started)
+            if response.status_code != 201:
+                raise RuntimeError(f"Upload failed with {response.status_code}: {response.content[:200]!r}")
+            rows = response.json()['total_equipment_count']
+
+            stats_url = f'/api/datasets/{Dataset.objects.latest("uploaded_at").pk}/stats/'
+            for i in range(STATS_REQUESTS):
+                started = time.perf_counter()
+                client.get(stats_url)
+                (stats_cold if i == 0 else stats_seconds).append(time.perf_counter() - started)
+
+        upload = statistics.median(upload_seconds)
+        size = os.path.getsize(path)
+        return {
+            "rows": rows,
+            "file_bytes": size,
+            "upload_seconds": round(upload, 6),
+            "upload_seconds_all": [round(value, 6) for value in upload_seconds],
+            "rows_per_second": round(rows / upload, 1),
+            "mb_per_second": round(size / (1 << 20) / upload, 2),
+            "stats_cold_seconds": round(statistics.median(stats_cold), 6),
+            "stats_warm_seconds": round(statistics.median(stats_seconds), 6),
+            "baseline_rss_mb": baseline_rss,
+            "peak_rss_mb": peak_rss_mb(),
+            # Summed over the repeats, so divide by "repeat" for one upload
+            "stages": {name: round(stage_seconds.total(stage=name), 6) for name in stage_seconds.label_values('stage')},
+            "settings": {
+                "CSV_ENGINE": resolve_engine(),
+                "CSV_CHUNK_SIZE": settings.CSV_CHUNK_SIZE,
+                "UPLOAD_STREAMING_PARSE": settings.UPLOAD_STREAMING_PARSE,
+                "DATASET_COLUMNAR_CACHE": settings.DATASET_COLUMNAR_CACHE,
+            },
+        }
+    finally:
+        settings.MEDIA_ROOT = original_media_root
+        shutil.rmtree(media_root, ignore_errors=True)
+
+
+def git_revision():
+    def git(*args):
+        return subprocess.run(['git', *args], cwd=BACKEND_DIR, capture_output=True, text=True).stdout.strip()
+    return git('rev-parse', '--short', 'HEAD') or None, bool(git('status', '--porcelain', '--untracked-files=no'))
+
+
+def main():
+    parser = argparse.ArgumentParser(description="Benchmark upload -> stats in-process.")
+    parser.add_argument('--sizes', nargs='+', default=['10k', '1m'], help="row counts, e.g. 10k 1m 10m")
+    parser.add_argument('--widths', nargs='+', default=list(WIDTHS), choices=list(WIDTHS))
+    parser.add_argument('--repeat', type=int, default=1, help="uploads per scenario; the median is reported")
+    parser.add_argument('--set', action='append', default=[], metavar='NAME=JSON',
+                        help="override a Django setting, e.g. --set CSV_ENGINE='\"c\"'")
+    parser.add_argument('--output', help="results file (default: benchmarks/results/<time>-<commit>.json)")
+    parser.add_argument('--child', help=argparse.SUPPRESS)
+    args = parser.parse_args()
+
+    overrides = {}
+    for item in args.set:
+        name, _, value = item.partition('=')
+        overrides[name] = json.loads(value)
+
+    if args.child:
+        print(json.dumps(run_scenario(args.child, args.repeat, overrides)))
+        return
+
+    commit, dirty = git_revision()
+    results = {
+        "commit": commit,
+        "dirty": dirty,
+        "created_at": datetime.now(timezone.utc).isoformat(),
+        "python": platform.python_version(),
+        "platform": platform.platform(),
+        "repeat": args.repeat,
+        "overrides": overrides,
+        "scenarios": {},
+    }
+    for rows in args.sizes:
+        for width in args.widths:
+            name = scenario_name(rows, width)
+            path = ensure_dataset(rows, width)
+            print(f"{name}: ", end='', flush=True)
+            child = subprocess.run(
+                [sys.executable, '-m', 'benchmarks.run', '--child', path, '--repeat', str(args.repeat),
+                 *(f'--set={item}' for item in args.set)],
+                cwd=BACKEND_DIR, capture_output=True, text=True,
+            )
+            if child.returncode:
+                print("failed")
+                sys.stderr.write(child.stderr)
+                results["scenarios"][name] = {"error": child.stderr.strip().splitlines()[-1:]}
+                continue
+            result = json.loads(child.stdout.strip().splitlines()[-1])
+            results["scenarios"][name] = result
+            print(f"{result['upload_seconds']:.3f}s, {result['rows_per_second']:,.0f} rows/s, "
+                  f"peak {result['peak_rss_mb']} MB, stats {result['stats_warm_seconds'] * 1000:.2f} ms")
+
+    output = args.output or os.path.join(
+        RESULTS_DIR, f"{datetime.now().strftime('%Y%m%d-%H%M%S')}-{commit or 'unknown'}.json"
+    )
+    os.makedirs(os.path.dirname(os.path.abspath(output)), exist_ok=True)
+    with open(output, 'w') as handle:
+        json.dump(results, handle, indent=2)
+    print(f"Results written to {output}")
+
+
+if __name__ == '__main__':
+    main()
@@ -11,6 +11,7 @@ https://docs.djangoproject.com/en/6.0/ref/settings/
 """
 
 from pathlib import Path
+import os
 
 # Build paths inside the project like this: BASE_DIR / 'subdir'.
 BASE_DIR = Path(__file__).resolve().parent.parent
@@ -76,12 +77,50 @@ WSGI_APPLICATION = 'config.wsgi.application'
 # Database
 # https://docs.djangoproject.com/en/6.0/ref/settings/#databases
 
-DATABASES = {
-    'default': {
-        'ENGINE': 'django.db.backends.sqlite3',
-        'NAME': BASE_DIR / 'db.sqlite3',
+# SQLite by default, set up for concurrent uploads: the WAL journal lets
+# history/stats reads run alongside a write, writers wait up to DB_TIMEOUT
+# seconds for the lock instead of failing with "database is locked", and
+# transactions take the write lock up front so two writers never deadlock
+# upgrading a read lock. For multi-process production deployments set
+# DB_ENGINE=postgres and the DB_* variables below to use a pooled PostgreSQL
+# connection (needs psycopg[pool]).
+DB_ENGINE = os.environ.get('DB_ENGINE', 'sqlite')
+DB_TIMEOUT = int(os.environ.get('DB_TIMEOUT', 20))
+
+if DB_ENGINE == 'postgres':
+    DATABASES = {
+        'default': {
+            'ENGINE': 'django.db.backends.postgresql',
+            'NAME': os.environ.get('DB_NAME', 'equipment'),
+            'USER': os.environ.get('DB_USER', ''),
+            'PASSWORD': os.environ.get('DB_PASSWORD', ''),
+            'HOST': os.environ.get('DB_HOST', 'localhost'),
+            'PORT': os.environ.get('DB_PORT', '5432'),
+            'OPTIONS': {
+                'pool': {
+                    'min_size': int(os.environ.get('DB_POOL_MIN_SIZE', 2)),
+                    'max_size': int(os.environ.get('DB_POOL_MAX_SIZE', 10)),
+                    'timeout': DB_TIMEOUT,
+                },
+            },
+        }
+    }
+else:
+    DATABASES = {
+        'default': {
+            'ENGINE': 'django.db.backends.sqlite3',
+            'NAME': BASE_DIR / 'db.sqlite3',
+            'OPTIONS': {
+                'timeout': DB_TIMEOUT,
+                'transaction_mode': 'IMMEDIATE',
+                'init_command': (
+                    'PRAGMA journal_mode=WAL;'
+                    'PRAGMA synchronous=NORMAL;'
+                    f'PRAGMA busy_timeout={DB_TIMEOUT * 1000};'
+                ),
+            },
+        }
     }
-}
 
 
 # Password validation
@@ -124,4 +163,116 @@ STATIC_URL = 'static/'
 MEDIA_URL = '/media/'
 MEDIA_ROOT = BASE_DIR / 'media'
 
+# Like FileSystemStorage, but concurrent uploads of the same name never
+# share a stored file (see api/storage.py)
+STORAGES = {
+    "default": {"BACKEND": "api.storage.DatasetStorage"},
+    "staticfiles": {"BACKEND": "django.contrib.staticfiles.storage.StaticFilesStorage"},
+}
+
 CORS_ALLOW_ALL_ORIGINS = True
+
+# Rows per chunk when streaming uploaded CSVs; bounds memory per upload
+CSV_CHUNK_SIZE = 100_000
+
+# Background threads used for asynchronous (?async=1) uploads, and for the
+# parsing done by the async upload view
+UPLOAD_WORKERS = 4
+
+# Chunked, resumable uploads (api/upload/chunked/): the chunk size suggested
+# to clients, the largest chunk accepted, and how many hours an unfinished
+# upload is kept before the prune_datasets command discards it
+UPLOAD_CHUNK_SIZE = 8 * 1024 * 1024
+UPLOAD_CHUNK_MAX_SIZE = 64 * 1024 * 1024
+CHUNKED_UPLOAD_EXPIRY_HOURS = 24
+
+# Largest size (bytes) a compressed upload (.csv.gz, .csv.zst or a body sent
+# with Content-Encoding) may expand to, against decompression bombs; None
+# disables the limit
+UPLOAD_MAX_DECOMPRESSED_SIZE = 16 * 1024 ** 3
+
+# Serve api/upload/ and api/history/ with async views. Only worth it under an
+# ASGI server (uvicorn config.asgi:application): a slow upload then holds no
+# thread while its body arrives. Under WSGI leave it off.
+API_ASYNC_VIEWS = os.environ.get('API_ASYNC_VIEWS', '') in ('1', 'true', 'yes')
+
+# Worker processes parsing the files of one api/upload/batch/ request in
+# parallel, and the most CSVs (after unpacking zips) one batch may hold
+BATCH_WORKERS = os.cpu_count() or 2
+BATCH_MAX_FILES = 100
+
+# Which datasets to keep after each upload. Any combination of limits may be
+# set; None disables a limit. The newest dataset is never pruned.
+DATASET_RETENTION = {
+    'MAX_COUNT': 5,
+    'MAX_AGE_DAYS': None,
+    'MAX_BYTES': None,
+}
+
+# Summaries of pruned datasets are kept for api/trends/ until they fall
+# outside this policy (same keys as above, MAX_BYTES is ignored)
+SUMMARY_RETENTION = {
+    'MAX_COUNT': 1000,
+    'MAX_AGE_DAYS': 365,
+}
+
+# In-process cache for api/history/ and api/datasets/<id>/stats/ responses.
+# Entries are dropped when a dataset or summary changes in this process; the
+# timeout (seconds) bounds how stale other worker processes can be.
+CACHES = {
+    'default': {
+        'BACKEND': 'django.core.cache.backends.locmem.LocMemCache',
+        'LOCATION': 'api-responses',
+    }
+}
+RESPONSE_CACHE_TIMEOUT = 30
+
+# Most points api/trends/ returns in one response
+TRENDS_MAX_POINTS = 1000
+
+# CSV parser engine: 'auto' uses pyarrow's streaming reader when it is
+# installed and falls back to pandas' C parser otherwise
+CSV_ENGINE = 'auto'
+
+# Write a memory-mappable columnar copy of every upload next to the CSV
+DATASET_COLUMNAR_CACHE = True
+
+# Parse synchronous uploads while they are received instead of re-reading the
+# stored file afterwards (?async=1 uploads are always parsed by the workers)
+UPLOAD_STREAMING_PARSE = True
+
+# Page sizes for api/datasets/<id>/rows/
+ROWS_PAGE_SIZE = 100
+ROWS_MAX_PAGE_SIZE = 1000
+
+# Per-Type percentiles: 'approximate' uses mergeable quantile sketches with
+# the given relative accuracy; 'exact' loads each metric column into memory.
+# Uploads may override the mode with ?percentiles=exact|approximate.
+STATS_PERCENTILE_MODE = 'approximate'
+STATS_SKETCH_ACCURACY = 0.01
+
+# Rendered api/datasets/<id>/chart.png|svg images kept in memory (LRU), and
+# the largest width/height in pixels a client may ask for
+CHART_CACHE_SIZE = 128
+CHART_MAX_SIZE = 3000
+
+# Default outlier limits for api/datasets/<id>/outliers/
+OUTLIER_ZSCORE_THRESHOLD = 3.0
+OUTLIER_IQR_MULTIPLIER = 1.5
+
+# Log one JSON line per upload, append and upload job to the 'api.timing'
+# logger with the wall time of each stage (receive, parse, aggregate,
+# columnar, summary, store, retention, ...). Metrics are always collected
+# and served at /metrics.
+UPLOAD_TIMING_LOGS = False
+
+LOGGING = {
+    'version': 1,
+    'disable_existing_loggers': False,
+    'handlers': {
+        'console': {'class': 'logging.StreamHandler'},
+    },
+    'loggers': {
+        'api.timing': {'handlers': ['console'], 'level': 'INFO', 'propagate': False},
+    },
+}
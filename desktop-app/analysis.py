@@ -0,0 +1,500 @@
+"""Offline statistics for the desktop client, and an on-disk cache of results.
+
+``compute_stats()`` builds the same summary JSON as the server's
+api/upload/ from a local CSV (``.csv``, ``.csv.gz``, and ``.csv.zst`` when
+zstandard is installed), so a dashboard can be shown without the server.
+Per-Type percentiles are estimated with the same sketch as the server's
+default ``percentile_mode``, so both agree.
+
+``StatsCache`` keeps every result under the user's cache directory, keyed by
+the SHA-256 of the file. An index of path, size and modification time finds
+an unchanged file without reading it, which is what lets the last dashboard
+appear at startup at once.
+"""
+import codecs
+import csv
+import hashlib
+import json
+import math
+import os
+import threading
+import zlib
+from array import array
+import numpy as np
+from PyQt5.QtCore import QObject, QRunnable, QStandardPaths, QThreadPool
+from network import RequestCancelled, RequestSignals
+
+try:
+    import zstandard
+except ImportError: # pragma: no cover - .csv.zst files need the optional zstandard package
+    zstandard = None
+
+REQUIRED_COLUMNS = {'Equipment Name', 'Type', 'Flowrate', 'Pressure', 'Temperature'}
+METRIC_COLUMNS = ('Flowrate', 'Pressure', 'Temperature')
+PERCENTILES = (50, 95, 99)
+# Cells read as missing, as by the server's CSV parsers; a row whose Type is
+# missing counts towards the totals but belongs to no Type
+NA_VALUES = {'', '#N/A', '#N/A N/A', '#NA', '-1.#IND', '-1.#QNAN', '-NaN', '-nan', '1.#IND', '1.#QNAN',
+             '<NA>', 'N/A', 'NA', 'NULL', 'NaN', 'None', 'n/a', 'nan', 'null'}
+BLOCK_SIZE = 1 << 20
+# Rows parsed before they are folded into the running statistics
+CHUNK_ROWS = 1 << 16
+# The server's default STATS_SKETCH_ACCURACY, so both give the same estimates
+SKETCH_ACCURACY = 0.01
+SKETCH_GAMMA = (1 + SKETCH_ACCURACY) / (1 - SKETCH_ACCURACY)
+SKETCH_MIN_VALUE = 1e-9
+# Stored with every cached result; raised whenever compute_stats() changes
+# what it reports, so results from older versions are computed again
+CACHE_VERSION = 2
+
+
+def default_cache_dir():
+    return os.path.join(QStandardPaths.writableLocation(QStandardPaths.GenericCacheLocation),
+                        'ChemicalEquipmentVisualizer', 'stats')
+
+
+def file_digest(path, cancelled=None):
+    """SHA-256 hex digest of the file at ``path``."""
+    digest = hashlib.sha256()
+    with open(path, 'rb') as handle:
+        while block := handle.read(BLOCK_SIZE):
+            if cancelled is not None and cancelled.is_set():
+                raise RequestCancelled()
+            digest.update(block)
+    return digest.hexdigest()
+
+
+def _decompressor(path):
+    name = path.lower()
+    if name.endswith('.gz'):
+        return _GzipStream()
+    if name.endswith('.zst'):
+        if zstandard is None:
+            raise ValueError("Reading .zst files needs the zstandard package.")
+        return zstandard.ZstdDecompressor().decompressobj(read_across_frames=True)
+    return None
+
+
+class _GzipStream:
+    # zlib stops at the end of a gzip member; files may hold several
+
+    def __init__(self):
+        self.member = zlib.decompressobj(16 + zlib.MAX_WBITS)
+
+    def decompress(self, data):
+        output = []
+        while data:
+            output.append(self.member.decompress(data))
+            if not self.member.eof:
+                break
+            data = self.member.unused_data
+            self.member = zlib.decompressobj(16 + zlib.MAX_WBITS)
+        return b''.join(output)
+
+
+def _lines(path, progress=None, cancelled=None):
+    """Decoded lines of the CSV at ``path``, line endings kept, for ``csv.reader``."""
+    size = os.path.getsize(path) or 1
+    decompressor = _decompressor(path)
+    decoder = codecs.getincrementaldecoder('utf-8-sig')(errors='replace')
+    tail = ''
+    with open(path, 'rb') as handle:
+        while True:
+            if cancelled is not None and cancelled.is_set():
+                raise RequestCancelled()
+            block = handle.read(BLOCK_SIZE)
+            data = decompressor.decompress(block) if decompressor and block else block
+            lines = (tail + decoder.decode(data, final=not block)).split('\n')
+            tail = lines.pop()
+            for line in lines:
+                yield line + '\n'
+            if progress:
+                progress(handle.tell(), size)
+            if not block:
+                break
+    if tail:
+        yield tail
+
+
+def _number(text, column):
+    if text in NA_VALUES:
+        return None
+    try:
+        value = float(text)
+    except ValueError:
+        raise ValueError(f"Column '{column}' must contain only numeric values") from None
+    return None if math.isnan(value) else value
+
+
+def _round(value):
+    if value is None or math.isnan(value):
+        return None
+    return round(float(value), 2)
+
+
+class _Moments:
+    """Count, mean, sum of squared deviations, min and max of one metric.
+
+    Chunks are folded in with Chan's parallel update, like the server's
+    ``MetricMoments``.
+    """
+
+    def __init__(self):
+        self.count = 0
+        self.mean = 0.0
+        self.m2 = 0.0
+        self.min = math.inf
+        self.max = -math.inf
+
+    def update(self, values):
+        if not values.size:
+            return
+        count, mean = values.size, float(values.mean())
+        total = self.count + count
+        delta = mean - self.mean
+        self.mean += delta * count / total
+        self.m2 += float(((values - mean) ** 2).sum()) + delta * delta * self.count * count / total
+        self.count = total
+        self.min = min(self.min, float(values.min()))
+        self.max = max(self.max, float(values.max()))
+
+    def std(self):
+        if self.count < 2:
+            return None
+        return math.sqrt(self.m2 / (self.count - 1))
+
+
+class _Sketch:
+    """Log-bucket quantile sketch, bucketed as the server's ``QuantileSketch``.
+
+    Estimates are within ``SKETCH_ACCURACY`` of the true value and the state
+    is a few hundred bucket counts, whatever the number of rows.
+    """
+
+    def __init__(self):
+        self.positive = {}
+        self.negative = {}
+        self.zero = 0
+        self.count = 0
+
+    def update(self, values):
+        signs = np.sign(values).astype(np.int8)
+        magnitudes = np.abs(values)
+        signs[magnitudes < SKETCH_MIN_VALUE] = 0
+        self.zero += int((signs == 0).sum())
+        for sign, buckets in ((1, self.positive), (-1, self.negative)):
+            selected = magnitudes[signs == sign]
+            keys, counts = np.unique(np.ceil(np.log(selected) / math.log(SKETCH_GAMMA)).astype(np.int64),
+                                     return_counts=True)
+            for key, count in zip(keys.tolist(), counts.tolist()):
+                buckets[key] = buckets.get(key, 0) + count
+        self.count += values.size
+
+    @staticmethod
+    def _value(key):
+        return 2 * SKETCH_GAMMA ** key / (SKETCH_GAMMA + 1)
+
+    def quantile(self, q):
+        if not self.count:
+            return None
+        rank = q * (self.count - 1)
+        seen = 0
+        for key in sorted(self.negative, reverse=True):
+            seen += self.negative[key]
+            if seen > rank:
+                return -self._value(key)
+        seen += self.zero
+        if seen > rank:
+            return 0.0
+        for key in sorted(self.positive):
+            seen += self.positive[key]
+            if seen > rank:
+                return self._value(key)
+        return self._value(max(self.positive)) if self.positive else 0.0
+
+
+class _Accumulator:
+    """Running totals and per-Type moments and sketches over chunks of rows."""
+
+    def __init__(self):
+        self.rows = 0
+        self.sums = dict.fromkeys(METRIC_COLUMNS, 0.0)
+        self.counts = dict.fromkeys(METRIC_COLUMNS, 0)
+        self.type_counts = {}
+        self.moments = {}
+        self.sketches = {}
+
+    def update(self, types, values):
+        """Fold in one chunk: its Types (None when missing) and a rows x metrics array."""
+        self.rows += len(types)
+        for position, column in enumerate(METRIC_COLUMNS):
+            present = values[:, position][~np.isnan(values[:, position])]
+            self.sums[column] += float(present.sum())
+            self.counts[column] += present.size
+
+        codes = {}
+        type_codes = np.array([-1 if equipment_type is None else codes.setdefault(equipment_type, len(codes))
+                               for equipment_type in types], dtype=np.int64)
+        for equipment_type in codes:
+            if equipment_type not in self.type_counts:
+                self.type_counts[equipment_type] = 0
+                self.moments[equipment_type] = {column: _Moments() for column in METRIC_COLUMNS}
+                self.sketches[equipment_type] = {column: _Sketch() for column in METRIC_COLUMNS}
+        # Rows sorted by Type, so each Type is one contiguous slice
+        order = np.argsort(type_codes, kind='stable')
+        bounds = np.searchsorted(type_codes[order], np.arange(len(codes) + 1))
+        for code, equipment_type in enumerate(codes):
+            group = values[order[bounds[code]:bounds[code + 1]]]
+            self.type_counts[equipment_type] += len(group)
+            for position, column in enumerate(METRIC_COLUMNS):
+                present = group[:, position][~np.isnan(group[:, position])]
+                self.moments[equipment_type][column].update(present)
+                self.sketches[equipment_type][column].update(present)
+
+    def percentile(self, equipment_type, column, percentile):
+        moments = self.moments[equipment_type][column]
+        estimate = self.sketches[equipment_type][column].quantile(percentile / 100)
+        if estimate is None:
+            return None
+        # Bucket midpoints can fall just outside the observed range
+        return min(max(estimate, moments.min), moments.max)
+
+    def to_stats(self):
+        # Most frequent first, ties by first appearance, like the server
+        distribution = dict(sorted(self.type_counts.items(), key=lambda item: -item[1]))
+        type_statistics = {}
+        for equipment_type, count in distribution.items():
+            entry = {"count": count}
+            for column in METRIC_COLUMNS:
+                moments = self.moments[equipment_type][column]
+                entry[column.lower()] = {
+                    "mean": _round(moments.mean) if moments.count else None,
+                    "min": _round(moments.min) if moments.count else None,
+                    "max": _round(moments.max) if moments.count else None,
+                    "std": _round(moments.std()),
+                    **{f"p{percentile}": _round(self.percentile(equipment_type, column, percentile))
+                       for percentile in PERCENTILES},
+                }
+            type_statistics[equipment_type] = entry
+
+        def mean(column):
+            return round(self.sums[column] / self.counts[column], 2) if self.counts[column] else 0
+
+        return {
+            "total_equipment_count": self.rows,
+            "average_flowrate": mean('Flowrate'),
+            "average_pressure": mean('Pressure'),
+            "average_temperature": mean('Temperature'),
+            "equipment_type_distribution": distribution,
+            "type_statistics": type_statistics,
+            "percentile_mode": 'approximate',
+        }
+
+
+def compute_stats(path, progress=None, cancelled=None):
+    """Summary statistics of the CSV at ``path``, in the server's format.
+
+    One pass with the csv module, ``CHUNK_ROWS`` rows at a time; between
+    chunks only running totals and per-Type sketches are kept, so memory does
+    not grow with the file. Percentiles are approximate, as with the server's
+    default. ``progress(read, size)`` reports bytes read. Raises ValueError
+    for a file the server would reject.
+    """
+    reader = csv.reader(_lines(path, progress, cancelled))
+    header = next(reader, [])
+    if not REQUIRED_COLUMNS.issubset(header):
+        raise ValueError(f"Missing columns. Required: {REQUIRED_COLUMNS}")
+    type_index = header.index('Type')
+    metric_indexes = [(column, header.index(column)) for column in METRIC_COLUMNS]
+
+    accumulator = _Accumulator()
+    types, values = [], array('d')
+    for row in reader:
+        if not row:
+            continue # Blank lines are skipped, as by the server's parsers
+        equipment_type = row[type_index] if type_index < len(row) else ''
+        types.append(None if equipment_type in NA_VALUES else equipment_type)
+        for column, index in metric_indexes:
+            value = _number(row[index] if index < len(row) else '', column)
+            values.append(math.nan if value is None else value)
+        if len(types) == CHUNK_ROWS:
+            accumulator.update(types, np.frombuffer(values, dtype=np.float64).reshape(-1, len(METRIC_COLUMNS)))
+            types, values = [], array('d')
+    if types:
+        accumulator.update(types, np.frombuffer(values, dtype=np.float64).reshape(-1, len(METRIC_COLUMNS)))
+    return accumulator.to_stats()
+
+
+class StatsCache:
+    """Stats on disk, one JSON file per file content (its SHA-256).
+
+    ``index.json`` maps each path seen to its size, mtime and digest, and
+    remembers the last file analysed. Only the ``max_entries`` most recently
+    stored results are kept. Safe to use from several threads.
+    """
+
+    def __init__(self, directory, max_entries=200):
+        self.directory = directory
+        self.max_entries = max_entries
+        self._lock = threading.Lock()
+
+    @property
+    def index_path(self):
+        return os.path.join(self.directory, 'index.json')
+
+    def _entry_path(self, digest):
+        return os.path.join(self.directory, f'{digest}.json')
+
+    def _read_json(self, path):
+        try:
+            with open(path, encoding='utf-8') as handle:
+                return json.load(handle)
+        except (OSError, ValueError):
+            return None
+
+    def _write_json(self, path, data):
+        os.makedirs(self.directory, exist_ok=True)
+        tmp_path = f'{path}.{threading.get_ident()}.tmp'
+        with open(tmp_path, 'w', encoding='utf-8') as handle:
+            json.dump(data, handle)
+        os.replace(tmp_path, path)
+
+    def _index(self):
+        index = self._read_json(self.index_path) or {}
+        index.setdefault('files', {})
+        return index
+
+    @staticmethod
+    def _signature(path):
+        info = os.stat(path)
+        return {"size": info.st_size, "mtime_ns": info.st_mtime_ns}
+
+    def lookup(self, path):
+        """Stats of ``path`` if it is unchanged since it was stored; never reads the file."""
+        path = os.path.abspath(path)
+        with self._lock:
+            known = self._index()['files'].get(path)
+        try:
+            if known is None or {key: known.get(key) for key in ('size', 'mtime_ns')} != self._signature(path):
+                return None
+        except OSError:
+            return None
+        return self.find(known['digest'])
+
+    def find(self, digest):
+        """Stats stored for content with this digest, wherever that file was."""
+        entry = self._read_json(self._entry_path(digest))
+        if not entry or entry.get('version') != CACHE_VERSION:
+            return None
+        return entry['stats']
+
+    def store(self, path, digest, stats):
+        path = os.path.abspath(path)
+        with self._lock:
+            self._write_json(self._entry_path(digest), {"version": CACHE_VERSION, "path": path, "stats": stats})
+            index = self._index()
+            index['files'][path] = {**self._signature(path), "digest": digest}
+            index['last'] = path
+            self._write_json(self.index_path, index)
+            self._trim(index)
+
+    def last(self):
+        """``(path, stats)`` of the last file stored, if it is unchanged, else None."""
+        with self._lock:
+            path = self._index().get('last')
+        if not path:
+            return None
+        stats = self.lookup(path)
+        return (path, stats) if stats is not None else None
+
+    def _trim(self, index):
+        entries = [name for name in os.listdir(self.directory) if name.endswith('.json') and name != 'index.json']
+        if len(entries) <= self.max_entries:
+            return
+        entries.sort(key=lambda name: os.path.getmtime(os.path.join(self.directory, name)))
+        stale = {name[:-len('.json')] for name in entries[:len(entries) - self.max_entries]}
+        for digest in stale:
+            os.remove(self._entry_path(digest))
+        index['files'] = {path: known for path, known in index['files'].items() if known['digest'] not in stale}
+        self._write_json(self.index_path, index)
+
+
+class AnalysisTask(QRunnable):
+    """Stats of a local file, computed on a worker thread or found in the cache.
+
+    With ``stats`` given (e.g. the server's answer) they are only stored for
+    the file. Signals as for ``network.ApiRequest``: ``finished(stats)``,
+    ``failed(message)`` or ``cancelled()``, and ``progress(read, size)``.
+    """
+
+    def __init__(self, cache, path, stats=None):
+        super().__init__()
+        self.setAutoDelete(False)
+        self.cache = cache
+        self.path = path
+        self.stats = stats
+        self.signals = RequestSignals()
+        self._cancelled = threading.Event()
+        self._reported = -1
+
+    def cancel(self):
+        self._cancelled.set()
+
+    def _report(self, read, size):
+        permille = read * 1000 // size if size else 1000
+        if permille != self._reported:
+            self._reported = permille
+            self.signals.progress.emit(read, size)
+
+    def run(self):
+        try:
+            # Hashing is far quicker than parsing, so a copy or a touched file
+            # with cached content is still answered without parsing it
+            digest = file_digest(self.path, self._cancelled)
+            stats = self.stats or self.cache.find(digest)
+            if stats is None:
+                stats = compute_stats(self.path, self._report, self._cancelled)
+            self.cache.store(self.path, digest, stats)
+        except RequestCancelled:
+            self.signals.cancelled.emit()
+        except (OSError, ValueError, csv.Error) as e:
+            self.signals.failed.emit(str(e))
+        else:
+            self.signals.finished.emit(stats)
+        finally:
+            self.signals.done.emit(self)
+
+
+class LocalAnalyzer(QObject):
+    """Runs ``AnalysisTask``s one at a time off the GUI thread."""
+
+    def __init__(self, cache, parent=None):
+        super().__init__(parent)
+        self.cache = cache
+        self.pool = QThreadPool(self)
+        self.pool.setMaxThreadCount(1)
+        self._active = set()
+
+    def analyse(self, path, finished=None, failed=None, cancelled=None, progress=None):
+        return self._start(AnalysisTask(self.cache, path), finished, failed, cancelled, progress)
+
+    def remember(self, path, stats):
+        """Store stats computed elsewhere (the server) for ``path``."""
+        return self._start(AnalysisTask(self.cache, path, stats))
+
+    def _start(self, task, finished=None, failed=None, cancelled=None, progress=None):
+        signals = task.signals
+        for signal, slot in ((signals.finished, finished), (signals.failed, failed),
+                             (signals.cancelled, cancelled), (signals.progress, progress)):
+            if slot is not None:
+                signal.connect(slot)
+        signals.done.connect(self._active.discard)
+        self._active.add(task)
+        self.pool.start(task)
+        return task
+
+    def shutdown(self, wait_ms=3000):
+        self.pool.clear()
+        for task in list(self._active):
+            task.cancel()
+        self.pool.waitForDone(wait_ms)
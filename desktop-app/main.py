@@ -1,14 +1,17 @@
 import sys
 import os
-import requests
 from PyQt5.QtWidgets import (QApplication, QMainWindow, QWidget, QVBoxLayout, 
                              QHBoxLayout, QPushButton, QLabel, QFileDialog, 
                              QStackedWidget, QTableWidget, QTableWidgetItem, 
-                             QMessageBox, QHeaderView, QFrame, QScrollArea)
-from PyQt5.QtCore import Qt, QSize
-from PyQt5.QtGui import QFont, QColor, QPalette, QIcon, QCursor
+                             QMessageBox, QHeaderView, QFrame, QProgressBar, QCheckBox,
+                             QDialog, QTableView, QAbstractItemView)
+from PyQt5.QtCore import Qt, QTimer
+from PyQt5.QtGui import QFont, QCursor
 from matplotlib.backends.backend_qt5agg import FigureCanvasQTAgg as FigureCanvas
 from matplotlib.figure import Figure
+from network import ApiClient, CHUNKED_UPLOAD_THRESHOLD, COMPRESSED_SUFFIXES
+from analysis import LocalAnalyzer, StatsCache, default_cache_dir
+from rows import LocalRows, RowTableModel, ServerRows, SORT_FIELDS, default_rows_dir
 
 # Configuration
 API_BASE_URL = "http://127.0.0.1:8000/api"
@@ -51,12 +54,69 @@ class MplCanvas(FigureCanvas):
         
         self.draw()
 
+class RowViewer(QDialog):
+    """Every row of a dataset in a virtualized table; see rows.py."""
+
+    def __init__(self, source, title, parent=None):
+        super().__init__(parent)
+        self.setWindowTitle(title)
+        self.resize(900, 600)
+        self.setAttribute(Qt.WA_DeleteOnClose)
+        layout = QVBoxLayout(self)
+
+        self.model = RowTableModel(source, parent=self)
+        self.table = QTableView()
+        self.table.setModel(self.model)
+        self.table.setSortingEnabled(True)
+        self.table.horizontalHeader().setSortIndicatorShown(False)
+        self.table.setAlternatingRowColors(True)
+        self.table.setWordWrap(False)
+        self.table.setSelectionBehavior(QAbstractItemView.SelectRows)
+        # Fixed row heights and column widths: nothing is measured per row,
+        # which would visit every one of millions of rows
+        vertical = self.table.verticalHeader()
+        vertical.setSectionResizeMode(QHeaderView.Fixed)
+        vertical.setDefaultSectionSize(26)
+        header = self.table.horizontalHeader()
+        header.setSectionResizeMode(0, QHeaderView.Stretch)
+        for column in range(1, 5):
+            header.setSectionResizeMode(column, QHeaderView.Fixed)
+            header.resizeSection(column, 130)
+        # Equipment Name cannot be sorted; clicking it restores the file order
+        header.sortIndicatorChanged.connect(self.on_sort_indicator_changed)
+        layout.addWidget(self.table)
+
+        self.status = QLabel()
+        layout.addWidget(self.status)
+        self.model.status.connect(self.status.setText)
+        self.model.failed.connect(lambda message: self.status.setText(f"Error: {message}"))
+        self.model.open()
+
+    def on_sort_indicator_changed(self, column, order):
+        # Changing the header while it emits this signal can crash Qt
+        shown = column in SORT_FIELDS
+        QTimer.singleShot(0, lambda: self.table.horizontalHeader().setSortIndicatorShown(shown))
+
+    def closeEvent(self, event):
+        self.model.shutdown()
+        super().closeEvent(event)
+
 class ChemicalApp(QMainWindow):
     def __init__(self):
         super().__init__()
         self.setWindowTitle("Chemical Equipment Visualizer (Desktop)")
         self.setGeometry(100, 100, 1400, 900)
         self.current_theme = 'dark'
+        self.history_etag = None
+        # All API traffic runs on background threads; see network.py
+        self.api = ApiClient(API_BASE_URL, parent=self)
+        self.upload_request = None
+        self.upload_path = None
+        self.dashboard_path = None
+        self.history_request = None
+        # Stats of files seen before, and offline analysis; see analysis.py
+        self.cache = StatsCache(default_cache_dir())
+        self.analyzer = LocalAnalyzer(self.cache, parent=self)
         
         # Central Widget & Main Layout
         central_widget = QWidget()
@@ -106,7 +166,14 @@ class ChemicalApp(QMainWindow):
 
         # Initial Setup
         self.apply_theme()
-        self.nav_buttons[0].click() # Activate Home by default
+        # Reopen on the last file's dashboard while it is unchanged on disk
+        last = self.cache.last()
+        if last:
+            self.dashboard_path = last[0]
+            self.update_dashboard(last[1])
+            self.nav_buttons[1].click()
+        else:
+            self.nav_buttons[0].click() # Activate Home by default
 
     def add_nav_button(self, text, index):
         btn = QPushButton(text)
@@ -143,15 +210,15 @@ class ChemicalApp(QMainWindow):
                 color: #00f3ff; border-left: 3px solid #00f3ff; background: linear-gradient(90deg, rgba(0, 243, 255, 0.2), transparent);
             }
             QLabel { color: #fff; }
-            QTableWidget { 
+            QTableView { 
                 background-color: #050510; 
                 alternate-background-color: #141423;
                 color: #fff; 
                 gridline-color: #333; 
                 border: 1px solid #333; 
             }
-            QTableWidget::item { padding: 5px; }
-            QTableWidget::item:selected { background-color: #00f3ff; color: #000; }
+            QTableView::item { padding: 5px; }
+            QTableView::item:selected { background-color: #00f3ff; color: #000; }
             QHeaderView::section { background-color: #141423; color: #00f3ff; border: 1px solid #333; padding: 5px; }
             QScrollArea { border: none; }
         """
@@ -167,15 +234,15 @@ class ChemicalApp(QMainWindow):
                 color: #0056b3; border-left: 3px solid #0056b3; background-color: rgba(0, 86, 179, 0.1);
             }
             QLabel { color: #1a1a1a; }
-            QTableWidget { 
+            QTableView { 
                 background-color: #fff; 
                 alternate-background-color: #f8f9fa;
                 color: #1a1a1a; 
                 gridline-color: #ccc; 
                 border: 1px solid #ccc; 
             }
-            QTableWidget::item { padding: 5px; }
-            QTableWidget::item:selected { background-color: #0056b3; color: #fff; }
+            QTableView::item { padding: 5px; }
+            QTableView::item:selected { background-color: #0056b3; color: #fff; }
             QHeaderView::section { background-color: #f8f9fa; color: #0056b3; border: 1px solid #ccc; padding: 5px; }
             QScrollArea { border: none; }
         """
@@ -298,14 +365,39 @@ class ChemicalApp(QMainWindow):
         header = QHBoxLayout()
         lbl = QLabel("DASHBOARD ANALYTICS")
         lbl.setFont(QFont("Segoe UI", 20, QFont.Bold))
-        btn_upload = QPushButton("  UPLOAD CSV  ")
-        btn_upload.clicked.connect(self.upload_file)
+        self.btn_upload = QPushButton("  UPLOAD CSV  ")
+        self.btn_upload.clicked.connect(self.upload_file)
         # Custom style for upload button to make it pop
-        btn_upload.setStyleSheet("background-color: #00f3ff; color: #000; border-radius: 4px; font-weight: bold; padding: 10px;")
+        self.btn_upload.setStyleSheet("background-color: #00f3ff; color: #000; border-radius: 4px; font-weight: bold; padding: 10px;")
+
+        # Upload progress, shown only while an upload is running
+        self.upload_progress = QProgressBar()
+        self.upload_progress.setRange(0, 1000)
+        self.upload_progress.setFixedWidth(260)
+        self.upload_progress.hide()
+        self.btn_cancel_upload = QPushButton("  CANCEL  ")
+        self.btn_cancel_upload.clicked.connect(self.cancel_upload)
+        self.btn_cancel_upload.setStyleSheet("border: 1px solid #ff0064; color: #ff0064; border-radius: 4px; padding: 10px;")
+        self.btn_cancel_upload.hide()
+        # gzip plain CSVs on the way; worth it on slow networks
+        self.chk_compress = QCheckBox("Compress")
+        self.chk_compress.setToolTip("Send CSVs gzip-compressed (typically 5-10x smaller)")
+        # Analyse on this machine without contacting the server
+        self.chk_offline = QCheckBox("Offline")
+        self.chk_offline.setToolTip("Compute the statistics locally; nothing is uploaded")
+        # Rows of the file on the dashboard, read from disk
+        self.btn_rows = QPushButton("  VIEW ROWS  ")
+        self.btn_rows.clicked.connect(self.view_dashboard_rows)
+        self.btn_rows.setStyleSheet("border: 1px solid #00f3ff; color: #00f3ff; border-radius: 4px; padding: 10px;")
         
         header.addWidget(lbl)
         header.addStretch()
-        header.addWidget(btn_upload)
+        header.addWidget(self.upload_progress)
+        header.addWidget(self.btn_cancel_upload)
+        header.addWidget(self.chk_compress)
+        header.addWidget(self.chk_offline)
+        header.addWidget(self.btn_rows)
+        header.addWidget(self.btn_upload)
         layout.addLayout(header)
         
         layout.addSpacing(20)
@@ -364,6 +456,9 @@ class ChemicalApp(QMainWindow):
         
         self.history_table.verticalHeader().setVisible(False)
         self.history_table.setAlternatingRowColors(True)
+        # Double-click a dataset to browse its rows on the server
+        self.history_table.setEditTriggers(QAbstractItemView.NoEditTriggers)
+        self.history_table.cellDoubleClicked.connect(self.view_history_rows)
         layout.addWidget(self.history_table)
         
         return page
@@ -372,22 +467,109 @@ class ChemicalApp(QMainWindow):
 
     def upload_file(self):
         options = QFileDialog.Options()
-        file_path, _ = QFileDialog.getOpenFileName(self, "Select CSV", "", "CSV Files (*.csv);;All Files (*)", options=options)
+        file_path, _ = QFileDialog.getOpenFileName(
+            self, "Select CSV", "", "CSV Files (*.csv *.csv.gz *.csv.zst);;All Files (*)", options=options
+        )
         
         if file_path:
-            try:
-                files = {'file': open(file_path, 'rb')}
-                response = requests.post(f"{API_BASE_URL}/upload/", files=files)
-                
-                if response.status_code == 201:
-                    data = response.json()
-                    self.update_dashboard(data)
-                    QMessageBox.information(self, "Success", "File uploaded and analyzed successfully!")
-                    # Switch to dashboard to see results if not there, but we are likely there
-                else:
-                    QMessageBox.warning(self, "Error", f"Upload failed: {response.text}")
-            except Exception as e:
-                QMessageBox.critical(self, "Error", f"Connection error: {str(e)}")
+            # A file analysed before shows at once, from the cache
+            cached = self.cache.lookup(file_path)
+            if cached is not None:
+                self.dashboard_path = file_path
+                self.update_dashboard(cached)
+            if self.chk_offline.isChecked():
+                if cached is None:
+                    self.analyse_locally(file_path)
+                return
+            self.upload_path = file_path
+            self.begin_upload("Uploading %p%")
+            callbacks = dict(
+                finished=self.on_upload_finished,
+                failed=self.on_upload_failed,
+                cancelled=self.on_upload_cancelled,
+                progress=self.on_upload_progress,
+            )
+            # Streamed from disk on a worker thread; the window stays responsive.
+            # Large files go in resumable chunks, so a retry skips what was sent;
+            # files that are compressed already are sent as they are
+            precompressed = file_path.lower().endswith(COMPRESSED_SUFFIXES)
+            compress = self.chk_compress.isChecked() and not precompressed
+            if os.path.getsize(file_path) > CHUNKED_UPLOAD_THRESHOLD and not precompressed:
+                self.upload_request = self.api.upload_chunked(file_path, compress=compress, **callbacks)
+            else:
+                self.upload_request = self.api.upload("upload/", file_path, compress=compress, **callbacks)
+
+    def begin_upload(self, progress_format):
+        self.btn_upload.setEnabled(False)
+        self.upload_progress.setValue(0)
+        self.upload_progress.setFormat(progress_format)
+        self.upload_progress.show()
+        self.btn_cancel_upload.show()
+
+    def analyse_locally(self, file_path):
+        # Same progress bar and cancel button as an upload
+        self.begin_upload("Analyzing locally %p%")
+        self.upload_path = file_path
+        self.upload_request = self.analyzer.analyse(
+            file_path,
+            finished=self.on_analysis_finished,
+            failed=self.on_analysis_failed,
+            cancelled=self.on_upload_cancelled,
+            progress=self.on_upload_progress,
+        )
+
+    def cancel_upload(self):
+        if self.upload_request is not None:
+            self.upload_request.cancel()
+            self.btn_cancel_upload.setEnabled(False)
+
+    def on_upload_progress(self, sent, total):
+        self.upload_progress.setValue(sent * 1000 // total if total else 1000)
+        if sent >= total:
+            # The body is sent; the server is parsing it now
+            self.upload_progress.setFormat("Analyzing...")
+
+    def on_upload_finished(self, response):
+        file_path = self.upload_path
+        self.end_upload()
+        if response.status_code == 201:
+            data = response.json()
+            self.dashboard_path = file_path
+            self.update_dashboard(data)
+            # Reopening the file later shows these stats without a round trip
+            self.analyzer.remember(file_path, data)
+            QMessageBox.information(self, "Success", "File uploaded and analyzed successfully!")
+        else:
+            QMessageBox.warning(self, "Error", f"Upload failed: {response.text}")
+
+    def on_upload_failed(self, message):
+        # The server is unreachable: fall back to the offline engine
+        file_path = self.upload_path
+        self.end_upload()
+        if self.cache.lookup(file_path) is None:
+            self.analyse_locally(file_path)
+        QMessageBox.information(self, "Offline", f"Could not reach the server ({message}).\n"
+                                "The file is analyzed locally and not saved to the history.")
+
+    def on_analysis_finished(self, stats):
+        self.dashboard_path = self.upload_path
+        self.end_upload()
+        self.update_dashboard(stats)
+
+    def on_analysis_failed(self, message):
+        self.end_upload()
+        QMessageBox.warning(self, "Error", f"Analysis failed: {message}")
+
+    def on_upload_cancelled(self):
+        self.end_upload()
+
+    def end_upload(self):
+        self.upload_request = None
+        self.upload_path = None
+        self.upload_progress.hide()
+        self.btn_cancel_upload.hide()
+        self.btn_cancel_upload.setEnabled(True)
+        self.btn_upload.setEnabled(True)
 
     def update_dashboard(self, data):
         # Update KPIs
@@ -426,22 +608,55 @@ class ChemicalApp(QMainWindow):
         
         self.canvas.draw()
 
+    def view_dashboard_rows(self):
+        if self.dashboard_path is None:
+            QMessageBox.information(self, "Rows", "Upload or analyze a CSV first.")
+            return
+        source = LocalRows(self.dashboard_path, default_rows_dir())
+        RowViewer(source, os.path.basename(self.dashboard_path), parent=self).show()
+
+    def view_history_rows(self, row, column):
+        dataset_id = self.history_table.item(row, 0).text()
+        name = self.history_table.item(row, 1).text()
+        RowViewer(ServerRows(self.api, dataset_id), name, parent=self).show()
+
     def load_history(self):
-        try:
-            response = requests.get(f"{API_BASE_URL}/history/")
-            if response.status_code == 200:
-                history_data = response.json()
-                self.history_table.setRowCount(len(history_data))
-                
-                for row, item in enumerate(history_data):
-                    self.history_table.setItem(row, 0, QTableWidgetItem(str(item['id'])))
-                    self.history_table.setItem(row, 1, QTableWidgetItem(item['dataset_name']))
-                    date_str = item['uploaded_at'].replace('T', ' ').split('.')[0]
-                    self.history_table.setItem(row, 2, QTableWidgetItem(date_str))
-            else:
-                 print("Failed to load history")
-        except Exception as e:
-            print(f"Connection error: {e}")
+        # Only the newest refresh matters when the tab is opened repeatedly
+        if self.history_request is not None:
+            self.history_request.cancel()
+        # The server answers 304 when the table already shows the latest history
+        headers = {'If-None-Match': self.history_etag} if self.history_etag else {}
+        self.history_request = self.api.get(
+            "history/", headers=headers,
+            finished=self.on_history_loaded,
+            failed=self.on_history_failed,
+        )
+
+    def on_history_loaded(self, response):
+        self.history_request = None
+        if response.status_code == 304:
+            return
+        if response.status_code == 200:
+            self.history_etag = response.headers.get('ETag')
+            history_data = response.json()
+            self.history_table.setRowCount(len(history_data))
+            
+            for row, item in enumerate(history_data):
+                self.history_table.setItem(row, 0, QTableWidgetItem(str(item['id'])))
+                self.history_table.setItem(row, 1, QTableWidgetItem(item['dataset_name']))
+                date_str = item['uploaded_at'].replace('T', ' ').split('.')[0]
+                self.history_table.setItem(row, 2, QTableWidgetItem(date_str))
+        else:
+             print("Failed to load history")
+
+    def on_history_failed(self, message):
+        self.history_request = None
+        print(f"Connection error: {message}")
+
+    def closeEvent(self, event):
+        self.api.shutdown()
+        self.analyzer.shutdown()
+        super().closeEvent(event)
 
 if __name__ == '__main__':
     app = QApplication(sys.argv)
@@ -0,0 +1,359 @@
+"""Background API traffic for the desktop client.
+
+Requests run on a QThreadPool and share one keep-alive ``requests.Session``;
+results come back to the GUI thread as Qt signals, so the window never waits
+on the network. Uploads are streamed from disk block by block, report their
+progress and can be cancelled between blocks. Large files use the server's
+chunked upload protocol, so a transfer that breaks off resumes at the last
+chunk the server stored, also after the app was restarted. Uploads can be
+gzip-compressed on the way (``Content-Encoding: gzip``).
+"""
+import gzip
+import hashlib
+import mimetypes
+import os
+import threading
+import uuid
+import requests
+from requests.adapters import HTTPAdapter
+from PyQt5.QtCore import QObject, QRunnable, QSettings, QThreadPool, pyqtSignal
+
+# (connect, read) seconds; an upload's read timeout covers server-side parsing
+REQUEST_TIMEOUT = (5, 30)
+UPLOAD_TIMEOUT = (5, None)
+BLOCK_SIZE = 1 << 20
+# Files above this size are sent as a chunked, resumable upload
+CHUNKED_UPLOAD_THRESHOLD = 8 << 20
+# Already compressed files are sent as they are, never in chunks
+COMPRESSED_SUFFIXES = ('.gz', '.zst')
+# zlib level for compressed uploads. Level 1 compresses ~3x faster than 6 for
+# a slightly larger body, which wins unless the link is very slow
+COMPRESS_LEVEL = 1
+
+
+class RequestCancelled(Exception):
+    pass
+
+
+class MultipartFile:
+    """A file streamed as a ``multipart/form-data`` body, one block at a time.
+
+    Because it has a length, requests sends it with a Content-Length header
+    instead of chunked encoding, which Django's development server cannot
+    read. ``progress(sent, total)`` is called after every block.
+    """
+
+    def __init__(self, path, field='file', progress=None, cancelled=None):
+        self.path = path
+        self.size = os.path.getsize(path)
+        self.progress = progress
+        self.cancelled = cancelled
+        self.boundary = uuid.uuid4().hex
+        filename = os.path.basename(path).replace('"', '')
+        file_type = mimetypes.guess_type(path)[0] or 'application/octet-stream'
+        self.head = (f'--{self.boundary}\r\n'
+                     f'Content-Disposition: form-data; name="{field}"; filename="{filename}"\r\n'
+                     f'Content-Type: {file_type}\r\n\r\n').encode('utf-8')
+        self.tail = f'\r\n--{self.boundary}--\r\n'.encode('utf-8')
+
+    @property
+    def content_type(self):
+        return f'multipart/form-data; boundary={self.boundary}'
+
+    def __len__(self):
+        return len(self.head) + self.size + len(self.tail)
+
+    def __iter__(self):
+        total = len(self)
+        sent = len(self.head)
+        yield self.head
+        with open(self.path, 'rb') as handle:
+            while True:
+                if self.cancelled is not None and self.cancelled.is_set():
+                    raise RequestCancelled()
+                block = handle.read(BLOCK_SIZE)
+                if not block:
+                    break
+                yield block
+                sent += len(block)
+                if self.progress:
+                    self.progress(sent, total)
+        yield self.tail
+        if self.progress:
+            self.progress(total, total)
+
+
+class FileChunk:
+    """``size`` bytes of a file from ``offset``, streamed as a raw request body.
+
+    ``progress(sent)`` gets the bytes of this chunk sent so far.
+    """
+
+    def __init__(self, path, offset, size, progress=None, cancelled=None):
+        self.path = path
+        self.offset = offset
+        self.size = size
+        self.progress = progress
+        self.cancelled = cancelled
+
+    def __len__(self):
+        return self.size
+
+    def __iter__(self):
+        sent = 0
+        with open(self.path, 'rb') as handle:
+            handle.seek(self.offset)
+            while sent < self.size:
+                if self.cancelled is not None and self.cancelled.is_set():
+                    raise RequestCancelled()
+                block = handle.read(min(BLOCK_SIZE, self.size - sent))
+                if not block:
+                    raise OSError(f"{self.path} got shorter during the upload")
+                yield block
+                sent += len(block)
+                if self.progress:
+                    self.progress(sent)
+
+
+class RequestSignals(QObject):
+    # Byte counts are objects so multi-GB uploads do not overflow a C int
+    progress = pyqtSignal(object, object)
+    finished = pyqtSignal(object)
+    failed = pyqtSignal(str)
+    cancelled = pyqtSignal()
+    done = pyqtSignal(object)
+
+
+class ApiRequest(QRunnable):
+    """One HTTP request run on the pool.
+
+    Exactly one of ``finished(response)``, ``failed(message)`` or
+    ``cancelled()`` is emitted. A cancelled upload stops sending at the next
+    block; any other cancelled request still completes on the worker, but its
+    result is dropped.
+    """
+
+    def __init__(self, session, method, url, upload=None, compress=False, **kwargs):
+        super().__init__()
+        self.setAutoDelete(False)
+        self.session = session
+        self.method = method
+        self.url = url
+        self.upload = upload
+        self.compress = compress
+        self.kwargs = kwargs
+        self.signals = RequestSignals()
+        self._cancelled = threading.Event()
+        self._reported = -1
+
+    def cancel(self):
+        self._cancelled.set()
+
+    @property
+    def is_cancelled(self):
+        return self._cancelled.is_set()
+
+    def _report(self, sent, total):
+        # At most one signal per 0.1%, however many blocks a file has
+        permille = sent * 1000 // total if total else 1000
+        if permille != self._reported:
+            self._reported = permille
+            self.signals.progress.emit(sent, total)
+
+    def run(self):
+        try:
+            if self.is_cancelled:
+                raise RequestCancelled()
+            kwargs = dict(self.kwargs)
+            if self.upload is not None:
+                body = MultipartFile(self.upload, progress=self._report, cancelled=self._cancelled)
+                kwargs['headers'] = {**kwargs.get('headers', {}), 'Content-Type': body.content_type}
+                if self.compress:
+                    # Only files below CHUNKED_UPLOAD_THRESHOLD get here, so the
+                    # compressed body is built in memory and has a known length
+                    kwargs['data'] = gzip.compress(b''.join(body), COMPRESS_LEVEL)
+                    kwargs['headers']['Content-Encoding'] = 'gzip'
+                else:
+                    kwargs['data'] = body
+            response = self.session.request(self.method, self.url, **kwargs)
+            if self.is_cancelled:
+                raise RequestCancelled()
+        except RequestCancelled:
+            self.signals.cancelled.emit()
+        except (requests.RequestException, OSError) as e:
+            if self.is_cancelled:
+                self.signals.cancelled.emit()
+            else:
+                self.signals.failed.emit(str(e))
+        else:
+            self.signals.finished.emit(response)
+        finally:
+            self.signals.done.emit(self)
+
+
+class ChunkedUploadRequest(ApiRequest):
+    """Upload a file through ``upload/chunked/`` and finish with the stats response.
+
+    The upload id is remembered per file (path, size and modification time)
+    in QSettings until the upload completes, so uploading the same file again
+    after a failure or a cancel only sends the chunks the server is missing.
+    A response other than 2xx ends the request early and is emitted as
+    ``finished`` like any other. With ``compress`` every chunk is gzipped in
+    memory before it is sent.
+    """
+
+    def __init__(self, session, base_url, file_path, timeout=UPLOAD_TIMEOUT, params=None, compress=False):
+        super().__init__(session, 'POST', f'{base_url}/upload/chunked/', compress=compress)
+        self.base_url = base_url
+        self.file_path = file_path
+        self.timeout = timeout
+        self.params = params
+
+    def _chunk(self, offset, length, size):
+        """Request body and headers for ``length`` bytes of the file from ``offset``."""
+        if not self.compress:
+            return (FileChunk(self.file_path, offset, length, cancelled=self._cancelled,
+                              progress=lambda sent: self._report(offset + sent, size)),
+                    {'Content-Type': 'application/octet-stream'})
+        with open(self.file_path, 'rb') as handle:
+            handle.seek(offset)
+            data = handle.read(length)
+        return (gzip.compress(data, COMPRESS_LEVEL),
+                {'Content-Type': 'application/octet-stream', 'Content-Encoding': 'gzip'})
+
+    def _resume_key(self):
+        info = os.stat(self.file_path)
+        identity = f'{os.path.abspath(self.file_path)}:{info.st_size}:{info.st_mtime_ns}'
+        return f"chunked_uploads/{hashlib.sha1(identity.encode('utf-8')).hexdigest()}"
+
+    def _start(self, settings, key):
+        upload_id = settings.value(key)
+        if upload_id:
+            response = self.session.get(f'{self.url}{upload_id}/', timeout=REQUEST_TIMEOUT)
+            if response.status_code == 200 and response.json()['status'] == 'receiving':
+                return response
+        response = self.session.post(self.url, json={'filename': os.path.basename(self.file_path)},
+                                     timeout=REQUEST_TIMEOUT)
+        if response.status_code == 201:
+            settings.setValue(key, response.json()['id'])
+        return response
+
+    def _send(self):
+        settings = QSettings('ChemicalEquipmentVisualizer', 'Desktop')
+        key = self._resume_key()
+        response = self._start(settings, key)
+        if not response.ok:
+            return response
+        upload = response.json()
+        size = os.path.getsize(self.file_path)
+        chunk_size = upload['chunk_size']
+        index = upload['next_chunk']
+        while index * chunk_size < size:
+            if self.is_cancelled:
+                raise RequestCancelled()
+            offset = index * chunk_size
+            length = min(chunk_size, size - offset)
+            body, headers = self._chunk(offset, length, size)
+            response = self.session.put(f"{self.url}{upload['id']}/chunks/{index}/", data=body,
+                                        timeout=self.timeout, headers=headers)
+            if response.status_code == 409 and 'next_chunk' in response.json():
+                # Out of step with the server (another client resumed it); continue where it is
+                index = response.json()['next_chunk']
+                continue
+            if not response.ok:
+                return response
+            self._report(offset + length, size)
+            index += 1
+        if self.is_cancelled:
+            raise RequestCancelled()
+        self._report(size, size)
+        response = self.session.post(f"{self.url}{upload['id']}/complete/", params=self.params, timeout=self.timeout)
+        if response.status_code != 409:
+            settings.remove(key)
+        return response
+
+    def run(self):
+        try:
+            if self.is_cancelled:
+                raise RequestCancelled()
+            response = self._send()
+            if self.is_cancelled:
+                raise RequestCancelled()
+        except RequestCancelled:
+            self.signals.cancelled.emit()
+        except (requests.RequestException, OSError, ValueError) as e:
+            if self.is_cancelled:
+                self.signals.cancelled.emit()
+            else:
+                self.signals.failed.emit(str(e))
+        else:
+            self.signals.finished.emit(response)
+        finally:
+            self.signals.done.emit(self)
+
+
+class ApiClient(QObject):
+    """Runs API requests off the GUI thread over one pooled keep-alive session."""
+
+    def __init__(self, base_url, max_workers=4, parent=None):
+        super().__init__(parent)
+        self.base_url = base_url.rstrip('/')
+        self.session = requests.Session()
+        adapter = HTTPAdapter(pool_connections=1, pool_maxsize=max_workers)
+        self.session.mount('http://', adapter)
+        self.session.mount('https://', adapter)
+        self.pool = QThreadPool(self)
+        self.pool.setMaxThreadCount(max_workers)
+        # Python references keep each request alive until its signals are delivered
+        self._active = set()
+
+    def url(self, path):
+        return f"{self.base_url}/{path.lstrip('/')}"
+
+    def get(self, path, **kwargs):
+        kwargs.setdefault('timeout', REQUEST_TIMEOUT)
+        return self.request('GET', path, **kwargs)
+
+    def upload(self, path, file_path, compress=False, **kwargs):
+        """POST ``file_path`` as the ``file`` field of a multipart form, streamed from disk.
+
+        ``compress`` gzips the whole body in memory, so keep it for files
+        below CHUNKED_UPLOAD_THRESHOLD.
+        """
+        kwargs.setdefault('timeout', UPLOAD_TIMEOUT)
+        return self.request('POST', path, upload=file_path, compress=compress, **kwargs)
+
+    def upload_chunked(self, file_path, params=None, compress=False, **callbacks):
+        """Send ``file_path`` as a resumable chunked upload; see ``ChunkedUploadRequest``."""
+        request = ChunkedUploadRequest(self.session, self.base_url, file_path, params=params, compress=compress)
+        return self.start(request, **callbacks)
+
+    def request(self, method, path, finished=None, failed=None, cancelled=None, progress=None, **kwargs):
+        """Start a request and return it; the callbacks run on the GUI thread.
+
+        Remaining keyword arguments go to ``requests.Session.request()``.
+        """
+        return self.start(ApiRequest(self.session, method, self.url(path), **kwargs),
+                          finished=finished, failed=failed, cancelled=cancelled, progress=progress)
+
+    def start(self, request, finished=None, failed=None, cancelled=None, progress=None):
+        signals = request.signals
+        for signal, slot in ((signals.finished, finished), (signals.failed, failed),
+                             (signals.cancelled, cancelled), (signals.progress, progress)):
+            if slot is not None:
+                signal.connect(slot)
+        signals.done.connect(self._forget)
+        self._active.add(request)
+        self.pool.start(request)
+        return request
+
+    def _forget(self, request):
+        self._active.discard(request)
+
+    def shutdown(self, wait_ms=3000):
+        """Cancel everything in flight and give the workers ``wait_ms`` to stop."""
+        self.pool.clear()
+        for request in list(self._active):
+            request.cancel()
+        self.pool.waitForDone(wait_ms)
+        self.session.close()
@@ -0,0 +1,562 @@
+"""Virtualized dataset rows for the desktop client.
+
+``RowTableModel`` is a ``QAbstractTableModel`` over millions of rows that
+keeps only the last few dozen pages in memory. A page is fetched on a worker
+thread when the view first paints one of its cells, newest request first, so
+a fast scroll only loads what ends up on screen. Rows come from a source:
+
+* ``ServerRows`` reads ``datasets/<id>/rows/`` by ``offset``, sorted by the
+  server from its memory-mapped columns.
+* ``LocalRows`` memory-maps a CSV on disk. A vectorised pass records where
+  each row starts; sorting parses the sort keys once. Both are kept as
+  memory-mapped files under the user cache directory, keyed by the file's
+  SHA-256, so reopening a file is instant.
+"""
+import copy
+import csv
+import json
+import os
+import shutil
+import threading
+from array import array
+from collections import OrderedDict
+import numpy as np
+import requests
+from PyQt5.QtCore import QAbstractTableModel, QModelIndex, QRunnable, QStandardPaths, QThreadPool, Qt, pyqtSignal
+from analysis import NA_VALUES, REQUIRED_COLUMNS, file_digest
+from network import REQUEST_TIMEOUT, RequestCancelled, RequestSignals
+
+COLUMNS = ('Equipment Name', 'Type', 'Flowrate', 'Pressure', 'Temperature')
+METRIC_COLUMNS = COLUMNS[2:]
+# Column -> the rows endpoint's ordering field; Equipment Name is not sortable
+SORT_FIELDS = {1: 'type', 2: 'flowrate', 3: 'pressure', 4: 'temperature'}
+PAGE_SIZE = 200
+# Pages kept in memory, pages waiting to be fetched, and fetches at once
+MAX_PAGES = 64
+MAX_WANTED = 8
+MAX_IN_FLIGHT = 2
+# Bytes scanned per step while indexing a local CSV, and rows parsed per step for sort keys
+SCAN_SIZE = 16 << 20
+KEY_BLOCK_ROWS = 100_000
+# Local row indexes kept on disk; they take ~16 bytes a row
+ROW_INDEX_KEEP = 5
+# Stored in meta.json; raised when the index or the sort keys change, so
+# indexes written by an older version are rebuilt
+INDEX_VERSION = 2
+
+# Sort keys and orders of a local file are built by one thread at a time
+_build_lock = threading.Lock()
+
+
+class RowSourceError(Exception):
+    pass
+
+
+def default_rows_dir():
+    return os.path.join(QStandardPaths.writableLocation(QStandardPaths.GenericCacheLocation),
+                        'ChemicalEquipmentVisualizer', 'rows')
+
+
+def _check_cancelled(cancelled):
+    if cancelled is not None and cancelled.is_set():
+        raise RequestCancelled()
+
+
+class ServerRows:
+    """Rows of an uploaded dataset, a page per request to the rows endpoint."""
+
+    def __init__(self, api, dataset_id, ordering=None):
+        self.api = api
+        self.dataset_id = dataset_id
+        self.ordering = ordering
+
+    def _get(self, path, **params):
+        response = self.api.session.get(self.api.url(f'datasets/{self.dataset_id}/{path}'), params=params,
+                                        timeout=REQUEST_TIMEOUT)
+        if response.status_code != 200:
+            raise RowSourceError(f"Server answered {response.status_code}: {response.text[:200]}")
+        return response.json()
+
+    def open(self, cancelled=None, progress=None):
+        """Number of rows; the stored stats count every row the server keeps."""
+        return self._get('stats/')['total_equipment_count']
+
+    def ordered(self, field, descending, cancelled=None, progress=None):
+        ordering = f"{'-' if descending else ''}{field}" if field else None
+        return ServerRows(self.api, self.dataset_id, ordering)
+
+    def fetch(self, start, count):
+        params = {'offset': start, 'page_size': count}
+        if self.ordering:
+            params['ordering'] = self.ordering
+        return [
+            (row['equipment_name'], row['type'], row['flowrate'], row['pressure'], row['temperature'])
+            for row in self._get('rows/', **params)['results']
+        ]
+
+
+class LocalRows:
+    """Rows of a CSV on disk, read through memory maps.
+
+    ``index.i8`` holds the start and end offset of every row (blank lines
+    left out); sort keys and orders are built next to it on first use. Only
+    plain CSVs can be mapped, so compressed files raise RowSourceError.
+    """
+
+    def __init__(self, path, directory):
+        self.path = path
+        self.directory = directory
+        self.field = None
+        self.descending = False
+        self.order = None
+        self.rows = 0
+        self.index_dir = None
+
+    @property
+    def meta_path(self):
+        return os.path.join(self.index_dir, 'meta.json')
+
+    def _map(self, name, dtype, shape):
+        if not shape or not shape[0]:
+            return np.empty(shape or 0, dtype=dtype)
+        return np.memmap(os.path.join(self.index_dir, name), dtype=dtype, mode='r', shape=shape)
+
+    def _stored_version(self):
+        try:
+            with open(self.meta_path, encoding='utf-8') as handle:
+                return json.load(handle).get('version')
+        except (OSError, ValueError):
+            return None
+
+    def open(self, cancelled=None, progress=None):
+        if self.path.lower().endswith(('.gz', '.zst')):
+            raise RowSourceError("Compressed files can only be browsed once uploaded, from the History page.")
+        digest = file_digest(self.path, cancelled)
+        self.index_dir = os.path.join(self.directory, digest)
+        if self._stored_version() != INDEX_VERSION:
+            self._build_index(cancelled, progress)
+        os.utime(self.index_dir) # Most recently used; see _trim()
+        self._trim()
+        with open(self.meta_path, encoding='utf-8') as handle:
+            self.meta = json.load(handle)
+        self.rows = self.meta['rows']
+        self.data = np.memmap(self.path, dtype='u1', mode='r') if os.path.getsize(self.path) else np.empty(0, 'u1')
+        self.index = self._map('index.i8', '<i8', (self.rows, 2))
+        return self.rows
+
+    def _build_index(self, cancelled, progress):
+        data = np.memmap(self.path, dtype='u1', mode='r') if os.path.getsize(self.path) else np.empty(0, 'u1')
+        size = len(data)
+        tmp_dir = f'{self.index_dir}.{threading.get_ident()}.tmp'
+        shutil.rmtree(tmp_dir, ignore_errors=True)
+        os.makedirs(tmp_dir)
+        header = None
+        rows = 0
+        # A newline ends a row only outside quotes: after an even number of
+        # quote characters since the start of the file
+        start = 3 if bytes(data[:3]) == b'\xef\xbb\xbf' else 0
+        odd_quotes = 0
+        with open(os.path.join(tmp_dir, 'index.i8'), 'wb') as index:
+            for position in range(0, size, SCAN_SIZE):
+                _check_cancelled(cancelled)
+                block = np.asarray(data[position:position + SCAN_SIZE])
+                quotes = np.flatnonzero(block == ord('"'))
+                newlines = np.flatnonzero(block == ord('\n'))
+                ends = newlines[(np.searchsorted(quotes, newlines) + odd_quotes) % 2 == 0] + position + 1
+                odd_quotes = (odd_quotes + len(quotes)) % 2
+                if position + SCAN_SIZE >= size and (not len(ends) or ends[-1] != size):
+                    ends = np.append(ends, size) # Last row without a trailing newline
+                if not len(ends):
+                    continue
+                starts = np.concatenate(([start], ends[:-1]))
+                start = int(ends[-1])
+                # Blank lines are skipped, as by the server
+                keep = ~((ends - starts <= 2) & np.isin(data[starts], (ord('\r'), ord('\n'))))
+                pairs = np.column_stack((starts[keep], ends[keep])).astype('<i8')
+                if header is None and len(pairs):
+                    header, pairs = pairs[0], pairs[1:]
+                pairs.tofile(index)
+                rows += len(pairs)
+                if progress:
+                    progress(min(position + SCAN_SIZE, size), size)
+
+        columns = next(csv.reader([_text(data, header)]), []) if header is not None else []
+        if not REQUIRED_COLUMNS.issubset(columns):
+            shutil.rmtree(tmp_dir, ignore_errors=True)
+            raise RowSourceError(f"Missing columns. Required: {REQUIRED_COLUMNS}")
+        with open(os.path.join(tmp_dir, 'meta.json'), 'w', encoding='utf-8') as handle:
+            json.dump({"version": INDEX_VERSION, "rows": rows, "width": len(columns),
+                       "columns": [columns.index(column) for column in COLUMNS]}, handle)
+        shutil.rmtree(self.index_dir, ignore_errors=True)
+        os.replace(tmp_dir, self.index_dir)
+
+    def _trim(self):
+        entries = [os.path.join(self.directory, name) for name in os.listdir(self.directory)
+                   if not name.endswith('.tmp')]
+        entries.sort(key=os.path.getmtime, reverse=True)
+        for stale in entries[ROW_INDEX_KEEP:]:
+            shutil.rmtree(stale, ignore_errors=True)
+
+    def _records(self, rows):
+        columns = self.meta['columns']
+        records = []
+        for start, end in self.index[rows]:
+            fields = next(csv.reader([_text(self.data, (start, end))]), [])
+            records.append(tuple(fields[column] if column < len(fields) else '' for column in columns))
+        return records
+
+    def _rows_at(self, positions):
+        # Same addressing as the server's RowQuery: descending reverses the ascending order
+        if self.descending:
+            positions = self.rows - 1 - positions
+        if self.order is None:
+            return positions
+        return np.asarray(self.order[positions])
+
+    def fetch(self, start, count):
+        positions = np.arange(start, min(start + count, self.rows))
+        records = []
+        for name, equipment_type, *metrics in self._records(self._rows_at(positions)):
+            records.append((name, _type(equipment_type), *(_number(value) for value in metrics)))
+        return records
+
+    def ordered(self, field, descending, cancelled=None, progress=None):
+        # The copy shares the memory maps; only the ordering differs
+        source = copy.copy(self)
+        source.field = field
+        source.descending = bool(field) and descending
+        source.order = self._order(field, cancelled, progress) if field else None
+        return source
+
+    def _order(self, field, cancelled, progress):
+        name = f'order.{field}.i8'
+        with _build_lock:
+            if not os.path.exists(os.path.join(self.index_dir, name)):
+                self._build_order(name, field, cancelled, progress)
+        return self._map(name, '<i8', (self.rows,))
+
+    def _build_order(self, name, field, cancelled, progress):
+        if 'categories' not in self.meta:
+            self._build_keys(cancelled, progress)
+        if field == 'type':
+            # Order by label, not by first appearance, as on the server;
+            # missing types sort last
+            categories = self.meta['categories']
+            label_rank = np.argsort(np.argsort(categories, kind='stable')).astype('<i4')
+            keys = np.append(label_rank, len(categories))[self._map('type.i4', '<i4', (self.rows,))]
+        else:
+            keys = self._map(f'{field}.f8', '<f8', (self.rows,))
+        tmp_path = os.path.join(self.index_dir, f'{name}.tmp')
+        np.argsort(keys, kind='stable').astype('<i8').tofile(tmp_path)
+        os.replace(tmp_path, os.path.join(self.index_dir, name))
+
+    def _build_keys(self, cancelled, progress):
+        """One pass writing Type codes and metric values (NaN when missing) as column files."""
+        categories = {}
+        names = ['type.i4', *(f'{column.lower()}.f8' for column in METRIC_COLUMNS)]
+        files = {name: open(os.path.join(self.index_dir, f'{name}.tmp'), 'wb') for name in names}
+        try:
+            for first in range(0, self.rows, KEY_BLOCK_ROWS):
+                _check_cancelled(cancelled)
+                last = min(first + KEY_BLOCK_ROWS, self.rows)
+                keys = self._split_keys(first, last) or self._parse_keys(first, last)
+                labels, codes, metrics = keys
+                lookup = np.array([-1 if _type(label) is None else categories.setdefault(label, len(categories))
+                                   for label in labels], dtype='<i4')
+                lookup[codes].tofile(files['type.i4'])
+                for name, values in zip(names[1:], metrics):
+                    values.astype('<f8').tofile(files[name])
+                if progress:
+                    progress(last, self.rows)
+        finally:
+            for handle in files.values():
+                handle.close()
+        for name in names:
+            os.replace(os.path.join(self.index_dir, f'{name}.tmp'), os.path.join(self.index_dir, name))
+        self.meta['categories'] = list(categories)
+        tmp_path = f'{self.meta_path}.tmp'
+        with open(tmp_path, 'w', encoding='utf-8') as handle:
+            json.dump(self.meta, handle)
+        os.replace(tmp_path, self.meta_path)
+
+    def _split_keys(self, first, last):
+        """Keys of rows ``first`` to ``last`` cut out with numpy, or None.
+
+        Without quotes every comma separates fields, so each field's bytes
+        are found by position and whole columns are converted at once. Rows
+        with quotes, a different number of fields, or a metric that is not
+        a number return None for the csv path.
+        """
+        starts, ends = self.index[first:last, 0], self.index[first:last, 1]
+        block = np.asarray(self.data[starts[0]:ends[-1]])
+        if (block == ord('"')).any():
+            return None
+        separators = self.meta['width'] - 1
+        commas = np.flatnonzero(block == ord(',')) + starts[0]
+        if ((np.searchsorted(commas, ends) - np.searchsorted(commas, starts)) != separators).any():
+            return None
+        commas = commas.reshape(-1, separators)
+        line_ends = ends - (self.data[ends - 1] == ord('\n'))
+        line_ends = line_ends - (self.data[line_ends - 1] == ord('\r'))
+        field_starts = np.column_stack((starts, commas + 1))
+        field_ends = np.column_stack((commas, line_ends))
+
+        def column(index):
+            return _fixed_width(self.data, field_starts[:, index], field_ends[:, index])
+
+        _, type_column, *metric_columns = self.meta['columns']
+        labels, codes = np.unique(column(type_column), return_inverse=True)
+        metrics = []
+        for index in metric_columns:
+            values = column(index)
+            try:
+                metrics.append(np.where(np.isin(values, _NA_BYTES), b'nan', values).astype(np.float64))
+            except ValueError:
+                return None
+        return [label.decode('utf-8', errors='replace') for label in labels], codes, metrics
+
+    def _parse_keys(self, first, last):
+        types = {}
+        codes = array('i')
+        metrics = [array('d') for _ in METRIC_COLUMNS]
+        for _, equipment_type, *values in self._records(slice(first, last)):
+            codes.append(types.setdefault(equipment_type, len(types)))
+            for column, value in zip(metrics, values):
+                number = _number(value)
+                column.append(np.nan if number is None or isinstance(number, str) else number)
+        return (list(types), np.frombuffer(codes, dtype=np.int32),
+                [np.frombuffer(column, dtype=np.float64) for column in metrics])
+
+
+def _fixed_width(data, starts, ends):
+    # The bytes data[start:end] of every row as one fixed-width bytes array
+    lengths = ends - starts
+    width = max(int(lengths.max()), 1)
+    offsets = np.arange(width)
+    chars = data[np.minimum(starts[:, None] + offsets, len(data) - 1)]
+    chars[offsets >= lengths[:, None]] = 0
+    return np.ascontiguousarray(chars).view(f'S{width}').ravel()
+
+
+def _text(data, span):
+    start, end = int(span[0]), int(span[1])
+    return bytes(data[start:end]).decode('utf-8', errors='replace').rstrip('\r\n')
+
+
+_NA_BYTES = np.array([value.encode() for value in NA_VALUES])
+
+
+def _type(value):
+    # Types the server's parsers read as missing are None, as in its rows
+    return None if value in NA_VALUES else value
+
+
+def _number(value):
+    # Metrics as the server returns them: floats, None when missing; text
+    # that is not a number is shown as it is
+    if value in NA_VALUES:
+        return None
+    try:
+        return float(value)
+    except ValueError:
+        return value
+
+
+class SourceTask(QRunnable):
+    """Runs one row-source call on a worker thread; signals as for ``network.ApiRequest``.
+
+    With ``reporting`` the call also gets ``cancelled`` and ``progress`` keywords.
+    """
+
+    def __init__(self, function, *args, reporting=False):
+        super().__init__()
+        self.setAutoDelete(False)
+        self.function = function
+        self.args = args
+        self.reporting = reporting
+        self.signals = RequestSignals()
+        self._cancelled = threading.Event()
+        self._reported = -1
+
+    def cancel(self):
+        self._cancelled.set()
+
+    def _report(self, done, total):
+        permille = done * 1000 // total if total else 1000
+        if permille != self._reported:
+            self._reported = permille
+            self.signals.progress.emit(done, total)
+
+    def run(self):
+        try:
+            kwargs = {'cancelled': self._cancelled, 'progress': self._report} if self.reporting else {}
+            result = self.function(*self.args, **kwargs)
+            if self._cancelled.is_set():
+                raise RequestCancelled()
+        except RequestCancelled:
+            self.signals.cancelled.emit()
+        except (RowSourceError, OSError, ValueError, KeyError, csv.Error, requests.RequestException) as e:
+            self.signals.failed.emit(str(e))
+        else:
+            self.signals.finished.emit(result)
+        finally:
+            self.signals.done.emit(self)
+
+
+class RowTableModel(QAbstractTableModel):
+    """Lazy table over a row source; see the module docstring.
+
+    ``open()`` counts the rows and ``sort()`` (called by a sorting view)
+    prepares an ordering, both off the GUI thread; ``status`` reports what is
+    happening and ``failed`` any error, for the view to show.
+    """
+    status = pyqtSignal(str)
+    failed = pyqtSignal(str)
+
+    def __init__(self, source, parent=None):
+        super().__init__(parent)
+        self.base_source = self.source = source
+        self.rows = 0
+        self.pages = OrderedDict()
+        self.wanted = []
+        self.in_flight = set()
+        self.failed_pages = set()
+        self.generation = 0
+        self.opened = False
+        self.sort_task = None
+        self.pending_sort = None
+        self.pool = QThreadPool(self)
+        self.pool.setMaxThreadCount(MAX_IN_FLIGHT)
+        self._active = set()
+
+    def _start(self, task, finished, failed=None, progress=None):
+        task.signals.finished.connect(finished)
+        task.signals.failed.connect(failed or self._failed)
+        if progress is not None:
+            task.signals.progress.connect(progress)
+        task.signals.done.connect(self._active.discard)
+        self._active.add(task)
+        self.pool.start(task)
+        return task
+
+    def _failed(self, message):
+        self.status.emit("")
+        self.failed.emit(message)
+
+    def open(self):
+        self.status.emit("Opening...")
+        self._start(SourceTask(self.source.open, reporting=True), self._opened,
+                    progress=lambda done, total: self.status.emit(f"Indexing rows... {done * 100 // total}%"))
+
+    def _opened(self, rows):
+        self.beginResetModel()
+        self.rows = rows
+        self.opened = True
+        self.endResetModel()
+        self.status.emit(f"{rows:,} rows")
+        if self.pending_sort is not None:
+            self.sort(*self.pending_sort)
+
+    def rowCount(self, parent=QModelIndex()):
+        return 0 if parent.isValid() else self.rows
+
+    def columnCount(self, parent=QModelIndex()):
+        return 0 if parent.isValid() else len(COLUMNS)
+
+    def headerData(self, section, orientation, role=Qt.DisplayRole):
+        if role != Qt.DisplayRole:
+            return None
+        return COLUMNS[section] if orientation == Qt.Horizontal else str(section + 1)
+
+    def data(self, index, role=Qt.DisplayRole):
+        if role == Qt.TextAlignmentRole:
+            return int(Qt.AlignRight | Qt.AlignVCenter) if index.column() >= 2 else None
+        if role != Qt.DisplayRole or not index.isValid():
+            return None
+        page, offset = divmod(index.row(), PAGE_SIZE)
+        rows = self.pages.get(page)
+        if rows is None:
+            self._want(page)
+            return "..." if index.column() == 0 else None
+        self.pages.move_to_end(page)
+        value = rows[offset][index.column()] if offset < len(rows) else None
+        return '' if value is None else str(value)
+
+    def _want(self, page):
+        if page in self.in_flight or page in self.failed_pages:
+            return
+        if page in self.wanted:
+            self.wanted.remove(page)
+        self.wanted.append(page)
+        # Pages scrolled past before their turn came are dropped
+        del self.wanted[:-MAX_WANTED]
+        self._pump()
+
+    def _pump(self):
+        while self.wanted and len(self.in_flight) < MAX_IN_FLIGHT:
+            page = self.wanted.pop()
+            self.in_flight.add(page)
+            start = page * PAGE_SIZE
+            task = SourceTask(self.source.fetch, start, min(PAGE_SIZE, self.rows - start))
+            generation = self.generation
+            self._start(task,
+                        lambda rows, page=page, generation=generation: self._loaded(generation, page, rows),
+                        lambda message, page=page, generation=generation: self._load_failed(generation, page, message))
+
+    def _loaded(self, generation, page, rows):
+        if generation != self.generation:
+            return
+        self.in_flight.discard(page)
+        self.pages[page] = rows
+        while len(self.pages) > MAX_PAGES:
+            self.pages.popitem(last=False)
+        first = page * PAGE_SIZE
+        self.dataChanged.emit(self.index(first, 0),
+                              self.index(min(first + PAGE_SIZE, self.rows) - 1, len(COLUMNS) - 1))
+        self._pump()
+
+    def _load_failed(self, generation, page, message):
+        if generation != self.generation:
+            return
+        # Not asked for again until the next sort, so a dead server is not polled on every repaint
+        self.in_flight.discard(page)
+        self.failed_pages.add(page)
+        self.failed.emit(message)
+        self._pump()
+
+    def sort(self, column, order=Qt.AscendingOrder):
+        if not self.opened:
+            # A sorting view sorts as soon as it gets the model
+            self.pending_sort = (column, order)
+            return
+        self.pending_sort = None
+        field = SORT_FIELDS.get(column)
+        if field is None and self.source is self.base_source and self.sort_task is None:
+            return
+        if self.sort_task is not None:
+            self.sort_task.cancel()
+        self.status.emit("Sorting...")
+        self.sort_task = self._start(
+            SourceTask(self.base_source.ordered, field, field is not None and order == Qt.DescendingOrder,
+                       reporting=True),
+            self._sorted,
+            progress=lambda done, total: self.status.emit(f"Preparing sort keys... {done * 100 // total}%"),
+        )
+
+    def _sorted(self, source):
+        self.sort_task = None
+        self.layoutAboutToBeChanged.emit()
+        self.source = source
+        self.generation += 1
+        self.pages.clear()
+        self.wanted.clear()
+        self.in_flight.clear()
+        self.failed_pages.clear()
+        self.layoutChanged.emit()
+        self.status.emit(f"{self.rows:,} rows")
+
+    def shutdown(self, wait_ms=3000):
+        self.pool.clear()
+        for task in list(self._active):
+            task.cancel()
+        self.pool.waitForDone(wait_ms)
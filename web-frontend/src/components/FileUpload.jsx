@@ -1,10 +1,55 @@
 import React, { useState } from 'react';
 import axios from 'axios';
 
+const API_URL = 'http://127.0.0.1:8000/api';
+// Files above this size go through the chunked, resumable protocol
+const CHUNKED_THRESHOLD = 8 * 1024 * 1024;
+// .csv.gz / .csv.zst files are decompressed by the server, and are posted whole
+const COMPRESSED = /\.(gz|zst)$/i;
+
+// An unfinished chunked upload is remembered per file, so picking the same
+// file again after a failure or a reload resumes where it stopped
+const resumeKey = (file) => `chunked-upload:${file.name}:${file.size}:${file.lastModified}`;
+
+const startChunkedUpload = async (file) => {
+  const savedId = localStorage.getItem(resumeKey(file));
+  if (savedId) {
+    try {
+      const response = await axios.get(`${API_URL}/upload/chunked/${savedId}/`);
+      if (response.data.status === 'receiving') {
+        return response.data;
+      }
+    } catch (err) {
+      // Expired or discarded: start over
+    }
+  }
+  const response = await axios.post(`${API_URL}/upload/chunked/`, { filename: file.name });
+  localStorage.setItem(resumeKey(file), response.data.id);
+  return response.data;
+};
+
+const uploadChunked = async (file, onProgress) => {
+  const upload = await startChunkedUpload(file);
+  const chunkSize = upload.chunk_size;
+  const chunks = Math.ceil(file.size / chunkSize);
+  for (let index = upload.next_chunk; index < chunks; index++) {
+    const start = index * chunkSize;
+    await axios.put(`${API_URL}/upload/chunked/${upload.id}/chunks/${index}/`,
+      file.slice(start, start + chunkSize), {
+        headers: { 'Content-Type': 'application/octet-stream' },
+      });
+    onProgress(Math.min(start + chunkSize, file.size) / file.size);
+  }
+  const response = await axios.post(`${API_URL}/upload/chunked/${upload.id}/complete/`);
+  localStorage.removeItem(resumeKey(file));
+  return response;
+};
+
 const FileUpload = ({ onUploadSuccess }) => {
   const [file, setFile] = useState(null);
   const [error, setError] = useState('');
   const [loading, setLoading] = useState(false);
+  const [progress, setProgress] = useState(null);
 
   // Handle file selection
   const handleFileChange = (e) => {
@@ -20,17 +65,22 @@ const FileUpload = ({ onUploadSuccess }) => {
       return;
     }
 
-    const formData = new FormData();
-    formData.append('file', file);
-
     setLoading(true);
     try {
-      // POST request to Django backend
-      const response = await axios.post('http://127.0.0.1:8000/api/upload/', formData, {
-        headers: {
-          'Content-Type': 'multipart/form-data',
-        },
-      });
+      let response;
+      if (file.size > CHUNKED_THRESHOLD && !COMPRESSED.test(file.name)) {
+        setProgress(0);
+        response = await uploadChunked(file, setProgress);
+      } else {
+        const formData = new FormData();
+        formData.append('file', file);
+        // POST request to Django backend
+        response = await axios.post(`${API_URL}/upload/`, formData, {
+          headers: {
+            'Content-Type': 'multipart/form-data',
+          },
+        });
+      }
       // Pass the response data (statistics) up to the parent component
       onUploadSuccess(response.data);
     } catch (err) {
@@ -38,6 +88,7 @@ const FileUpload = ({ onUploadSuccess }) => {
       setError('Upload failed. Please check the file and try again.');
     } finally {
       setLoading(false);
+      setProgress(null);
     }
   };
 
@@ -51,7 +102,7 @@ const FileUpload = ({ onUploadSuccess }) => {
            {file ? file.name : "Select CSV Dataset"}
            <input 
              type="file" 
-             accept=".csv" 
+             accept=".csv,.gz,.zst" 
              onChange={handleFileChange} 
              style={styles.hiddenInput}
            />
@@ -66,7 +117,9 @@ const FileUpload = ({ onUploadSuccess }) => {
             cursor: loading ? 'not-allowed' : 'pointer'
           }}
         >
-          {loading ? 'PROCESSING...' : 'INITIALIZE ANALYTICS'}
+          {loading
+            ? (progress !== null ? `UPLOADING ${Math.floor(progress * 100)}%` : 'PROCESSING...')
+            : 'INITIALIZE ANALYTICS'}
         </button>
       </form>
       {error && <p style={styles.error}>{error}</p>}